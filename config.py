@@ -1,7 +1,7 @@
 import os
 
 
-LOG_DIR = "./logs"
+LOG_DIR = os.environ.get("IOT_LOG_DIR", "./logs")
 
 
 # 设备信息
@@ -10,3 +10,71 @@ DEVICE_INFO_DB = os.path.join(LOG_DIR, "device_info.db")
 # 设备配置
 SENSOR_CONFIG_DB = os.path.join(LOG_DIR, "sensor_config.db")
 
+# 数据库线程池大小，异步接口通过该线程池调用同步的 DAO 函数，设为 0 则直接在事件循环中调用
+DB_EXECUTOR_WORKERS = int(os.environ.get("IOT_DB_EXECUTOR_WORKERS", 8))
+
+# 设备查询缓存（按 MAC 地址缓存 get_device_by_mac 的结果）
+DEVICE_CACHE_SIZE = int(os.environ.get("IOT_DEVICE_CACHE_SIZE", 10000))
+DEVICE_CACHE_TTL = float(os.environ.get("IOT_DEVICE_CACHE_TTL", 60))
+
+# MAC 地址规范化结果的缓存条数，心跳、遥测等入口反复规范化同一批设备的 MAC 地址
+MAC_CACHE_SIZE = int(os.environ.get("IOT_MAC_CACHE_SIZE", 16384))
+
+# 设备遥测数据
+TELEMETRY_DB = os.path.join(LOG_DIR, "telemetry.db")
+
+# 报警默认回差：超过上限后需要回落到 上限-回差 以下才解除报警（下限同理），可在设备 config_data 中用 alarm_hysteresis 覆盖
+ALARM_HYSTERESIS = float(os.environ.get("IOT_ALARM_HYSTERESIS", 0.5))
+
+# MQTT 桥接：为空则不启动；订阅 {MQTT_TOPIC_PREFIX}/+/# 下的设备状态和遥测数据
+MQTT_BROKER = os.environ.get("IOT_MQTT_BROKER", "")
+MQTT_PORT = int(os.environ.get("IOT_MQTT_PORT", 1883))
+MQTT_TOPIC_PREFIX = os.environ.get("IOT_MQTT_TOPIC_PREFIX", "txkj")
+MQTT_CLIENT_ID = os.environ.get("IOT_MQTT_CLIENT_ID", "iot-server")
+# 发布连接池大小，同一主题总是使用同一个连接以保证顺序
+MQTT_PUBLISHER_POOL_SIZE = int(os.environ.get("IOT_MQTT_PUBLISHER_POOL_SIZE", 2))
+# 收到的消息攒够 MQTT_BATCH_SIZE 条或每隔 MQTT_FLUSH_INTERVAL 秒批量写入数据库
+MQTT_BATCH_SIZE = int(os.environ.get("IOT_MQTT_BATCH_SIZE", 1000))
+MQTT_FLUSH_INTERVAL = float(os.environ.get("IOT_MQTT_FLUSH_INTERVAL", 0.5))
+
+# Home Assistant 自动发现：已发布的 discovery 配置摘要，用于只发布变化的部分
+HA_DISCOVERY_DB = os.path.join(LOG_DIR, "ha_discovery.db")
+HA_DISCOVERY_PREFIX = os.environ.get("IOT_HA_DISCOVERY_PREFIX", "homeassistant")
+
+# 设备变更事件缓冲区大小，断线的客户端在缓冲区范围内可以续传，超出后需要重新全量加载
+EVENT_BUFFER_SIZE = int(os.environ.get("IOT_EVENT_BUFFER_SIZE", 10000))
+
+# 心跳在线检测：超过 report_interval（未配置时为 LIVENESS_DEFAULT_INTERVAL 秒）的 LIVENESS_TIMEOUT_FACTOR 倍没有心跳判定为离线
+LIVENESS_DEFAULT_INTERVAL = int(os.environ.get("IOT_LIVENESS_DEFAULT_INTERVAL", 60))
+LIVENESS_TIMEOUT_FACTOR = float(os.environ.get("IOT_LIVENESS_TIMEOUT_FACTOR", 2.0))
+# 心跳检测最多跟踪的设备数，只接受已登记设备的心跳，超出后新设备的心跳被拒绝
+LIVENESS_MAX_DEVICES = int(os.environ.get("IOT_LIVENESS_MAX_DEVICES", 100000))
+
+# 设备状态写后缓冲：开启后状态更新先在内存中按 MAC 合并为最新值，每隔 STATUS_FLUSH_INTERVAL 秒或攒够 STATUS_FLUSH_SIZE 个设备时在一个事务中写入
+STATUS_WRITE_BEHIND = os.environ.get("IOT_STATUS_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+STATUS_FLUSH_INTERVAL = float(os.environ.get("IOT_STATUS_FLUSH_INTERVAL", 0.2))
+STATUS_FLUSH_SIZE = int(os.environ.get("IOT_STATUS_FLUSH_SIZE", 1000))
+
+# 多进程部署：IOT_CLUSTER=1 时第一个拿到 LOG_DIR/cluster.lock 的 worker 成为主进程，独占数据库写入和 MQTT、心跳检测等后台任务，
+# 其它 worker 通过 LOG_DIR/cluster.sock 把写操作转发给主进程，缓存失效和变更事件由主进程广播
+CLUSTER_ENABLED = os.environ.get("IOT_CLUSTER", "0").lower() in ("1", "true", "yes")
+# 配置后通过 Redis 发布/订阅广播缓存失效，否则由主进程通过 cluster.sock 直接推送给各 worker
+CLUSTER_REDIS_URL = os.environ.get("IOT_REDIS_URL", "")
+CLUSTER_REDIS_CHANNEL = os.environ.get("IOT_REDIS_CHANNEL", "iot_device_info:cluster")
+CLUSTER_AUTHKEY = os.environ.get("IOT_CLUSTER_AUTHKEY", "iot-device-info").encode("utf-8")
+# 读操作等待本进程追上主进程广播的最长时间（秒），超时则丢弃本地缓存直接读数据库
+CLUSTER_SYNC_TIMEOUT = float(os.environ.get("IOT_CLUSTER_SYNC_TIMEOUT", 1.0))
+
+# Prometheus 指标（/metrics）：请求延迟、数据库查询耗时、连接池等待和缓存命中率，设为 0 则不安装任何统计钩子
+METRICS_ENABLED = os.environ.get("IOT_METRICS", "1").lower() in ("1", "true", "yes")
+
+# 日志：JSON 格式，经队列由后台线程写到 stderr；成功请求的访问日志按 LOG_SAMPLE_RATE 采样，
+# 同一错误每 LOG_RATE_WINDOW 秒最多输出 LOG_RATE_LIMIT 条
+LOG_LEVEL = os.environ.get("IOT_LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("IOT_LOG_SAMPLE_RATE", 0.01))
+LOG_RATE_LIMIT = int(os.environ.get("IOT_LOG_RATE_LIMIT", 5))
+LOG_RATE_WINDOW = float(os.environ.get("IOT_LOG_RATE_WINDOW", 60))
+LOG_QUEUE_SIZE = int(os.environ.get("IOT_LOG_QUEUE_SIZE", 10000))
+
+# 设备批量导入：每读满 IMPORT_CHUNK_SIZE 行校验后在一个事务中写入，并记录断点供中断后续传
+IMPORT_CHUNK_SIZE = int(os.environ.get("IOT_IMPORT_CHUNK_SIZE", 1000))
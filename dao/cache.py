@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from collections import OrderedDict
+from utils.metrics import registry
+
+class LRUCache:
+    """线程安全的 LRU + TTL 缓存
+
+    DAO 函数在线程池中执行，所以所有操作都加锁。
+    为避免“读到旧数据 -> 写入并失效 -> 旧数据回填”的竞争，回填时需要带上读之前取得的
+    generation，期间只要 key 所在的分片发生过失效，本次回填就会被丢弃。
+    generation 按 key 的哈希分成 shards 个分片，失效一个设备只影响同一分片中并发的回填，
+    不会让所有正在进行的回填都作废。
+    """
+
+    def __init__(self, maxsize=10000, ttl=60, shards=256):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generations = [0] * shards
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """读取缓存
+
+        Returns:
+            (bool, object, int): 是否命中、缓存的值、key 所在分片当前的 generation（未命中时用于 set）
+        """
+        shard = hash(key) % len(self._generations)
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expire_at = item
+                if expire_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value, self._generations[shard]
+                del self._data[key]
+            self.misses += 1
+            return False, None, self._generations[shard]
+
+    def set(self, key, value, generation):
+        """回填缓存，generation 已过期（期间同一分片有失效）时放弃回填"""
+        shard = hash(key) % len(self._generations)
+        with self._lock:
+            if generation != self._generations[shard]:
+                return
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        """失效指定的 key"""
+        with self._lock:
+            for key in keys:
+                self._generations[hash(key) % len(self._generations)] += 1
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._generations = [generation + 1 for generation in self._generations]
+            self._data.clear()
+
+    def stats(self):
+        """缓存统计信息，用于评估缓存大小"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+# 缓存统计导出到 /metrics 时的指标名和类型
+_CACHE_METRICS = (
+    ("hits", "iot_cache_hits_total", "counter", "缓存命中次数"),
+    ("misses", "iot_cache_misses_total", "counter", "缓存未命中次数"),
+    ("evictions", "iot_cache_evictions_total", "counter", "超出容量被淘汰的条目数"),
+    ("invalidations", "iot_cache_invalidations_total", "counter", "写操作失效的条目数"),
+    ("size", "iot_cache_entries", "gauge", "当前缓存的条目数"),
+    ("hit_ratio", "iot_cache_hit_ratio", "gauge", "启动以来的缓存命中率"),
+)
+
+def export_cache_metrics(cache_name, cache):
+    """把缓存的命中/未命中等统计登记到 /metrics，导出时才读取 stats()"""
+    for key, metric_name, kind, documentation in _CACHE_METRICS:
+        registry.add_callback(metric_name, documentation, kind, ("cache",),
+                              lambda key=key: {(cache_name,): cache.stats()[key]})
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import mmap
+import time
+import fcntl
+import queue
+import random
+import struct
+import functools
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client
+from config import LOG_DIR, CLUSTER_ENABLED, CLUSTER_REDIS_URL, CLUSTER_REDIS_CHANNEL, CLUSTER_AUTHKEY, CLUSTER_SYNC_TIMEOUT
+from utils.lazy_import import lazy_import
+from utils.log import get_logger
+from dao.database import DuplicateError
+
+logger = get_logger("dao.cluster")
+
+redis = lazy_import("redis")
+
+CLUSTER_LOCK = os.path.abspath(os.path.join(LOG_DIR, "cluster.lock"))
+CLUSTER_SOCKET = os.path.abspath(os.path.join(LOG_DIR, "cluster.sock"))
+CLUSTER_SHM = os.path.abspath(os.path.join(LOG_DIR, "cluster.shm"))
+
+# 副本进程连接主进程的最长等待时间（秒），覆盖多个 worker 同时启动、主进程还没开始监听的情况
+CONNECT_TIMEOUT = 10.0
+
+
+class ClusterError(RuntimeError):
+    """主进程不可用或与主进程的连接中断"""
+
+
+# 除内置异常外可以原样传回副本进程的项目异常，副本进程导入的是同一份代码，能够还原
+_PORTABLE_EXCEPTIONS = (DuplicateError,)
+
+
+# 任务名 -> (函数, 是否在写线程中串行执行)
+_tasks = {}
+
+def _register(func, serialize):
+    name = f"{func.__module__}.{func.__qualname__}"
+    _tasks[name] = (func, serialize)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        role = cluster.role
+        if role == "replica":
+            return cluster.call(name, args, kwargs)
+        if role == "primary" and serialize:
+            return cluster.submit(func, args, kwargs)
+        return func(*args, **kwargs)
+    return wrapper
+
+def writer_task(func):
+    """写数据库的函数：多进程部署时只在主进程的写线程中串行执行，副本进程转发给主进程
+
+    参数和返回值需要能被 pickle，单进程部署时直接调用
+    """
+    return _register(func, serialize=True)
+
+def primary_task(func):
+    """依赖主进程内存状态的函数（心跳检测、报警状态、MQTT 统计等）：副本进程转发给主进程，不经过写线程"""
+    return _register(func, serialize=False)
+
+
+class _SharedVersion:
+    """主进程的 (epoch, 广播版本号)，放在共享内存文件中，各 worker 读取时不需要任何通信"""
+
+    _FORMAT = struct.Struct("<QQ")
+
+    def __init__(self, path, create):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if create:
+                os.ftruncate(fd, self._FORMAT.size)
+            self._map = mmap.mmap(fd, self._FORMAT.size)
+        finally:
+            os.close(fd)
+
+    def read(self):
+        return self._FORMAT.unpack_from(self._map, 0)
+
+    def write(self, epoch, version):
+        self._FORMAT.pack_into(self._map, 0, epoch, version)
+
+    def write_version(self, version):
+        struct.pack_into("<Q", self._map, 8, version)
+
+    def close(self):
+        self._map.close()
+
+
+def _connect_primary(kind, timeout=CONNECT_TIMEOUT):
+    """连接主进程的 cluster.sock，kind 为 rpc 或 subscribe"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = Client(CLUSTER_SOCKET, family="AF_UNIX", authkey=CLUSTER_AUTHKEY)
+            conn.send((kind, os.getpid()))
+            return conn
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            if time.monotonic() > deadline:
+                raise ClusterError(f"主进程不可用: {e}") from e
+            time.sleep(0.1)
+
+
+class _LocalSubscriber:
+    """主进程中的一个订阅连接，由单独的线程发送，慢的副本进程不会阻塞写线程"""
+
+    def __init__(self, conn, on_close):
+        self.conn = conn
+        self._on_close = on_close
+        self._queue = queue.SimpleQueue()
+        threading.Thread(target=self._run, name="cluster-feed", daemon=True).start()
+
+    def put(self, message):
+        self._queue.put(message)
+
+    def close(self):
+        self._queue.put(None)
+
+    def _run(self):
+        try:
+            while True:
+                message = self._queue.get()
+                if message is None:
+                    break
+                self.conn.send(message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.conn.close()
+            self._on_close(self)
+
+
+class _LocalFeed:
+    """副本进程通过 cluster.sock 接收主进程推送的广播"""
+
+    def __init__(self):
+        self.conn = _connect_primary("subscribe")
+        if self.conn.recv() != "ok":
+            raise ClusterError("订阅主进程广播失败")
+
+    def recv(self, timeout=1.0):
+        if self.conn.poll(timeout):
+            return self.conn.recv()
+        return None
+
+    def close(self):
+        self.conn.close()
+
+
+class _RedisFeed:
+    """副本进程通过 Redis 发布/订阅接收主进程的广播"""
+
+    def __init__(self):
+        self.pubsub = redis.Redis.from_url(CLUSTER_REDIS_URL).pubsub()
+        self.pubsub.subscribe(CLUSTER_REDIS_CHANNEL)
+        # 等到订阅生效再握手，握手之后的广播都不会漏掉
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            message = self.pubsub.get_message(timeout=1.0)
+            if message is not None and message["type"] == "subscribe":
+                break
+            if time.monotonic() > deadline:
+                raise ClusterError("订阅 Redis 频道超时")
+
+    def recv(self, timeout=1.0):
+        message = self.pubsub.get_message(timeout=timeout)
+        if message is None or message["type"] != "message":
+            return None
+        return tuple(json.loads(message["data"]))
+
+    def close(self):
+        self.pubsub.close()
+
+
+class Cluster:
+    """多进程部署的协调
+
+    - role 为 None 时是单进程部署，所有函数在本进程直接执行（默认）
+    - primary 主进程：在一个写线程中串行执行所有 writer_task，副本进程的写操作通过 cluster.sock 转发过来，
+      SQLite 同一时间只有一个写入者，不会出现 database is locked；MQTT、心跳检测等后台任务也只在主进程运行
+    - replica 副本进程：只处理 HTTP 请求，读操作直接读数据库和本地缓存
+
+    主进程的每次缓存失效、变更事件都通过 broadcast() 按递增的版本号广播（Redis 或 cluster.sock），
+    并把最新版本号写入共享内存。副本进程按顺序应用广播，读缓存之前调用 sync() 等到本进程追上共享内存中的
+    版本号，所以任何 worker 写入成功之后，所有 worker 都能读到新值。
+    """
+
+    def __init__(self):
+        self.role = None
+        self.resets = 0
+        self._handlers = {}         # 广播类型 -> 副本进程中的处理函数
+        self._reset_handlers = []
+        self._states = {}           # 名称 -> (主进程 getter, 副本进程 setter)，握手时同步
+        self._lock_fd = None
+        self._shared = None
+        self._stopping = threading.Event()
+        # 主进程
+        self._epoch = 0
+        self._version = 0
+        self._broadcast_lock = threading.Lock()
+        self._listener = None
+        self._subscribers = set()
+        self._redis = None
+        self._queue = queue.SimpleQueue()
+        self._writer_lock = threading.Lock()
+        self._writer_thread = None
+        # 副本进程
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._connected = False
+        self._applied_epoch = 0
+        self._applied = 0
+        self._follow_thread = None
+
+    # ---------- 注册 ----------
+
+    def subscribe(self, kind, handler):
+        """注册副本进程中某类广播的处理函数，参数为广播的内容"""
+        self._handlers[kind] = handler
+
+    def on_reset(self, handler):
+        """注册副本进程丢失广播（与主进程断开、主进程重启等）时的处理函数，用于丢弃本地缓存"""
+        self._reset_handlers.append(handler)
+
+    def register_state(self, name, getter, setter):
+        """副本进程连上主进程时，用主进程 getter() 的结果调用本进程的 setter()"""
+        self._states[name] = (getter, setter)
+
+    # ---------- 启动和停止 ----------
+
+    def start(self, enabled=CLUSTER_ENABLED):
+        """确定本进程的角色并启动，返回 None（单进程）、primary 或 replica"""
+        if not enabled:
+            return None
+        self._stopping.clear()
+        self._lock_fd = os.open(CLUSTER_LOCK, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._start_replica()
+        else:
+            self._start_primary()
+        return self.role
+
+    def _start_primary(self):
+        self._epoch = random.getrandbits(63) or 1
+        self._version = 0
+        self._shared = _SharedVersion(CLUSTER_SHM, create=True)
+        self._shared.write(self._epoch, 0)
+        if CLUSTER_REDIS_URL:
+            self._redis = redis.Redis.from_url(CLUSTER_REDIS_URL)
+        self._writer_thread = threading.Thread(target=self._write_loop, name="cluster-writer", daemon=True)
+        self._writer_thread.start()
+        # 上一个主进程留下的 socket 文件
+        if os.path.exists(CLUSTER_SOCKET):
+            os.unlink(CLUSTER_SOCKET)
+        self._listener = Listener(CLUSTER_SOCKET, family="AF_UNIX", authkey=CLUSTER_AUTHKEY)
+        os.chmod(CLUSTER_SOCKET, 0o600)
+        self.role = "primary"
+        threading.Thread(target=self._accept_loop, name="cluster-accept", daemon=True).start()
+
+    def _start_replica(self):
+        self.role = "replica"
+        self._follow_thread = threading.Thread(target=self._follow_loop, name="cluster-follow", daemon=True)
+        self._follow_thread.start()
+
+    def stop(self):
+        """停止后台线程并释放主进程锁，角色保持不变"""
+        self._stopping.set()
+        if self.role == "primary":
+            self._listener.close()
+            with self._broadcast_lock:
+                for subscriber in list(self._subscribers):
+                    subscriber.close()
+            with self._writer_lock:
+                writer_thread, self._writer_thread = self._writer_thread, None
+                self._queue.put(None)
+            writer_thread.join()
+        elif self.role == "replica" and self._follow_thread is not None:
+            self._follow_thread.join()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    # ---------- 主进程 ----------
+
+    def submit(self, func, args, kwargs):
+        """在写线程中执行 func 并等待结果，写线程自己调用或写线程已停止时直接执行"""
+        with self._writer_lock:
+            writer_thread = self._writer_thread
+            if writer_thread is not None and threading.current_thread() is not writer_thread:
+                future = Future()
+                self._queue.put((future, func, args, kwargs))
+            else:
+                future = None
+        if future is None:
+            return func(*args, **kwargs)
+        return future.result()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, func, args, kwargs = item
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _accept_loop(self):
+        while not self._stopping.is_set():
+            try:
+                conn = self._listener.accept()
+            except Exception:
+                # 监听已关闭，或者连接认证失败
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name="cluster-rpc", daemon=True).start()
+
+    def _serve(self, conn):
+        """处理一个副本进程连接：订阅广播，或者逐个执行转发过来的函数"""
+        try:
+            kind, worker_pid = conn.recv()
+            if kind == "subscribe":
+                with self._broadcast_lock:
+                    subscriber = _LocalSubscriber(conn, self._remove_subscriber)
+                    subscriber.put("ok")
+                    self._subscribers.add(subscriber)
+                return
+            while True:
+                name, args, kwargs = conn.recv()
+                try:
+                    func, serialize = _tasks[name]
+                    value = self.submit(func, args, kwargs) if serialize else func(*args, **kwargs)
+                    reply = (True, value)
+                except Exception as e:
+                    # 副本进程不一定能还原第三方库的异常，只原样传回内置异常和项目异常
+                    if type(e).__module__ != "builtins" and not isinstance(e, _PORTABLE_EXCEPTIONS):
+                        e = RuntimeError(f"{type(e).__name__}: {e}")
+                    reply = (False, e)
+                try:
+                    conn.send(reply)
+                except Exception as e:
+                    conn.send((False, RuntimeError(f"返回值无法序列化: {e}")))
+        except (EOFError, OSError):
+            conn.close()
+
+    def _remove_subscriber(self, subscriber):
+        with self._broadcast_lock:
+            self._subscribers.discard(subscriber)
+
+    def broadcast(self, kind, payload):
+        """主进程广播一次变化，副本进程按版本号顺序交给 subscribe() 注册的处理函数；其它角色下不做任何事
+
+        payload 需要能被 JSON 序列化（使用 Redis 时）
+        """
+        if self.role != "primary":
+            return
+        with self._broadcast_lock:
+            self._version += 1
+            message = (self._epoch, self._version, kind, payload)
+            if self._redis is not None:
+                try:
+                    self._redis.publish(CLUSTER_REDIS_CHANNEL, json.dumps(message, ensure_ascii=False))
+                except Exception:
+                    # 副本进程会从版本号的缺口发现丢失的广播并丢弃本地缓存
+                    logger.exception("广播发布到 Redis 失败", extra={"kind": kind})
+            for subscriber in self._subscribers:
+                subscriber.put(message)
+            self._shared.write_version(self._version)
+
+    def _state(self):
+        with self._broadcast_lock:
+            return self._epoch, self._version, {name: getter() for name, (getter, _) in self._states.items()}
+
+    # ---------- 副本进程 ----------
+
+    def call(self, name, args, kwargs):
+        """把函数转发给主进程执行并返回结果，主进程抛出的异常在本进程重新抛出"""
+        conn = getattr(self._local, "conn", None)
+        # 空闲的连接可读说明主进程已经关闭了它（主进程重启过）
+        if conn is not None and conn.poll():
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = self._local.conn = _connect_primary("rpc")
+        try:
+            conn.send((name, args, kwargs))
+            ok, value = conn.recv()
+        except (EOFError, OSError) as e:
+            self._local.conn = None
+            conn.close()
+            raise ClusterError(f"与主进程的连接中断，操作结果未知: {e}") from e
+        if not ok:
+            raise value
+        return value
+
+    def sync(self, timeout=CLUSTER_SYNC_TIMEOUT):
+        """副本进程读本地缓存之前调用：等待本进程应用完主进程到目前为止的全部广播
+
+        Returns:
+            bool: 本地缓存是否可信；与主进程断开或等待超时时返回 False，调用方应直接读数据库且不回填缓存
+        """
+        if self.role != "replica":
+            return True
+        if not self._connected:
+            return False
+        epoch, version = self._shared.read()
+        if self._applied_epoch == epoch and self._applied >= version:
+            return True
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._connected and self._applied_epoch == epoch and self._applied >= version, timeout
+            )
+
+    def _follow_loop(self):
+        """订阅主进程的广播，断开后重新连接并重新握手"""
+        while not self._stopping.is_set():
+            feed = None
+            try:
+                feed = _RedisFeed() if CLUSTER_REDIS_URL else _LocalFeed()
+                epoch, version, states = _cluster_state()
+                with self._cond:
+                    self._reset()
+                    for name, value in states.items():
+                        self._states[name][1](value)
+                    if self._shared is None:
+                        self._shared = _SharedVersion(CLUSTER_SHM, create=False)
+                    self._applied_epoch, self._applied = epoch, version
+                    self._connected = True
+                    self._cond.notify_all()
+                while not self._stopping.is_set():
+                    message = feed.recv()
+                    if message is not None:
+                        self._apply(*message)
+            except Exception as e:
+                if not self._stopping.is_set():
+                    logger.warning("与主进程的广播连接中断，稍后重连: %s: %s", type(e).__name__, e)
+            finally:
+                if feed is not None:
+                    feed.close()
+                with self._cond:
+                    if self._connected:
+                        self._connected = False
+                        self._reset()
+            self._stopping.wait(0.5)
+
+    def _apply(self, epoch, version, kind, payload):
+        with self._cond:
+            if epoch != self._applied_epoch:
+                raise ClusterError("主进程已经切换")
+            if version <= self._applied:
+                # 握手之前已经包含在主进程状态中的广播
+                return
+            if version != self._applied + 1:
+                # 丢失了中间的广播（例如 Redis 订阅短暂断开），本地缓存全部作废
+                self._reset()
+            handler = self._handlers.get(kind)
+            if handler is not None:
+                try:
+                    handler(payload)
+                except Exception:
+                    logger.exception("广播处理失败", extra={"kind": kind})
+            self._applied = version
+            self._cond.notify_all()
+
+    def _reset(self):
+        self.resets += 1
+        for handler in self._reset_handlers:
+            try:
+                handler()
+            except Exception:
+                logger.exception("本地缓存重置失败")
+
+    def stats(self):
+        stats = {"role": self.role, "pid": os.getpid()}
+        if self.role == "primary":
+            stats.update(epoch=self._epoch, version=self._version, subscribers=len(self._subscribers),
+                         redis=self._redis is not None)
+        elif self.role == "replica":
+            stats.update(epoch=self._applied_epoch, version=self._applied, connected=self._connected,
+                         resets=self.resets, redis=bool(CLUSTER_REDIS_URL))
+        return stats
+
+# 每个进程一个实例，服务启动时调用 cluster.start()
+cluster = Cluster()
+
+@primary_task
+def _cluster_state():
+    """副本进程握手：主进程当前的 epoch、广播版本号和 register_state() 注册的状态"""
+    return cluster._state()
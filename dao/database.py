@@ -1,24 +1,173 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from sqlalchemy import create_engine as sa_create_engine
+import os
+import sys
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine as sa_create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
+from config import METRICS_ENABLED
+from utils.metrics import registry
+
+
+class DuplicateError(ValueError):
+    """要写入的记录违反唯一约束（已经存在）
+
+    DAO 捕获 IntegrityError 后抛出；多进程部署时副本进程转发的写操作抛出该异常会原样传回，
+    调用方不需要区分单进程和多进程部署
+    """
+
+# SQLite 连接建立时执行的 PRAGMA
+# WAL 允许读写并发，synchronous=NORMAL 在 WAL 下只在 checkpoint 时 fsync，
+# busy_timeout 让写锁冲突时等待而不是立即报 database is locked
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 268435456,     # 256MB
+    "cache_size": -65536,       # 负数单位为 KB，即 64MB
+    "busy_timeout": 5000,       # 毫秒
+    "temp_store": "MEMORY",
+}
+
+_session_factories = {}
+_session_factories_lock = threading.Lock()
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """新建 SQLite 连接时设置 PRAGMA"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+# 数据库指标，标签 db 为数据库文件名，function 为执行查询的 DAO 函数
+DB_QUERY_SECONDS = registry.histogram(
+    "iot_db_query_duration_seconds", "每条 SQL（executemany 算一条）的执行耗时", ("db", "function")
+)
+DB_POOL_WAIT_SECONDS = registry.histogram(
+    "iot_db_pool_checkout_wait_seconds", "从连接池取连接的等待耗时（包括新建连接）", ("db",)
+)
+_instrumented_engines = {}
+
+# 代码对象 -> DAO 函数标签（不是 DAO 函数时为 None），每个代码对象只判断一次
+_function_labels = {}
+_NOT_DAO_MODULES = ("dao.database", "dao.cluster")
+
+def _dao_function():
+    """沿调用栈向上找到最近的公开 DAO 函数，例如 device_info.get_device_by_mac（跳过 _ 开头的内部函数）"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        try:
+            label = _function_labels[code]
+        except KeyError:
+            module = frame.f_globals.get("__name__", "")
+            if module.startswith("dao.") and module not in _NOT_DAO_MODULES and not code.co_name.startswith(("<", "_")):
+                label = f"{module[4:]}.{code.co_name}"
+            else:
+                label = None
+            _function_labels[code] = label
+        if label is not None:
+            return label
+        frame = frame.f_back
+    return "other"
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+class _TimedQueuePool(QueuePool):
+    """记录取连接等待时间的 QueuePool"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT_SECONDS.observe((getattr(self, "_metrics_db", ""),), time.perf_counter() - start)
+
+def _instrument_engine(engine, db_name):
+    """安装查询耗时的事件钩子，并登记连接池供 /metrics 导出占用情况"""
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_metrics_start", None)
+        if start is not None:
+            DB_QUERY_SECONDS.observe((db_name, _dao_function()), time.perf_counter() - start)
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    engine.pool._metrics_db = db_name
+    _instrumented_engines[db_name] = engine
+
+def _pool_stats(method):
+    return lambda: {(db_name,): getattr(engine.pool, method)() for db_name, engine in _instrumented_engines.items()}
+
+registry.add_callback("iot_db_pool_checked_out", "连接池中正在使用的连接数", "gauge", ("db",), _pool_stats("checkedout"))
+registry.add_callback("iot_db_pool_overflow", "连接池超出 pool_size 的连接数（负数表示还可以新建的连接数）", "gauge", ("db",), _pool_stats("overflow"))
 
 def create_db_engine(db_path):
-    """创建数据库引擎"""
+    """创建数据库引擎
+
+    本地 SQLite 文件不会出现断开的连接，所以不需要 pool_pre_ping / pool_recycle，
+    省掉每次取连接时的探活查询
+    """
     database_url = f"sqlite:///{db_path}"
-    return sa_create_engine(
+    engine = sa_create_engine(
         database_url,
-        poolclass=QueuePool,
+        poolclass=_TimedQueuePool if METRICS_ENABLED else QueuePool,
         pool_size=5,
         max_overflow=10,
         pool_timeout=30,
-        pool_pre_ping=True,
-        pool_recycle=3600
+        connect_args={"check_same_thread": False}
     )
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    if METRICS_ENABLED:
+        _instrument_engine(engine, os.path.basename(db_path))
+    return engine
+
+@contextmanager
+def schema_lock(db_path):
+    """建表、建索引时持有的文件锁，多个 worker 进程同时启动时依次执行，避免 table already exists"""
+    with open(f"{db_path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def get_session_factory(engine):
+    """获取引擎对应的 sessionmaker，每个引擎只创建一次"""
+    factory = _session_factories.get(engine)
+    if factory is None:
+        with _session_factories_lock:
+            factory = _session_factories.get(engine)
+            if factory is None:
+                factory = sessionmaker(bind=engine)
+                _session_factories[engine] = factory
+    return factory
 
 def get_session(engine):
     """获取数据库会话"""
-    Session = sessionmaker(bind=engine)
-    return Session()
\ No newline at end of file
+    return get_session_factory(engine)()
+
+@contextmanager
+def session_scope(engine):
+    """工作单元：正常结束时提交，出现异常时回滚并重新抛出，最后关闭会话
+
+    示例:
+        with session_scope(engine_device) as session:
+            session.add(device)
+    """
+    session = get_session(engine)
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -1,14 +1,25 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import re
 import enum
+import json
+import base64
+import threading
 import traceback
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, Enum
+from typing import NamedTuple, Optional
+from sqlalchemy import Column, Integer, String, Text, DateTime, Enum, Index, and_, or_, case, func, insert, select, update, text, inspect, type_coerce
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import declarative_base
-from config import DEVICE_INFO_DB
-from dao.database import create_db_engine, get_session
+from config import DEVICE_INFO_DB, DEVICE_CACHE_SIZE, DEVICE_CACHE_TTL, STATUS_FLUSH_INTERVAL, STATUS_FLUSH_SIZE
+from dao.database import create_db_engine, session_scope, schema_lock
+from dao.cache import LRUCache, export_cache_metrics
+from dao.events import device_events
+from dao.cluster import cluster, writer_task
+from utils.log import get_logger
+from utils.mac import normalize_mac
+
+logger = get_logger("dao.device_info")
 
 Base = declarative_base()
 
@@ -31,6 +42,15 @@ class DeviceInfo(Base):
     status = Column(Enum(DeviceStatus), default=DeviceStatus.ACTIVE, comment='设备状态')
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    # 列表页常用的筛选/排序组合，id 放在最后作为分页游标的决胜列
+    __table_args__ = (
+        Index('ix_devices_status_id', 'status', 'id'),
+        Index('ix_devices_device_type_id', 'device_type', 'id'),
+        Index('uq_devices_device_name', 'device_name', unique=True),
+        Index('ix_devices_created_at_id', 'created_at', 'id'),
+        Index('ix_devices_updated_at_id', 'updated_at', 'id'),
+    )
     
     def to_dict(self):
         """转换为字典格式"""
@@ -84,15 +104,240 @@ class DeviceInfo(Base):
         
         print("=" * 50)
 
+class DeviceSummary(Base):
+    """设备统计汇总表，按 (状态, 类型, 位置) 分组计数，由 devices 表上的触发器维护"""
+    __tablename__ = 'device_summary'
+
+    status = Column(String(20), primary_key=True, comment='设备状态（与 devices.status 存储值一致）')
+    device_type = Column(String(20), primary_key=True, comment='设备类型')
+    location = Column(String(100), primary_key=True, comment='安装位置，未设置时为空字符串')
+    device_count = Column(Integer, nullable=False, default=0, comment='设备数量')
+
+class DeviceImport(Base):
+    """批量导入任务的进度（断点），与每一块设备记录在同一个事务中更新"""
+    __tablename__ = 'device_imports'
+
+    import_id = Column(String(64), primary_key=True, comment='导入任务ID，续传时使用同一个ID')
+    source_format = Column(String(10), nullable=False, comment='文件格式 csv / ndjson')
+    rows_done = Column(Integer, nullable=False, default=0, comment='已处理的数据行数（不含表头），续传时跳过')
+    inserted = Column(Integer, nullable=False, default=0, comment='新增的设备数')
+    updated = Column(Integer, nullable=False, default=0, comment='有变化而更新的设备数')
+    unchanged = Column(Integer, nullable=False, default=0, comment='与现有设备完全相同的行数')
+    failed = Column(Integer, nullable=False, default=0, comment='校验失败或名称冲突的行数')
+    completed = Column(Integer, nullable=False, default=0, comment='是否已读到文件末尾')
+    created_at = Column(DateTime, default=datetime.now, comment='创建时间')
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, comment='更新时间')
+
+    def to_dict(self):
+        """转换为字典格式"""
+        return {
+            'import_id': self.import_id,
+            'format': self.source_format,
+            'rows_done': self.rows_done,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'failed': self.failed,
+            'completed': bool(self.completed),
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class DeviceLivenessOffline(Base):
+    """被心跳检测判定为离线的设备，只有这些设备会因为心跳恢复为在线，人工设置的状态不受心跳影响"""
+    __tablename__ = 'device_liveness_offline'
+
+    mac_address = Column(String(17), primary_key=True, comment='设备MAC地址')
+    created_at = Column(DateTime, default=datetime.now, comment='判定为离线的时间')
+
+# 触发器与设备写入在同一个事务中更新汇总表，ORM、批量插入等所有写入路径都会生效
+_DEVICE_SUMMARY_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_device_summary_insert AFTER INSERT ON devices
+    BEGIN
+        INSERT INTO device_summary (status, device_type, location, device_count)
+        VALUES (NEW.status, NEW.device_type, COALESCE(NEW.location, ''), 1)
+        ON CONFLICT (status, device_type, location) DO UPDATE SET device_count = device_count + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_device_summary_delete AFTER DELETE ON devices
+    BEGIN
+        UPDATE device_summary SET device_count = device_count - 1
+        WHERE status = OLD.status AND device_type = OLD.device_type AND location = COALESCE(OLD.location, '');
+        DELETE FROM device_summary WHERE device_count <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_device_summary_update AFTER UPDATE OF status, device_type, location ON devices
+    WHEN OLD.status IS NOT NEW.status OR OLD.device_type IS NOT NEW.device_type OR OLD.location IS NOT NEW.location
+    BEGIN
+        UPDATE device_summary SET device_count = device_count - 1
+        WHERE status = OLD.status AND device_type = OLD.device_type AND location = COALESCE(OLD.location, '');
+        DELETE FROM device_summary WHERE device_count <= 0;
+        INSERT INTO device_summary (status, device_type, location, device_count)
+        VALUES (NEW.status, NEW.device_type, COALESCE(NEW.location, ''), 1)
+        ON CONFLICT (status, device_type, location) DO UPDATE SET device_count = device_count + 1;
+    END
+    """,
+]
+
+# 设备状态被其它途径修改或设备被删除时，清除心跳检测的离线标记
+_DEVICE_LIVENESS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_device_liveness_update AFTER UPDATE OF status ON devices
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        DELETE FROM device_liveness_offline WHERE mac_address = NEW.mac_address;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_device_liveness_delete AFTER DELETE ON devices
+    BEGIN
+        DELETE FROM device_liveness_offline WHERE mac_address = OLD.mac_address;
+    END
+    """,
+]
+
+def _create_device_summary_triggers(engine):
+    with engine.begin() as conn:
+        for trigger in _DEVICE_SUMMARY_TRIGGERS + _DEVICE_LIVENESS_TRIGGERS:
+            conn.execute(text(trigger))
+
+def _clear_liveness_marks(session, mac_addresses):
+    """人工设置状态时清除心跳检测的离线标记（状态值没有变化时触发器不会清除）"""
+    session.execute(DeviceLivenessOffline.__table__.delete().where(
+        DeviceLivenessOffline.mac_address.in_(mac_addresses)
+    ))
+
+@writer_task
+def rebuild_device_summary():
+    """根据 devices 表重建汇总表，用于补齐触发器创建之前的数据
+
+    服务启动时由主进程（单进程部署时由本进程）执行一次；放在写线程中，不会与其它写操作交错。
+    副本进程不执行，否则每个 worker 启动时都会在主进程写入的同时清空并重建汇总表
+    """
+    with engine_device.begin() as conn:
+        conn.execute(text("DELETE FROM device_summary"))
+        conn.execute(text(
+            "INSERT INTO device_summary (status, device_type, location, device_count) "
+            "SELECT status, device_type, COALESCE(location, ''), COUNT(*) FROM devices "
+            "GROUP BY status, device_type, COALESCE(location, '')"
+        ))
+
 # 创建设备信息数据库引擎和表
 engine_device = create_db_engine(DEVICE_INFO_DB)
-Base.metadata.create_all(engine_device)
+with schema_lock(DEVICE_INFO_DB):
+    Base.metadata.create_all(engine_device)
+    # create_all 不会给已存在的表补建索引，这里单独检查一遍
+    for _index in DeviceInfo.__table__.indexes:
+        try:
+            _index.create(engine_device, checkfirst=True)
+        except IntegrityError:
+            # 旧数据中存在重复的设备名称时无法建立唯一索引，需要先人工清理
+            logger.warning("索引 %s 创建失败，请先清理重复数据", _index.name)
+    _create_device_summary_triggers(engine_device)
+
+# 允许对外查询的字段、允许排序的字段（排序字段必须非空，否则游标比较不成立）
+DEVICE_FIELDS = ('id', 'mac_address', 'device_name', 'device_type', 'location', 'description',
+                 'install_date', 'status', 'created_at', 'updated_at')
+DEVICE_SORT_FIELDS = ('id', 'mac_address', 'device_name', 'device_type', 'created_at', 'updated_at')
+
+def _json_column(field):
+    """查询字段对应的 SQL 表达式，直接查出与 to_dict 相同的 JSON 值，取出的行不需要再逐字段转换
+
+    日期按 SQLite 中的存储格式（YYYY-MM-DD HH:MM:SS.ffffff）转换为 isoformat，微秒为 0 时去掉小数部分；
+    状态由枚举名转换为枚举值
+    """
+    column = getattr(DeviceInfo, field)
+    if isinstance(column.type, DateTime):
+        stored = type_coerce(column, String)
+        return case(
+            (func.substr(stored, 20) == '.000000', func.replace(func.substr(stored, 1, 19), ' ', 'T')),
+            else_=func.replace(stored, ' ', 'T')
+        ).label(field)
+    if isinstance(column.type, Enum):
+        return case({s.name: s.value for s in DeviceStatus}, value=type_coerce(column, String)).label(field)
+    return column
+
+_JSON_COLUMNS = {field: _json_column(field) for field in DEVICE_FIELDS}
+
+class DeviceRecord(NamedTuple):
+    """只读路径使用的设备记录
+
+    由 Core 查询的元组直接构造，和元组一样紧凑、不可变，没有 ORM 实例的身份映射和属性追踪；
+    字段值与 to_dict 相同，也可以像字典一样按字段名取值（record['status']）
+    """
+    id: int
+    mac_address: str
+    device_name: str
+    device_type: str
+    location: Optional[str]
+    description: Optional[str]
+    install_date: Optional[str]
+    status: str
+    created_at: str
+    updated_at: str
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key not in DEVICE_FIELDS:
+                raise KeyError(key)
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in DEVICE_FIELDS else default
+
+    def keys(self):
+        return self._fields
+
+    def to_dict(self):
+        """转换为字典格式，与 DeviceInfo.to_dict 相同"""
+        return dict(zip(self._fields, self))
+
+assert DeviceRecord._fields == DEVICE_FIELDS
+
+# 查询完整设备记录的语句，按条件追加 where
+_RECORD_SELECT = select(*_JSON_COLUMNS.values())
+
+def _fetch_records(conn, *conditions):
+    rows = conn.execute(_RECORD_SELECT.where(*conditions).order_by(DeviceInfo.id)).all()
+    return [DeviceRecord._make(row) for row in rows]
+
+# get_device_by_mac 的读穿透缓存，所有写操作都要调用 _invalidate_device_cache
+device_cache = LRUCache(maxsize=DEVICE_CACHE_SIZE, ttl=DEVICE_CACHE_TTL)
+export_cache_metrics("device", device_cache)
+
+def _invalidate_device_cache(*mac_addresses):
+    """失效指定MAC地址的缓存（同时失效原始写法和规范化写法）"""
+    keys = set(mac_addresses)
+    keys.update(normalize_mac(mac) for mac in mac_addresses)
+    keys.discard(None)
+    device_cache.invalidate(*keys)
+    if keys:
+        cluster.broadcast("device_cache", sorted(keys))
+
+def _publish_device_event(op, mac_address, **data):
+    """事务提交且缓存失效之后发布设备变更事件
+
+    op 为 create（data 含 device 完整字段）、update（data 含 changes 变化的字段）或 delete
+    """
+    event = device_events.publish("device", op=op, mac_address=mac_address, **data)
+    cluster.broadcast("device_event", [device_events.epoch, event])
+
+# 多进程部署时副本进程按主进程的广播失效缓存、重放变更事件
+cluster.subscribe("device_cache", lambda keys: device_cache.invalidate(*keys))
+cluster.subscribe("device_event", lambda payload: device_events.follow(*payload))
+cluster.register_state("device_events", device_events.position, lambda position: device_events.reset(*position))
+cluster.on_reset(device_cache.clear)
+cluster.on_reset(device_events.reset)
 
 def _add_device(mac_address, device_name, device_type, location=None, description=None, install_date=None, status=DeviceStatus.ACTIVE):
-    """添加新设备
+    """在一个事务中插入新设备，唯一性由 mac_address / device_name 的唯一约束保证
     
     Args:
-        mac_address: 设备MAC地址，必须为17个字符且唯一
+        mac_address: 规范化后的设备MAC地址
         device_name: 设备名称，不能为空
         device_type: 设备类型，不能为空
         location: 安装位置，可选
@@ -101,240 +346,882 @@ def _add_device(mac_address, device_name, device_type, location=None, descriptio
         status: 设备状态，默认为ACTIVE
     
     Returns:
-        DeviceInfo: 新建设备对象
-        
-    Raises:
-        ValueError: 参数验证失败
-        Exception: 数据库操作失败
+        (bool, str): 是否成功，失败时的错误信息
     """
-    # 参数验证
-    if not mac_address or len(mac_address) != 17:
-        return False, "MAC地址必须为17个字符"
-    
-    if not device_name or len(device_name.strip()) == 0:
-        return False, "设备名称不能为空"
-
-    if not device_type or len(device_type.strip()) == 0:
-        return False, "设备类型不能为空"
-
-    # 验证MAC地址格式（简单验证）
-    if not all(c in '0123456789ABCDEFabcdef:' for c in mac_address):
-        return False, "MAC地址格式不正确，应包含0-9,A-F,a-f和冒号"
-
-    session = get_session(engine_device)
+    created = None
     try:
-        # 检查MAC地址是否已存在
-        existing_device = session.query(DeviceInfo).filter(
-            DeviceInfo.mac_address == mac_address
-        ).first()
-        
-        if existing_device:
-            return False, f"MAC地址 {mac_address} 已存在，设备名称为: {existing_device.device_name}"
-
-        # 检查设备名称是否已存在（可选，根据业务需求）
-        existing_name = session.query(DeviceInfo).filter(
-            DeviceInfo.device_name == device_name
-        ).first()
-        
-        if existing_name:
-            return False, f"设备名称 '{device_name}' 已存在，对应的MAC地址为: {existing_name.mac_address}"
-        
-        # 创建设备记录
-        new_device = DeviceInfo(
-            mac_address=mac_address.upper(),  # 统一转为大写
-            device_name=device_name.strip(),
-            device_type=device_type.strip(),
-            location=location.strip() if location else None,
-            description=description.strip() if description else None,
-            install_date=install_date,
-            status=status
-        )
-        
-        session.add(new_device)
-        session.commit()
+        with session_scope(engine_device) as session:
+            device = DeviceInfo(
+                mac_address=mac_address,
+                device_name=device_name.strip(),
+                device_type=device_type.strip(),
+                location=location.strip() if location else None,
+                description=description.strip() if description else None,
+                install_date=install_date,
+                status=status
+            )
+            session.add(device)
+            session.flush()
+            created = device.to_dict()
         return True, ""
-        
-    except ValueError:
-        # 重新抛出已知的业务逻辑错误
-        error_info = traceback.format_exc()
-        return False, str(error_info)
+
+    except IntegrityError as e:
+        created = None
+        return False, _unique_error_message(e, mac_address, device_name.strip())
     except Exception as e:
-        session.rollback()
-        # 封装数据库错误信息
-        if "UNIQUE constraint failed" in str(e) or "Duplicate entry" in str(e):
-            return False, f"设备信息已存在，可能由于重复的MAC地址或设备名称: {mac_address}"
-        else:
-            return False, f"数据库操作失败: {str(e)}"
+        created = None
+        return False, f"数据库操作失败: {str(e)}"
     finally:
-        session.close()
+        _invalidate_device_cache(mac_address)
+        if created:
+            _publish_device_event("create", mac_address, device=created)
 
-def validate_mac_address(mac_address):
-    """
-    验证并规范化 MAC 地址格式
-    支持常见格式: AA:BB:CC:DD:EE:FF 或 AA-BB-CC-DD-EE-FF
-    返回值：
-        如果合法 -> 返回规范化后的 MAC（大写、冒号分隔）
-        如果非法 -> 返回 None
-    """
-    if not mac_address or not isinstance(mac_address, str):
-        return None
+# 导入时可以写入的字段，id、created_at、updated_at 等由本地数据库生成
+IMPORT_FIELDS = ('mac_address', 'device_name', 'device_type', 'location', 'description', 'install_date', 'status')
+_STATUS_VALUES = {s.value for s in DeviceStatus}
 
-    # 去除首尾空格
-    mac_address = mac_address.strip()
+def validate_import_record(record):
+    """校验并规范化导入文件中的一行，CSV 中的空字符串视为未设置
 
-    # 匹配格式: 允许 : 或 - 分隔
-    pattern = r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$'
-    if re.match(pattern, mac_address):
-        # 统一成冒号分隔 + 大写形式
-        normalized = mac_address.replace('-', ':').upper()
-        return normalized
+    状态可以是枚举值（active）或枚举名（ACTIVE），安装日期为 ISO 格式，与导出的文件格式一致
 
-    # 尝试匹配无分隔符形式，例如 AABBCCDDEEFF
-    pattern_no_sep = r'^[0-9A-Fa-f]{12}$'
-    if re.match(pattern_no_sep, mac_address):
-        normalized = ':'.join(mac_address[i:i+2] for i in range(0, 12, 2)).upper()
-        return normalized
+    Returns:
+        (dict, str): 可以写入的设备字段和错误信息，校验通过时错误信息为空字符串
+    """
+    if not isinstance(record, dict):
+        return None, "每行必须是一个 JSON 对象"
+    normalized_mac, error = _validate_device_fields(
+        record.get('mac_address'), record.get('device_name'), record.get('device_type')
+    )
+    if error:
+        return None, error
 
-    return None
+    location = record.get('location') or None
+    if location is not None and not isinstance(location, str):
+        return None, "安装位置必须是字符串"
+    location = (location or '').strip() or None
+    if location and len(location) > 100:
+        return None, "安装位置长度不能超过100个字符"
+    description = record.get('description') or None
+    if description is not None and not isinstance(description, str):
+        return None, "设备描述必须是字符串"
+    description = (description or '').strip() or None
 
-def _is_device_name_exists(device_name, exclude_mac=None):
-    """检查设备名称是否已存在（排除指定MAC地址）"""
-    session = get_session(engine_device)
+    status_value = record.get('status') or DeviceStatus.ACTIVE.value
     try:
-        query = session.query(DeviceInfo).filter(DeviceInfo.device_name == device_name)
-        if exclude_mac:
-            query = query.filter(DeviceInfo.mac_address != exclude_mac)
-        return query.first() is not None
-    finally:
-        session.close()
+        # 不可哈希的值（列表、对象）在集合查找时就会抛出 TypeError
+        status = DeviceStatus(status_value) if status_value in _STATUS_VALUES else DeviceStatus[status_value]
+    except (KeyError, TypeError):
+        return None, f"设备状态 '{status_value}' 不正确"
+
+    install_date = record.get('install_date') or None
+    if install_date is not None:
+        try:
+            install_date = datetime.fromisoformat(install_date)
+        except (TypeError, ValueError):
+            return None, f"安装日期 '{install_date}' 格式不正确"
+
+    return {
+        'mac_address': normalized_mac,
+        'device_name': record['device_name'].strip(),
+        'device_type': record['device_type'].strip(),
+        'location': location,
+        'description': description,
+        'install_date': install_date,
+        'status': status,
+    }, ""
+
+def get_import_checkpoint(import_id):
+    """读取导入任务的进度，不存在时返回 None"""
+    with session_scope(engine_device) as session:
+        checkpoint = session.get(DeviceImport, import_id)
+        return checkpoint.to_dict() if checkpoint else None
+
+@writer_task
+def import_devices_chunk(import_id, source_format, start_row, end_row, rows, failed=0, completed=False):
+    """把导入文件中 [start_row, end_row) 的一块记录按 MAC 地址写入（新增或更新），并在同一个事务中更新断点
 
-def _is_mac_address_exists(mac_address, exclude_name=None):
-    """检查MAC地址是否已存在（排除指定设备名称）"""
-    session = get_session(engine_device)
+    与现有设备完全相同的行不写入；设备名称已被其它 MAC 地址占用的行记为失败（包括本块中更早的行）。
+    本块中同一个 MAC 地址出现多次时以最后一次为准。
+
+    Args:
+        rows: (行号, validate_import_record 的结果) 列表，只包含校验通过的行
+        failed: 本块中校验失败的行数，计入断点
+        completed: 本块是否为文件的最后一块
+
+    Returns:
+        dict: 本块的 inserted / updated / unchanged / failed 数量和 errors（行号, MAC地址, 错误信息）
+
+    Raises:
+        ValueError: 断点的进度与 start_row 不一致（例如同一个任务被并发导入）
+    """
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'failed': failed}
+    errors = []
+    inserts, updates = {}, {}
+    if rows:
+        # 导入会覆盖状态，先写入缓冲中更早的状态
+        status_write_behind.flush()
     try:
-        query = session.query(DeviceInfo).filter(DeviceInfo.mac_address == mac_address)
-        if exclude_name:
-            query = query.filter(DeviceInfo.device_name != exclude_name)
-        return query.first() is not None
+        with session_scope(engine_device) as session:
+            checkpoint = session.get(DeviceImport, import_id)
+            if checkpoint is None:
+                # 同一个任务的第一块可能被并发提交：INSERT OR IGNORE 等对方提交后忽略，
+                # 再读到的是对方写入的进度，由下面的进度检查拒绝，而不是抛出唯一约束冲突
+                session.execute(insert(DeviceImport.__table__).prefix_with("OR IGNORE").values(
+                    import_id=import_id, source_format=source_format, rows_done=0,
+                    inserted=0, updated=0, unchanged=0, failed=0, completed=0
+                ))
+                checkpoint = session.get(DeviceImport, import_id)
+            if checkpoint.rows_done != start_row:
+                raise ValueError(f"导入任务 {import_id} 已处理 {checkpoint.rows_done} 行，与本块的起始行 {start_row} 不一致")
+
+            existing, name_owners = {}, {}
+            if rows:
+                macs = {row['mac_address'] for _, row in rows}
+                names = {row['device_name'] for _, row in rows}
+                query = select(DeviceInfo.id, *[getattr(DeviceInfo, f) for f in IMPORT_FIELDS]).where(
+                    or_(DeviceInfo.mac_address.in_(macs), DeviceInfo.device_name.in_(names))
+                )
+                for device_id, *values in session.execute(query):
+                    device = dict(zip(IMPORT_FIELDS, values), id=device_id)
+                    name_owners[device['device_name']] = device['mac_address']
+                    if device['mac_address'] in macs:
+                        existing[device['mac_address']] = device
+
+            for row_number, row in rows:
+                mac = row['mac_address']
+                owner = name_owners.setdefault(row['device_name'], mac)
+                if owner != mac:
+                    counts['failed'] += 1
+                    errors.append((row_number, mac, f"设备名称 '{row['device_name']}' 已被设备 {owner} 使用"))
+                    continue
+                if mac in inserts:
+                    counts['updated' if inserts[mac] != row else 'unchanged'] += 1
+                    inserts[mac] = row
+                    continue
+                current = updates.get(mac, (existing.get(mac), None))[0]
+                if current is None:
+                    inserts[mac] = row
+                    counts['inserted'] += 1
+                    continue
+                changes = {f: row[f] for f in IMPORT_FIELDS if row[f] != current[f]}
+                if not changes:
+                    counts['unchanged'] += 1
+                    continue
+                previous_changes = updates[mac][1] if mac in updates else {}
+                updates[mac] = (dict(current, **row), dict(previous_changes, **changes))
+                counts['updated'] += 1
+
+            if inserts:
+                # 用表级 insert：ORM 的批量插入会省略值为 None 的列，各行列集不同时退化为逐行执行
+                session.execute(insert(DeviceInfo.__table__), list(inserts.values()))
+            if updates:
+                now = datetime.now()
+                session.execute(update(DeviceInfo), [
+                    dict({f: device[f] for f in IMPORT_FIELDS}, id=device['id'], updated_at=now)
+                    for device, _ in updates.values()
+                ])
+
+            checkpoint.rows_done = end_row
+            for key, value in counts.items():
+                setattr(checkpoint, key, getattr(checkpoint, key) + value)
+            if completed:
+                checkpoint.completed = 1
+    except Exception:
+        inserts, updates = {}, {}
+        raise
     finally:
-        session.close()
+        _invalidate_device_cache(*inserts, *updates)
+        for mac, row in inserts.items():
+            _publish_device_event("create", mac, device={k: _format_value(v) for k, v in row.items()})
+        for mac, (_, changes) in updates.items():
+            _publish_device_event("update", mac, changes={k: _format_value(v) for k, v in changes.items()})
+    return dict(counts, errors=errors)
 
-def add_device(mac_address, device_name, device_type, location=None, description=None, install_date=None, status=DeviceStatus.ACTIVE):
-    """增强版的添加设备函数，包含更严格的验证"""
-    
+def _unique_error_message(error, mac_address, device_name):
+    """把唯一约束冲突转换为原有的错误提示"""
+    error_info = str(error.orig) if getattr(error, 'orig', None) is not None else str(error)
+    if 'devices.mac_address' in error_info:
+        return f"MAC地址 {mac_address} 已存在"
+    if 'devices.device_name' in error_info:
+        return f"设备名称 '{device_name}' 已存在"
+    return f"设备信息已存在，可能由于重复的MAC地址或设备名称: {mac_address}"
+
+# 兼容旧的调用方：验证并规范化 MAC 地址，合法时返回大写、冒号分隔的形式，否则返回 None
+validate_mac_address = normalize_mac
+
+def _validate_device_fields(mac_address, device_name, device_type):
+    """校验新设备的必填字段
+
+    Returns:
+        (str, str): 规范化后的MAC地址和错误信息，校验通过时错误信息为空字符串
+    """
     # 标准化MAC地址
-    if not validate_mac_address(mac_address):
-        return False, "MAC地址格式不正确" 
-        
-    # 参数验证
+    normalized_mac = normalize_mac(mac_address)
+    if not normalized_mac:
+        return None, "MAC地址格式不正确"
+
+    # 参数验证；导入的 NDJSON 中字段可能是任意 JSON 值
+    if device_name is not None and not isinstance(device_name, str):
+        return None, "设备名称必须是字符串"
+
     if not device_name or len(device_name.strip()) == 0:
-        return False, "设备名称不能为空" 
-    
+        return None, "设备名称不能为空"
+
     if len(device_name.strip()) > 50:
-        return False, "设备名称长度不能超过50个字符"
+        return None, "设备名称长度不能超过50个字符"
+
+    if device_type is not None and not isinstance(device_type, str):
+        return None, "设备类型必须是字符串"
 
     if not device_type or len(device_type.strip()) == 0:
-        return False, "设备类型不能为空"
+        return None, "设备类型不能为空"
 
     if len(device_type.strip()) > 20:
-        return False, "设备类型长度不能超过20个字符"
+        return None, "设备类型长度不能超过20个字符"
 
-    # 检查唯一性
-    if _is_mac_address_exists(mac_address):
-        return False, f"MAC地址 {mac_address} 已存在"
+    return normalized_mac, ""
 
-    if _is_device_name_exists(device_name):
-        return False, f"设备名称 '{device_name}' 已存在"
+@writer_task
+def add_device(mac_address, device_name, device_type, location=None, description=None, install_date=None, status=DeviceStatus.ACTIVE):
+    """增强版的添加设备函数，包含更严格的验证
 
-    return _add_device(mac_address, device_name, device_type, location, description, install_date, status)
+    参数校验在内存中完成，唯一性检查交给数据库的唯一约束，整个插入只有一次事务
+    """
+    normalized_mac, error = _validate_device_fields(mac_address, device_name, device_type)
+    if error:
+        return False, error
 
-def get_all_devices():
-    """获取所有设备"""
-    session = get_session(engine_device)
+    return _add_device(normalized_mac, device_name, device_type, location, description, install_date, status)
+
+@writer_task
+def add_devices_bulk(devices, chunk_size=400):
+    """批量添加设备
+
+    先在内存中校验全部记录并剔除批次内部的重复，然后按块处理：每块用一次 IN 查询检查
+    数据库中已存在的MAC地址和设备名称，再用 executemany 在一个事务中插入剩余记录
+
+    Args:
+        devices: 设备字典列表，字段与 add_device 的参数相同
+        chunk_size: 每个事务处理的记录数，IN 查询的参数个数为其两倍，需低于 SQLite 的参数上限
+
+    Returns:
+        list: 与输入一一对应的 (bool, str) 列表，表示每条记录是否成功及错误信息
+    """
+    results = [None] * len(devices)
+    rows = []
+    seen_macs = set()
+    seen_names = set()
+
+    for index, device in enumerate(devices):
+        normalized_mac, error = _validate_device_fields(
+            device.get('mac_address'), device.get('device_name'), device.get('device_type')
+        )
+        if error:
+            results[index] = (False, error)
+            continue
+
+        device_name = device['device_name'].strip()
+        if normalized_mac in seen_macs:
+            results[index] = (False, f"MAC地址 {normalized_mac} 在本批次中重复")
+            continue
+        if device_name in seen_names:
+            results[index] = (False, f"设备名称 '{device_name}' 在本批次中重复")
+            continue
+        seen_macs.add(normalized_mac)
+        seen_names.add(device_name)
+
+        location = device.get('location')
+        description = device.get('description')
+        rows.append((index, {
+            'mac_address': normalized_mac,
+            'device_name': device_name,
+            'device_type': device['device_type'].strip(),
+            'location': location.strip() if location else None,
+            'description': description.strip() if description else None,
+            'install_date': device.get('install_date'),
+            'status': device.get('status') or DeviceStatus.ACTIVE,
+        }))
+
+    for start in range(0, len(rows), chunk_size):
+        _insert_device_chunk(rows[start:start + chunk_size], results)
+
+    return results
+
+def _insert_device_chunk(chunk, results):
+    """在一个事务中插入一块设备记录，结果写回 results"""
+    inserted = []
     try:
-        devices = session.query(DeviceInfo).all()
-        return [device.to_dict() for device in devices]
+        with session_scope(engine_device) as session:
+            macs = [row['mac_address'] for _, row in chunk]
+            names = [row['device_name'] for _, row in chunk]
+            existing = session.query(DeviceInfo.mac_address, DeviceInfo.device_name).filter(
+                or_(DeviceInfo.mac_address.in_(macs), DeviceInfo.device_name.in_(names))
+            ).all()
+            existing_macs = {mac for mac, _ in existing}
+            existing_names = {name for _, name in existing}
+
+            to_insert = []
+            for index, row in chunk:
+                if row['mac_address'] in existing_macs:
+                    results[index] = (False, f"MAC地址 {row['mac_address']} 已存在")
+                elif row['device_name'] in existing_names:
+                    results[index] = (False, f"设备名称 '{row['device_name']}' 已存在")
+                else:
+                    to_insert.append((index, row))
+
+            if to_insert:
+                session.execute(insert(DeviceInfo), [row for _, row in to_insert])
+        for index, _ in to_insert:
+            results[index] = (True, "")
+        inserted = [row for _, row in to_insert]
+
+    except IntegrityError:
+        # 检查之后有并发写入抢先插入了相同的数据，退回到逐条插入以得到每条记录的结果
+        for index, row in chunk:
+            if results[index] is None:
+                results[index] = _add_device(**row)
+    except Exception as e:
+        for index, _ in chunk:
+            if results[index] is None:
+                results[index] = (False, f"数据库操作失败: {str(e)}")
     finally:
-        session.close()
+        _invalidate_device_cache(*(row['mac_address'] for _, row in chunk))
+        # executemany 不返回自增 id 和创建时间，事件中只包含插入的字段
+        for row in inserted:
+            _publish_device_event("create", row['mac_address'], device={k: _format_value(v) for k, v in row.items()})
 
-def get_device_by_mac(mac_address, print=False):
-    """根据MAC地址获取设备"""
-    session = get_session(engine_device)
+def _device_conditions(status=None, device_type=None, location=None):
+    """按状态、设备类型和安装位置筛选的 where 条件"""
+    conditions = []
+    if status:
+        conditions.append(DeviceInfo.status == status)
+    if device_type:
+        conditions.append(DeviceInfo.device_type == device_type)
+    if location:
+        conditions.append(DeviceInfo.location == location)
+    return conditions
+
+def get_device_records(status=None, device_type=None, location=None):
+    """按条件查询完整的设备记录，按 id 排序
+
+    Returns:
+        list: DeviceRecord 列表
+    """
+    conditions = _device_conditions(status, device_type, location)
+    status_write_behind.flush()
+    with engine_device.connect() as conn:
+        return _fetch_records(conn, *conditions)
+
+def iter_device_records(status=None, device_type=None, location=None, batch_size=1000):
+    """按条件流式读取设备记录，按 id 排序，每次产出一批 DeviceRecord
+
+    使用 yield_per 逐批从游标取行，内存占用只与 batch_size 有关，与设备总数无关；
+    整个遍历在同一个读事务中，WAL 模式下读到的是开始时的一致快照，不阻塞写入。
+    生成器没有遍历完时需要调用 close() 归还连接
+    """
+    conditions = _device_conditions(status, device_type, location)
+    status_write_behind.flush()
+    with engine_device.connect() as conn:
+        result = conn.execution_options(yield_per=batch_size).execute(
+            _RECORD_SELECT.where(*conditions).order_by(DeviceInfo.id)
+        )
+        for rows in result.partitions():
+            yield [DeviceRecord._make(row) for row in rows]
+
+def get_all_devices():
+    """获取所有设备，返回 DeviceRecord 列表"""
+    return get_device_records()
+
+def _format_value(value):
+    """把数据库中的值转换为可 JSON 序列化的值，与 to_dict 保持一致"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, DeviceStatus):
+        return value.value
+    return value
+
+def _encode_cursor(sort_value, device_id):
+    """把最后一条记录的 (排序值, id) 编码为分页游标"""
+    raw = json.dumps([_format_value(sort_value), device_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor, sort_field):
+    """解析分页游标，返回 (排序值, id)"""
     try:
-        device = session.query(DeviceInfo).filter(DeviceInfo.mac_address == mac_address).first()
-        if print:
+        sort_value, device_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if sort_field in ('created_at', 'updated_at'):
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(device_id)
+    except Exception:
+        raise ValueError("分页游标格式不正确")
+
+def _parse_sort(sort):
+    """解析排序参数，例如 'device_name' 或 '-created_at'，返回 (字段名, 是否倒序)"""
+    sort = (sort or 'id').strip()
+    descending = sort.startswith('-')
+    sort_field = sort.lstrip('+-')
+    if sort_field not in DEVICE_SORT_FIELDS:
+        raise ValueError(f"不支持的排序字段: {sort_field}，可选: {', '.join(DEVICE_SORT_FIELDS)}")
+    return sort_field, descending
+
+def query_devices(status=None, device_type=None, location=None, sort='id', limit=None, cursor=None, fields=None):
+    """按条件分页查询设备，筛选、排序和分页都在 SQL 中完成
+
+    Args:
+        status: 设备状态筛选，DeviceStatus
+        device_type: 设备类型筛选
+        location: 安装位置筛选
+        sort: 排序字段，前缀 '-' 表示倒序，只能是 DEVICE_SORT_FIELDS 中的字段
+        limit: 每页条数，None 表示不分页
+        cursor: 上一页返回的 next_cursor，按游标（keyset）翻页
+        fields: 需要返回的字段列表，None 表示全部字段
+
+    Returns:
+        (devices, next_cursor, total): 当前页设备字典列表、下一页游标（没有下一页时为 None）、满足筛选条件的总数
+
+    Raises:
+        ValueError: 排序字段、返回字段或游标不合法
+    """
+    sort_field, descending = _parse_sort(sort)
+
+    if fields:
+        unknown = [f for f in fields if f not in DEVICE_FIELDS]
+        if unknown:
+            raise ValueError(f"不支持的字段: {', '.join(unknown)}")
+        fields = [f for f in DEVICE_FIELDS if f in fields]
+    else:
+        fields = list(DEVICE_FIELDS)
+
+    conditions = _device_conditions(status, device_type, location)
+
+    sort_column = getattr(DeviceInfo, sort_field)
+    # 游标需要排序字段和 id，即使调用方没有请求这两个字段也要查出来；请求的字段排在前面，按位置取值
+    query_fields = list(dict.fromkeys(fields + [sort_field, 'id']))
+
+    # 在连接上直接执行 Core 查询，结果是轻量的元组，不经过 Session 和 ORM 的结果加载；
+    # 日期和状态在 SQL 中转换为 JSON 值，与 to_dict 的结果相同
+    query = select(*[_JSON_COLUMNS[f] for f in query_fields]).where(*conditions)
+    if cursor:
+        last_value, last_id = _decode_cursor(cursor, sort_field)
+        if descending:
+            query = query.where(or_(sort_column < last_value, and_(sort_column == last_value, DeviceInfo.id < last_id)))
+        else:
+            query = query.where(or_(sort_column > last_value, and_(sort_column == last_value, DeviceInfo.id > last_id)))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), DeviceInfo.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), DeviceInfo.id.asc())
+
+    if limit is not None:
+        # 多查一条用来判断是否还有下一页
+        query = query.limit(limit + 1)
+
+    # 按状态筛选和计数需要数据库中的状态是最新的，先写入缓冲中的状态
+    status_write_behind.flush()
+    with engine_device.connect() as conn:
+        total = conn.execute(select(func.count(DeviceInfo.id)).where(*conditions)).scalar()
+        rows = conn.execute(query).all()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_cursor(getattr(last, sort_field), last.id)
+
+    devices = [dict(zip(fields, row)) for row in rows]
+    return devices, next_cursor, total
+
+def get_device_summary():
+    """从汇总表读取设备统计，查询量只与分组数有关，与设备总数无关
+
+    Returns:
+        dict: 各状态数量、总数、按位置的状态分布以及设备类型列表
+    """
+    status_write_behind.flush()
+    with session_scope(engine_device) as session:
+        rows = session.query(
+            DeviceSummary.status, DeviceSummary.device_type, DeviceSummary.location, DeviceSummary.device_count
+        ).filter(DeviceSummary.device_count > 0).all()
+
+    empty_count = {s.value: 0 for s in DeviceStatus}
+    summary = dict(empty_count, total=0)
+    by_location = {}
+    device_types = set()
+    for status_name, device_type, location, count in rows:
+        status_value = DeviceStatus[status_name].value
+        summary[status_value] += count
+        summary['total'] += count
+        location_count = by_location.setdefault(location, dict(empty_count, total=0))
+        location_count[status_value] += count
+        location_count['total'] += count
+        device_types.add(device_type)
+
+    summary['by_location'] = [
+        dict(location=location or None, **by_location[location]) for location in sorted(by_location)
+    ]
+    summary['device_types'] = sorted(device_types)
+    return summary
+
+def get_device_by_mac(mac_address, print=False):
+    """根据MAC地址获取设备，优先读取缓存（不存在的设备也会缓存为 None）
+
+    写后缓冲中还没写入数据库的状态会覆盖读到的状态，保证调用方能读到自己刚写入的值
+    """
+    # 多进程部署时先追上主进程的广播，本地缓存和写后缓冲中的状态才是最新的；追不上时不使用缓存
+    use_cache = cluster.sync() and not print
+    # 必须在读缓存/数据库之前取缓冲中的状态：之后才写入的值不影响本次读取，之前的值无论是否已写入都是最新的
+    pending_status = status_write_behind.pending_status(mac_address)
+    if use_cache:
+        hit, device, generation = device_cache.get(mac_address)
+        if hit:
+            return _overlay_status(device, pending_status)
+
+    if print:
+        with session_scope(engine_device) as session:
+            device = session.query(DeviceInfo).filter(DeviceInfo.mac_address == mac_address).first()
             device.print_info()
-        return device.to_dict() if device else None
-    finally:
-        session.close()
+            return device.to_dict()
+
+    # 缓存中存放不可变的 DeviceRecord，比字典更省内存，命中时也不需要防御性复制
+    with engine_device.connect() as conn:
+        records = _fetch_records(conn, DeviceInfo.mac_address == mac_address)
+    record = records[0] if records else None
+    if use_cache:
+        device_cache.set(mac_address, record, generation)
+    return _overlay_status(record, pending_status)
 
+def _overlay_status(record, pending_status):
+    """把设备记录转换为字典，并用写后缓冲中的状态覆盖"""
+    if record is None:
+        return None
+    device = record.to_dict()
+    if pending_status is not None:
+        device['status'] = pending_status.value
+    return device
+
+@writer_task
 def update_device_status(mac_address, status):
-    """更新设备状态"""
-    session = get_session(engine_device)
+    """更新设备状态
+
+    开启写后缓冲时只检查设备是否存在（走缓存）并把状态放入缓冲区，由后台线程合并写入
+    """
+    if status_write_behind.enabled:
+        if get_device_by_mac(mac_address) is None:
+            return False
+        status_write_behind.put(mac_address, status)
+        return True
+
+    changed = False
     try:
-        device = session.query(DeviceInfo).filter(DeviceInfo.mac_address == mac_address).first()
-        if device:
+        with session_scope(engine_device) as session:
+            device = session.query(DeviceInfo).filter(DeviceInfo.mac_address == mac_address).first()
+            if not device:
+                return False
+            changed = device.status != status
             device.status = status
-            session.commit()
-            return True
-        return False
-    except Exception as e:
-        session.rollback()
-        raise e
+            _clear_liveness_marks(session, [mac_address])
+        return True
+    except Exception:
+        changed = False
+        raise
     finally:
-        session.close()
+        _invalidate_device_cache(mac_address)
+        if changed:
+            _publish_device_event("update", mac_address, changes={'status': _format_value(status)})
         
+def _write_statuses(statuses, chunk_size=500):
+    """在一个事务中写入一批设备状态，只修改状态确实变化的设备
+
+    Args:
+        statuses: {MAC地址: DeviceStatus}
+
+    Returns:
+        dict: 状态发生变化的 {MAC地址: DeviceStatus}
+    """
+    mac_addresses = list(statuses)
+    changed = {}
+    with session_scope(engine_device) as session:
+        for start in range(0, len(mac_addresses), chunk_size):
+            _clear_liveness_marks(session, mac_addresses[start:start + chunk_size])
+            devices = session.query(DeviceInfo).filter(
+                DeviceInfo.mac_address.in_(mac_addresses[start:start + chunk_size])
+            ).all()
+            for device in devices:
+                new_status = statuses[device.mac_address]
+                if device.status != new_status:
+                    device.status = new_status
+                    changed[device.mac_address] = new_status
+    return changed
+
+class StatusWriteBehind:
+    """设备状态的写后缓冲
+
+    频繁上下线的设备每次状态变化都单独提交会让 SQLite 忙于提交。开启后 update_device_status
+    只把状态放入按 MAC 索引的缓冲区（同一设备只保留最新值），后台线程每隔 flush_interval 秒
+    或缓冲区达到 flush_size 个设备时在一个事务中写入，停止时把剩余的状态全部写入。
+
+    正在写入的一批状态在提交并失效缓存之前仍然可以通过 pending_status() 读到，
+    get_device_by_mac 用它覆盖读到的状态，所以写入期间的读取也不会读到旧值。
+
+    多进程部署时缓冲区在主进程中，副本进程的缓冲区是按广播维护的镜像，只用于覆盖读到的状态。
+    """
+
+    def __init__(self, flush_interval=0.2, flush_size=1000):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()    # 同一时间只有一个 flush，保证写入顺序
+        self._pending = {}                     # MAC地址 -> DeviceStatus，等待写入
+        self._flushing = {}                    # 正在写入的一批
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.updates = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    def put(self, mac_address, status):
+        with self._lock:
+            self._pending[mac_address] = status
+            self.updates += 1
+            if len(self._pending) >= self.flush_size:
+                self._wakeup.set()
+        cluster.broadcast("status_pending", [mac_address, status.value])
+
+    def pending_status(self, mac_address):
+        """缓冲区中尚未写入数据库的状态，没有时返回 None"""
+        with self._lock:
+            status = self._pending.get(mac_address)
+            return status if status is not None else self._flushing.get(mac_address)
+
+    def flush(self):
+        """把缓冲区中的状态写入数据库，返回状态发生变化的设备数
+
+        多进程部署时在主进程的写线程中执行，副本进程只在镜像中有待写入的状态时才请主进程写入
+        """
+        if cluster.role == "replica":
+            cluster.sync()
+        with self._lock:
+            if not self._pending and (cluster.role == "replica" or not self._flushing):
+                return 0
+        return _flush_status_buffer()
+
+    def _flush_pending(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+            changed = {}
+            try:
+                changed = _write_statuses(batch)
+            except Exception:
+                # 写入失败时放回缓冲区，期间写入的更新的值优先
+                with self._lock:
+                    for mac_address, status in batch.items():
+                        self._pending.setdefault(mac_address, status)
+                raise
+            finally:
+                # 先失效缓存再清除正在写入的一批，中间不会出现读到旧值的窗口
+                _invalidate_device_cache(*changed)
+                with self._lock:
+                    self._flushing = {}
+                    self.flushes += 1
+                    self.rows_written += len(changed)
+            cluster.broadcast("status_flushed", {mac_address: status.value for mac_address, status in batch.items()})
+            for mac_address, status in changed.items():
+                _publish_device_event("update", mac_address, changes={'status': status.value})
+            return len(changed)
+
+    def _mirror(self):
+        with self._lock:
+            return {mac_address: status.value for mac_address, status in {**self._flushing, **self._pending}.items()}
+
+    def _follow_pending(self, payload):
+        mac_address, value = payload
+        with self._lock:
+            self._pending[mac_address] = DeviceStatus(value)
+
+    def _follow_flushed(self, batch):
+        with self._lock:
+            for mac_address, value in batch.items():
+                if self._pending.get(mac_address) is DeviceStatus(value):
+                    del self._pending[mac_address]
+
+    def _load_mirror(self, mirror):
+        with self._lock:
+            self._pending = {mac_address: DeviceStatus(value) for mac_address, value in mirror.items()}
+
+    def _clear_mirror(self):
+        with self._lock:
+            self._pending = {}
+
+    def start(self):
+        """开启写后缓冲并启动后台写入线程"""
+        self.enabled = True
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="status-write-behind", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("状态写后缓冲写入数据库失败")
+
+    def stop(self):
+        """关闭写后缓冲，之后的状态更新直接写入数据库，缓冲区中剩余的状态在返回前写入"""
+        self.enabled = False
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pending": len(self._pending) + len(self._flushing),
+                "updates": self.updates,
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+            }
+
+# 设备状态写后缓冲，服务启动时按 STATUS_WRITE_BEHIND 开启
+status_write_behind = StatusWriteBehind(STATUS_FLUSH_INTERVAL, STATUS_FLUSH_SIZE)
+cluster.subscribe("status_pending", status_write_behind._follow_pending)
+cluster.subscribe("status_flushed", status_write_behind._follow_flushed)
+cluster.register_state("status_pending", status_write_behind._mirror, status_write_behind._load_mirror)
+cluster.on_reset(status_write_behind._clear_mirror)
+
+@writer_task
+def _flush_status_buffer():
+    return status_write_behind._flush_pending()
+
+@writer_task
+def update_devices_liveness(mac_addresses, online, chunk_size=500):
+    """按心跳检测结果批量切换设备的在线状态
+
+    只修改状态确实需要变化的设备（离线: active -> inactive，同时记下离线标记；
+    上线: 只恢复带离线标记的 inactive 设备），人工设为 inactive 或维护中的设备不受心跳影响
+
+    Returns:
+        list: 状态发生变化的MAC地址
+    """
+    new_status = DeviceStatus.ACTIVE if online else DeviceStatus.INACTIVE
+    old_status = DeviceStatus.INACTIVE if online else DeviceStatus.ACTIVE
+    mac_addresses = list(mac_addresses)
+    if not mac_addresses:
+        return []
+    # 按数据库中的当前状态判断是否需要切换，先写入缓冲中的状态（例如刚设为维护中的设备）
+    status_write_behind.flush()
+    changed = []
+    try:
+        with session_scope(engine_device) as session:
+            for start in range(0, len(mac_addresses), chunk_size):
+                query = session.query(DeviceInfo).filter(
+                    DeviceInfo.mac_address.in_(mac_addresses[start:start + chunk_size]),
+                    DeviceInfo.status == old_status
+                )
+                if online:
+                    # 恢复在线时触发器清除离线标记
+                    query = query.join(DeviceLivenessOffline, DeviceLivenessOffline.mac_address == DeviceInfo.mac_address)
+                devices = query.all()
+                for device in devices:
+                    device.status = new_status
+                if devices and not online:
+                    # 先写入状态再记下标记，状态变化的触发器不会把新标记清除
+                    session.flush()
+                    session.execute(insert(DeviceLivenessOffline).prefix_with("OR IGNORE"),
+                                    [{"mac_address": device.mac_address} for device in devices])
+                changed.extend(device.mac_address for device in devices)
+    except Exception:
+        changed = []
+        raise
+    finally:
+        _invalidate_device_cache(*changed)
+        for mac_address in changed:
+            _publish_device_event("update", mac_address, changes={'status': new_status.value})
+    return changed
+
+@writer_task
 def delete_device(mac_address):
     """根据设备的MAC地址删除设备"""
-    session = get_session(engine_device)
+    deleted = False
     try:
-        # 查找设备
-        device = session.query(DeviceInfo).filter(DeviceInfo.mac_address == mac_address).first()
-        
-        if not device:
-            raise ValueError(f"设备 {mac_address} 不存在")
-        
-        # 删除设备
-        session.delete(device)
-        session.commit()
-        print(f"设备 {mac_address} 删除成功")
+        with session_scope(engine_device) as session:
+            # 查找设备
+            device = session.query(DeviceInfo).filter(DeviceInfo.mac_address == mac_address).first()
+
+            if not device:
+                raise ValueError(f"设备 {mac_address} 不存在")
+
+            # 删除设备
+            session.delete(device)
+        deleted = True
+        logger.info("设备删除成功", extra={"mac_address": mac_address})
         return True
-    except Exception as e:
-        session.rollback()
-        raise e
     finally:
-        session.close()
+        _invalidate_device_cache(mac_address)
+        if deleted:
+            _publish_device_event("delete", mac_address)
   
+@writer_task
 def update_device_info(mac_address, device_name=None, device_type=None, location=None, description=None, status=None):
     """修改设备信息（只能修改除了ID和MAC地址的字段）"""
-    session = get_session(engine_device)
+    changes = {}
+    if status:
+        # 先写入缓冲中更早的状态，避免之后被它覆盖
+        status_write_behind.flush()
     try:
-        # 查找设备
-        device = session.query(DeviceInfo).filter(DeviceInfo.mac_address == mac_address).first()
-        
-        if not device:
-            raise ValueError(f"设备 {mac_address} 不存在")
-        
-        # 只能修改非ID和非MAC地址的字段
-        if device_name:
-            device.device_name = device_name.strip()
-            if _is_device_name_exists(device_name, exclude_mac=mac_address):
-                raise ValueError(f"设备名称 '{device_name}' 已存在")
-        if device_type:
-            device.device_type = device_type.strip()
-        if location:
-            device.location = location.strip()
-        if description:
-            device.description = description.strip()
-        if status:
-            device.status = status
-        
-        session.commit()
-        print(f"设备 {mac_address} 信息更新成功")
+        with session_scope(engine_device) as session:
+            # 查找设备
+            device = session.query(DeviceInfo).filter(DeviceInfo.mac_address == mac_address).first()
+
+            if not device:
+                raise ValueError(f"设备 {mac_address} 不存在")
+
+            # 只能修改非ID和非MAC地址的字段
+            if device_name:
+                # 在同一个会话中检查名称是否被其它设备占用（先查询再赋值，避免自动 flush 触发唯一约束）
+                name_taken = session.query(DeviceInfo.id).filter(
+                    DeviceInfo.device_name == device_name.strip(),
+                    DeviceInfo.mac_address != mac_address
+                ).first()
+                if name_taken:
+                    raise ValueError(f"设备名称 '{device_name}' 已存在")
+                device.device_name = device_name.strip()
+            if device_type:
+                device.device_type = device_type.strip()
+            if location:
+                device.location = location.strip()
+            if description:
+                device.description = description.strip()
+            if status:
+                device.status = status
+                _clear_liveness_marks(session, [mac_address])
+
+            # 记录实际变化的字段，用于发布增量事件
+            for attr in inspect(device).attrs:
+                if attr.history.has_changes():
+                    changes[attr.key] = _format_value(attr.value)
+
+        logger.info("设备信息更新成功", extra={"mac_address": mac_address, "changes": changes})
         return True, ""
     except Exception as e:
-        session.rollback()
+        changes = {}
         error_info = traceback.format_exc()
         return False, str(error_info)
     finally:
-        session.close()
+        _invalidate_device_cache(mac_address)
+        if changes:
+            _publish_device_event("update", mac_address, changes=changes)
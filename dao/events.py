@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import uuid
+import asyncio
+import threading
+from collections import deque
+from config import EVENT_BUFFER_SIZE
+from utils.log import get_logger
+
+logger = get_logger("dao.events")
+
+class EventBus:
+    """进程内的变更事件总线
+
+    DAO 的写函数在事务提交后发布事件，每个事件分配递增的序号并保存在环形缓冲区中，
+    客户端用游标（"{epoch}:{seq}"）断线续传：缓冲区里还有的事件直接补发，
+    已经被淘汰或服务重启过（epoch 不同）时需要重新全量加载。
+
+    同步监听器在发布者的线程中调用；异步等待方（SSE 连接）通过 wait() 在自己的事件循环中被唤醒。
+    """
+
+    def __init__(self, buffer_size=10000):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._listeners = []
+        self._waiters = set()
+
+    def cursor(self):
+        """当前位置的游标，之后发布的事件都能通过 events_after() 取到"""
+        return f"{self.epoch}:{self._seq}"
+
+    def add_listener(self, listener):
+        """注册同步监听器，参数为事件字典"""
+        self._listeners.append(listener)
+
+    def publish(self, event_type, **data):
+        """发布事件，返回带序号的事件字典"""
+        with self._lock:
+            self._seq += 1
+            event = {"seq": self._seq, "type": event_type, "ts": int(time.time() * 1000), **data}
+            self._events.append(event)
+            waiters = list(self._waiters)
+
+        self._wake(waiters)
+        self._notify(event)
+        return event
+
+    def position(self):
+        """(epoch, 最新序号)"""
+        with self._lock:
+            return self.epoch, self._seq
+
+    def follow(self, epoch, event):
+        """多进程部署时副本进程重放主进程发布的事件，保持与主进程相同的 epoch 和序号，
+        客户端的游标在任何 worker 上都有效。重复的事件会被忽略，中间缺失事件时之前的游标全部失效
+        """
+        with self._lock:
+            if epoch == self.epoch and event["seq"] <= self._seq:
+                return
+            if epoch != self.epoch or event["seq"] != self._seq + 1:
+                self.epoch = epoch
+                self._events.clear()
+            self._seq = event["seq"]
+            self._events.append(event)
+            waiters = list(self._waiters)
+
+        self._wake(waiters)
+        self._notify(event)
+
+    def reset(self, epoch=None, seq=0):
+        """丢弃缓冲区中的事件并切换 epoch，之前的游标都需要重新全量加载"""
+        with self._lock:
+            self.epoch = epoch or uuid.uuid4().hex[:8]
+            self._seq = seq
+            self._events.clear()
+            waiters = list(self._waiters)
+        self._wake(waiters)
+
+    def _wake(self, waiters):
+        for loop, ready in waiters:
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                # 等待方的事件循环已经关闭
+                pass
+
+    def _notify(self, event):
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("设备事件监听器执行失败")
+
+    def events_after(self, cursor):
+        """获取游标之后的事件
+
+        Returns:
+            list 或 None: 事件列表；游标无效、过旧或来自之前的进程时返回 None，调用方需要重新全量加载
+        """
+        try:
+            epoch, seq = cursor.split(":")
+            seq = int(seq)
+        except (AttributeError, ValueError):
+            return None
+        with self._lock:
+            if epoch != self.epoch or seq > self._seq:
+                return None
+            if seq == self._seq:
+                return []
+            oldest = self._events[0]["seq"] if self._events else self._seq + 1
+            if seq < oldest - 1:
+                return None
+            return [event for event in self._events if event["seq"] > seq]
+
+    async def wait(self, cursor, timeout):
+        """等待游标之后出现新事件，返回是否有新事件（超时返回 False）"""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        waiter = (loop, ready)
+        with self._lock:
+            if cursor != f"{self.epoch}:{self._seq}":
+                return True
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+# 设备变更事件，由 dao.device_info 的写函数发布
+device_events = EventBus(EVENT_BUFFER_SIZE)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import DB_EXECUTOR_WORKERS
+
+# 所有 DAO 调用共享一个有界线程池，避免同步的 SQLAlchemy 调用阻塞事件循环；
+# 第一次使用时创建，关闭后再次使用（同一进程中重新启动应用，例如多个测试依次启动 TestClient）时重新创建
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    executor = _executor
+    if executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="dao")
+            executor = _executor
+    return executor
+
+async def run_in_db(func, *args, **kwargs):
+    """在数据库线程池中执行同步的 DAO 函数并等待结果
+
+    DB_EXECUTOR_WORKERS 为 0 时直接在当前线程调用（旧的阻塞行为，用于对比测试）；
+    在当前上下文中执行，日志能带上请求的关联 ID
+    """
+    if DB_EXECUTOR_WORKERS <= 0:
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_get_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+def shutdown_db_executor(wait=True):
+    """关闭数据库线程池，等待正在执行的数据库操作完成"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+from sqlalchemy import Column, String, BigInteger, text
+from sqlalchemy.orm import declarative_base
+from config import HA_DISCOVERY_DB
+from dao.database import create_db_engine, session_scope, schema_lock
+
+Base = declarative_base()
+
+class PublishedDiscovery(Base):
+    """已发布到 MQTT 的 Home Assistant discovery 配置
+
+    只保存负载的摘要，同步时与新生成的配置比较，决定哪些主题需要重新发布或清除
+    """
+    __tablename__ = 'ha_discovery_published'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    topic = Column(String(255), primary_key=True, comment='discovery 配置主题')
+    payload_hash = Column(String(40), nullable=False, comment='负载的 sha1 摘要')
+    published_at = Column(BigInteger, nullable=False, comment='发布时间（毫秒）')
+
+# 创建数据库引擎和表
+engine_ha_discovery = create_db_engine(HA_DISCOVERY_DB)
+with schema_lock(HA_DISCOVERY_DB):
+    Base.metadata.create_all(engine_ha_discovery)
+
+_UPSERT_PUBLISHED_SQL = (
+    "INSERT INTO ha_discovery_published (topic, payload_hash, published_at) VALUES (?, ?, ?) "
+    "ON CONFLICT (topic) DO UPDATE SET payload_hash = excluded.payload_hash, published_at = excluded.published_at"
+)
+_DELETE_PUBLISHED_SQL = "DELETE FROM ha_discovery_published WHERE topic = ?"
+
+def get_published_hashes():
+    """获取全部已发布的配置，返回 {topic: payload_hash}"""
+    with session_scope(engine_ha_discovery) as session:
+        rows = session.execute(text("SELECT topic, payload_hash FROM ha_discovery_published"))
+        return {topic: payload_hash for topic, payload_hash in rows}
+
+def record_published(published=(), removed=()):
+    """在一个事务中记录一批已发布的配置和已清除的主题
+
+    Args:
+        published: [(topic, payload_hash)]
+        removed: [topic]
+    """
+    now_ms = int(time.time() * 1000)
+    with engine_ha_discovery.begin() as conn:
+        if published:
+            conn.exec_driver_sql(_UPSERT_PUBLISHED_SQL, [(topic, digest, now_ms) for topic, digest in published])
+        if removed:
+            conn.exec_driver_sql(_DELETE_PUBLISHED_SQL, [(topic,) for topic in removed])
@@ -1,11 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import json
+import hashlib
+import threading
 from datetime import datetime
 from sqlalchemy import Column, Integer, String, Float, Text, DateTime
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import declarative_base
 from config import SENSOR_CONFIG_DB
-from dao.database import create_db_engine, get_session
+from dao.database import create_db_engine, session_scope, schema_lock, DuplicateError
+from dao.cluster import cluster, writer_task
+from utils.log import get_logger
+
+logger = get_logger("dao.sensor_config")
 
 Base = declarative_base()
 
@@ -37,53 +45,127 @@ class SensorConfig(Base):
 
 # 创建设备配置数据库引擎和表
 engine_config = create_db_engine(SENSOR_CONFIG_DB)
-Base.metadata.create_all(engine_config)
+with schema_lock(SENSOR_CONFIG_DB):
+    Base.metadata.create_all(engine_config)
+
+# 全量配置快照，网关启动时批量拉取。任何写操作都会让快照失效，下次读取时重建
+_snapshot = None
+_snapshot_generation = 0
+_snapshot_lock = threading.Lock()
+
+# 配置变化监听器，回调参数为 (device_mac, 新配置字典)，删除时新配置为 None
+_config_listeners = []
+
+def add_config_listener(listener):
+    """注册配置变化监听器，例如报警引擎需要在阈值变化时更新内存中的阈值"""
+    _config_listeners.append(listener)
 
+def _invalidate_config_snapshot():
+    """配置发生变化，丢弃当前快照"""
+    global _snapshot, _snapshot_generation
+    with _snapshot_lock:
+        _snapshot = None
+        _snapshot_generation += 1
+
+def _config_changed(device_mac, config):
+    """配置写入成功后调用：让快照失效并通知监听器，多进程部署时广播给副本进程"""
+    _invalidate_config_snapshot()
+    cluster.broadcast("config", [device_mac, config])
+    for listener in _config_listeners:
+        try:
+            listener(device_mac, config)
+        except Exception:
+            logger.exception("配置变化监听器执行失败", extra={"device_mac": device_mac})
+
+cluster.subscribe("config", lambda payload: _config_changed(*payload))
+cluster.on_reset(_invalidate_config_snapshot)
+
+@writer_task
 def add_device_config(device_mac, report_interval=60, alarm_threshold_min=None, 
                      alarm_threshold_max=None, config_data=None, updated_by=None):
-    """添加设备配置"""
-    session = get_session(engine_config)
+    """添加设备配置，返回新配置的字典；该设备已有配置时抛出 DuplicateError"""
     try:
-        new_config = SensorConfig(
-            device_mac=device_mac,
-            report_interval=report_interval,
-            alarm_threshold_min=alarm_threshold_min,
-            alarm_threshold_max=alarm_threshold_max,
-            config_data=config_data,
-            updated_by=updated_by
-        )
-        session.add(new_config)
-        session.commit()
-        return new_config
-    except Exception as e:
-        session.rollback()
-        raise e
-    finally:
-        session.close()
+        with session_scope(engine_config) as session:
+            new_config = SensorConfig(
+                device_mac=device_mac,
+                report_interval=report_interval,
+                alarm_threshold_min=alarm_threshold_min,
+                alarm_threshold_max=alarm_threshold_max,
+                config_data=config_data,
+                updated_by=updated_by
+            )
+            session.add(new_config)
+            session.flush()
+            result = new_config.to_dict()
+    except IntegrityError as e:
+        raise DuplicateError(f"设备 {device_mac} 的配置已存在") from e
+    _config_changed(device_mac, result)
+    return result
 
 def get_device_config(device_mac):
     """获取设备配置"""
-    session = get_session(engine_config)
-    try:
+    with session_scope(engine_config) as session:
         config = session.query(SensorConfig).filter(SensorConfig.device_mac == device_mac).first()
         return config.to_dict() if config else None
-    finally:
-        session.close()
 
+@writer_task
 def update_device_config(device_mac, **kwargs):
-    """更新设备配置"""
-    session = get_session(engine_config)
-    try:
+    """更新设备配置，值为 None 的字段会被清除；更新后阈值上限小于下限时抛出 ValueError，不做任何修改"""
+    with session_scope(engine_config) as session:
         config = session.query(SensorConfig).filter(SensorConfig.device_mac == device_mac).first()
-        if config:
-            for key, value in kwargs.items():
-                if hasattr(config, key):
-                    setattr(config, key, value)
-            session.commit()
-            return True
-        return False
-    except Exception as e:
-        session.rollback()
-        raise e
-    finally:
-        session.close()
\ No newline at end of file
+        if not config:
+            return False
+        for key, value in kwargs.items():
+            if hasattr(config, key):
+                setattr(config, key, value)
+        # 只更新一侧阈值时要和库中另一侧比较，请求模型只能检查同时给出的两侧
+        low, high = config.alarm_threshold_min, config.alarm_threshold_max
+        if low is not None and high is not None and high < low:
+            raise ValueError(f"报警阈值上限 {high} 不能小于下限 {low}")
+        session.flush()
+        result = config.to_dict()
+    _config_changed(device_mac, result)
+    return True
+
+@writer_task
+def delete_device_config(device_mac):
+    """删除设备配置"""
+    with session_scope(engine_config) as session:
+        deleted = session.query(SensorConfig).filter(SensorConfig.device_mac == device_mac).delete()
+    if deleted:
+        _config_changed(device_mac, None)
+    return deleted > 0
+
+def get_all_device_configs():
+    """获取所有设备配置"""
+    with session_scope(engine_config) as session:
+        configs = session.query(SensorConfig).order_by(SensorConfig.device_mac).all()
+        return [config.to_dict() for config in configs]
+
+def get_config_snapshot():
+    """获取全量配置快照
+
+    快照只在配置变化后的第一次读取时重建，之后直接返回预先序列化好的内容。
+    version 由内容的哈希得到，内容不变时多个进程、多次重启得到的 version 都相同，可以直接作为 ETag
+
+    Returns:
+        (str, bytes): 快照版本号、JSON 格式的快照内容
+    """
+    global _snapshot
+    # 多进程部署时追不上主进程的广播就不使用也不保存快照
+    use_snapshot = cluster.sync()
+    with _snapshot_lock:
+        if _snapshot is not None and use_snapshot:
+            return _snapshot
+        generation = _snapshot_generation
+
+    configs = get_all_device_configs()
+    configs_json = json.dumps(configs, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    version = hashlib.sha1(configs_json.encode('utf-8')).hexdigest()[:16]
+    body = f'{{"version":"{version}","count":{len(configs)},"configs":{configs_json}}}'.encode('utf-8')
+
+    with _snapshot_lock:
+        # 重建期间配置又发生了变化，本次结果只返回不缓存
+        if use_snapshot and generation == _snapshot_generation:
+            _snapshot = (version, body)
+    return version, body
\ No newline at end of file
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+from datetime import datetime
+from sqlalchemy import Column, String, Float, Integer, BigInteger, text
+from sqlalchemy.orm import declarative_base
+from config import TELEMETRY_DB
+from dao.database import create_db_engine, session_scope, schema_lock
+from utils.mac import normalize_mac
+from dao.cluster import writer_task
+
+Base = declarative_base()
+
+class Reading(Base):
+    """设备遥测数据表
+
+    WITHOUT ROWID 表按主键 (device_mac, metric, ts) 聚簇存储，主键本身就是覆盖索引：
+    同一设备同一指标的数据物理上连续，按时间范围查询只需要一次顺序扫描
+    """
+    __tablename__ = 'readings'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    device_mac = Column(String(17), primary_key=True, comment='设备MAC地址')
+    metric = Column(String(32), primary_key=True, comment='指标名称，例如 temperature')
+    ts = Column(BigInteger, primary_key=True, comment='时间戳（毫秒）')
+    value = Column(Float, nullable=False, comment='数值')
+
+class ReadingRollup(Base):
+    """遥测数据预聚合表
+
+    每个 (设备, 指标) 按 1m/1h/1d 三个粒度保存 count/sum/min/max，写入原始数据时在同一事务中增量更新
+    （被覆盖的数据点所在的时间桶重新计算），长时间范围的查询直接读取聚合数据，不需要扫描原始数据
+    """
+    __tablename__ = 'reading_rollups'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    device_mac = Column(String(17), primary_key=True, comment='设备MAC地址')
+    metric = Column(String(32), primary_key=True, comment='指标名称')
+    tier = Column(String(4), primary_key=True, comment='聚合粒度: 1m/1h/1d')
+    bucket_ts = Column(BigInteger, primary_key=True, comment='时间桶起点（毫秒）')
+    count = Column(Integer, nullable=False, comment='数据点数')
+    sum = Column(Float, nullable=False, comment='数值之和')
+    min = Column(Float, nullable=False, comment='最小值')
+    max = Column(Float, nullable=False, comment='最大值')
+
+# 聚合粒度及对应的时间桶宽度（毫秒），从细到粗
+ROLLUP_TIERS = (('1m', 60000), ('1h', 3600000), ('1d', 86400000))
+
+# 创建遥测数据库引擎和表
+engine_telemetry = create_db_engine(TELEMETRY_DB)
+with schema_lock(TELEMETRY_DB):
+    Base.metadata.create_all(engine_telemetry)
+
+# 同一 (设备, 指标, 时间戳) 重复上报时以最后一次为准，设备重发不会报错：
+# 本批数据先写入连接私有的临时表，与原始表按主键关联出已存在的数据点，只有新数据点累加到预聚合中
+_CREATE_INCOMING_SQL = (
+    "CREATE TEMP TABLE IF NOT EXISTS incoming_readings ("
+    "device_mac TEXT NOT NULL, metric TEXT NOT NULL, ts INTEGER NOT NULL, value REAL NOT NULL, "
+    "PRIMARY KEY (device_mac, metric, ts)) WITHOUT ROWID"
+)
+_INSERT_INCOMING_SQL = "INSERT OR REPLACE INTO temp.incoming_readings (device_mac, metric, ts, value) VALUES (?, ?, ?, ?)"
+_SELECT_EXISTING_SQL = (
+    "SELECT i.device_mac, i.metric, i.ts, r.value FROM temp.incoming_readings AS i "
+    "JOIN readings AS r ON r.device_mac = i.device_mac AND r.metric = i.metric AND r.ts = i.ts"
+)
+_INSERT_READING_SQL = "INSERT INTO readings (device_mac, metric, ts, value) VALUES (?, ?, ?, ?)"
+_UPDATE_READING_SQL = "UPDATE readings SET value = ? WHERE device_mac = ? AND metric = ? AND ts = ?"
+
+# 预聚合的增量更新：count/sum 累加，min/max 取极值，只用于新数据点
+_UPSERT_ROLLUP_SQL = (
+    "INSERT INTO reading_rollups (device_mac, metric, tier, bucket_ts, count, sum, min, max) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (device_mac, metric, tier, bucket_ts) DO UPDATE SET "
+    "count = count + excluded.count, sum = sum + excluded.sum, "
+    "min = MIN(min, excluded.min), max = MAX(max, excluded.max)"
+)
+
+# 数值被覆盖的时间桶重新计算：最细的粒度从原始数据汇总，更粗的粒度由上一级聚合合并
+_REBUILD_FINEST_ROLLUP_SQL = (
+    "INSERT OR REPLACE INTO reading_rollups (device_mac, metric, tier, bucket_ts, count, sum, min, max) "
+    "SELECT device_mac, metric, ?, ?, COUNT(*), SUM(value), MIN(value), MAX(value) FROM readings "
+    "WHERE device_mac = ? AND metric = ? AND ts >= ? AND ts < ? GROUP BY device_mac, metric"
+)
+_REBUILD_COARSER_ROLLUP_SQL = (
+    "INSERT OR REPLACE INTO reading_rollups (device_mac, metric, tier, bucket_ts, count, sum, min, max) "
+    "SELECT device_mac, metric, ?, ?, SUM(count), SUM(sum), MIN(min), MAX(max) FROM reading_rollups "
+    "WHERE device_mac = ? AND metric = ? AND tier = ? AND bucket_ts >= ? AND bucket_ts < ? GROUP BY device_mac, metric"
+)
+
+def _parse_timestamp(ts):
+    """把时间戳转换为毫秒，支持秒级 epoch（int/float）和 ISO 格式字符串，None 表示当前时间"""
+    if ts is None:
+        return int(time.time() * 1000)
+    if isinstance(ts, (int, float)) and not isinstance(ts, bool):
+        return int(ts * 1000)
+    if isinstance(ts, str):
+        return int(datetime.fromisoformat(ts).timestamp() * 1000)
+    raise ValueError(f"时间戳格式不正确: {ts}")
+
+def parse_reading(record):
+    """校验并规范化一条遥测数据
+
+    Args:
+        record: dict，包含 mac_address、metric、value，可选 ts（秒级 epoch 或 ISO 字符串）
+
+    Returns:
+        tuple: (device_mac, metric, ts_ms, value)
+
+    Raises:
+        ValueError: 数据不合法
+    """
+    if not isinstance(record, dict):
+        raise ValueError("遥测数据必须是对象")
+
+    device_mac = normalize_mac(record.get('mac_address'))
+    if not device_mac:
+        raise ValueError("MAC地址格式不正确")
+
+    metric = record.get('metric')
+    if not metric or not isinstance(metric, str) or len(metric) > 32:
+        raise ValueError("指标名称不能为空且长度不能超过32个字符")
+
+    value = record.get('value')
+    if isinstance(value, bool):
+        value = float(value)
+    if not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError("数值必须是有限的数字")
+
+    try:
+        ts_ms = _parse_timestamp(record.get('ts'))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"时间戳格式不正确: {record.get('ts')}")
+
+    return device_mac, metric, ts_ms, float(value)
+
+def add_readings(records, chunk_size=5000):
+    """批量写入遥测数据
+
+    每块数据在一个事务中用 executemany 写入，绕过 ORM 对象构造
+
+    Args:
+        records: 遥测数据字典列表，格式见 parse_reading
+        chunk_size: 每个事务写入的条数
+
+    Returns:
+        (int, list): 写入成功的条数、[(序号, 错误信息)] 列表
+    """
+    rows, errors = parse_readings(records)
+    add_reading_rows(rows, chunk_size)
+    return len(rows), errors
+
+def parse_readings(records):
+    """逐条校验遥测数据
+
+    Returns:
+        (list, list): 规范化后的 (device_mac, metric, ts_ms, value) 列表、[(序号, 错误信息)] 列表
+    """
+    rows = []
+    errors = []
+    for index, record in enumerate(records):
+        try:
+            rows.append(parse_reading(record))
+        except ValueError as e:
+            errors.append((index, str(e)))
+    return rows, errors
+
+@writer_task
+def add_reading_rows(rows, chunk_size=5000):
+    """写入已经规范化的 (device_mac, metric, ts_ms, value) 元组，同时更新预聚合数据
+
+    同一 (设备, 指标, 时间戳) 重复上报时以最后一次为准：数值相同的重发（例如 MQTT QoS1 重投）不写入也不计数，
+    数值不同时覆盖原始数据，并从原始数据重新计算所在的时间桶，预聚合始终与原始表一致
+    """
+    for start in range(0, len(rows), chunk_size):
+        with engine_telemetry.begin() as conn:
+            _write_reading_chunk(conn, rows[start:start + chunk_size])
+
+def _write_reading_chunk(conn, chunk):
+    """在一个事务中写入一块原始数据并更新预聚合"""
+    # 本批内部重复的数据点同样以最后一次为准
+    latest = {(device_mac, metric, ts): value for device_mac, metric, ts, value in chunk}
+    conn.exec_driver_sql(_CREATE_INCOMING_SQL)
+    conn.exec_driver_sql("DELETE FROM temp.incoming_readings")
+    conn.exec_driver_sql(_INSERT_INCOMING_SQL, [(*key, value) for key, value in latest.items()])
+    existing = {(device_mac, metric, ts): value for device_mac, metric, ts, value in conn.exec_driver_sql(_SELECT_EXISTING_SQL)}
+    conn.exec_driver_sql("DELETE FROM temp.incoming_readings")
+
+    new_rows = []
+    changed_rows = []
+    for key, value in latest.items():
+        old_value = existing.get(key)
+        if old_value is None:
+            new_rows.append((*key, value))
+        elif old_value != value:
+            changed_rows.append((*key, value))
+
+    if new_rows:
+        conn.exec_driver_sql(_INSERT_READING_SQL, new_rows)
+        conn.exec_driver_sql(_UPSERT_ROLLUP_SQL, _aggregate_rollups(new_rows))
+    if changed_rows:
+        conn.exec_driver_sql(_UPDATE_READING_SQL, [(value, mac, metric, ts) for mac, metric, ts, value in changed_rows])
+        _rebuild_rollups(conn, changed_rows)
+
+def _rebuild_rollups(conn, rows):
+    """从原始数据重新计算这些数据点所在的各粒度时间桶（在原始数据写入之后调用）"""
+    (finest_tier, finest_ms), coarser_tiers = ROLLUP_TIERS[0], ROLLUP_TIERS[1:]
+    buckets = {(mac, metric, ts - ts % finest_ms) for mac, metric, ts, _ in rows}
+    conn.exec_driver_sql(_REBUILD_FINEST_ROLLUP_SQL, [
+        (finest_tier, bucket_ts, mac, metric, bucket_ts, bucket_ts + finest_ms) for mac, metric, bucket_ts in buckets
+    ])
+    finer_tier = finest_tier
+    for tier, bucket_ms in coarser_tiers:
+        buckets = {(mac, metric, ts - ts % bucket_ms) for mac, metric, ts in buckets}
+        conn.exec_driver_sql(_REBUILD_COARSER_ROLLUP_SQL, [
+            (tier, bucket_ts, mac, metric, finer_tier, bucket_ts, bucket_ts + bucket_ms) for mac, metric, bucket_ts in buckets
+        ])
+        finer_tier = tier
+
+def _aggregate_rollups(rows):
+    """把一批原始数据聚合为各粒度的 (device_mac, metric, tier, bucket_ts, count, sum, min, max)
+
+    先按最细的 1m 聚合，更粗的粒度由 1m 的结果合并，逐条处理只做一遍
+    """
+    (finest_tier, finest_ms), coarser_tiers = ROLLUP_TIERS[0], ROLLUP_TIERS[1:]
+    buckets = {}
+    for device_mac, metric, ts, value in rows:
+        key = (device_mac, metric, ts - ts % finest_ms)
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [1, value, value, value]
+        else:
+            bucket[0] += 1
+            bucket[1] += value
+            if value < bucket[2]:
+                bucket[2] = value
+            elif value > bucket[3]:
+                bucket[3] = value
+
+    result = [(mac, metric, finest_tier, ts, *bucket) for (mac, metric, ts), bucket in buckets.items()]
+    for tier, bucket_ms in coarser_tiers:
+        merged = {}
+        for (device_mac, metric, ts), (count, total, low, high) in buckets.items():
+            key = (device_mac, metric, ts - ts % bucket_ms)
+            bucket = merged.get(key)
+            if bucket is None:
+                merged[key] = [count, total, low, high]
+            else:
+                bucket[0] += count
+                bucket[1] += total
+                bucket[2] = min(bucket[2], low)
+                bucket[3] = max(bucket[3], high)
+        result.extend((mac, metric, tier, ts, *bucket) for (mac, metric, ts), bucket in merged.items())
+        buckets = merged
+    return result
+
+def get_rollups(device_mac, metric, tier, start_ts, end_ts):
+    """查询某个粒度的预聚合数据
+
+    Returns:
+        list: [(bucket_ts, count, sum, min, max)]，按时间升序
+    """
+    with session_scope(engine_telemetry) as session:
+        rows = session.execute(text(
+            "SELECT bucket_ts, count, sum, min, max FROM reading_rollups "
+            "WHERE device_mac = :mac AND metric = :metric AND tier = :tier "
+            "AND bucket_ts >= :start_ts AND bucket_ts < :end_ts ORDER BY bucket_ts"
+        ), {'mac': device_mac, 'metric': metric, 'tier': tier, 'start_ts': start_ts, 'end_ts': end_ts})
+        return [tuple(row) for row in rows]
+
+def get_readings(device_mac, metric, start_ts=None, end_ts=None, limit=None):
+    """按时间范围查询某个设备某个指标的原始数据
+
+    Args:
+        device_mac: 设备MAC地址
+        metric: 指标名称
+        start_ts: 起始时间（毫秒，包含）
+        end_ts: 结束时间（毫秒，不包含）
+        limit: 最多返回条数
+
+    Returns:
+        list: [(ts_ms, value)]，按时间升序
+    """
+    sql = "SELECT ts, value FROM readings WHERE device_mac = :mac AND metric = :metric"
+    params = {'mac': device_mac, 'metric': metric}
+    if start_ts is not None:
+        sql += " AND ts >= :start_ts"
+        params['start_ts'] = start_ts
+    if end_ts is not None:
+        sql += " AND ts < :end_ts"
+        params['end_ts'] = end_ts
+    sql += " ORDER BY ts"
+    if limit is not None:
+        sql += " LIMIT :limit"
+        params['limit'] = limit
+
+    with session_scope(engine_telemetry) as session:
+        return [tuple(row) for row in session.execute(text(sql), params)]
+
+def get_metrics(device_mac):
+    """获取某个设备上报过的全部指标名称"""
+    with session_scope(engine_telemetry) as session:
+        rows = session.execute(
+            text("SELECT DISTINCT metric FROM readings WHERE device_mac = :mac"), {'mac': device_mac}
+        )
+        return sorted(row[0] for row in rows)
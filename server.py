@@ -3,33 +3,140 @@
 # PEP 8 compliant
 # Author: Jokker
 
-import time
-import redis
 import json
-import requests
 import traceback
-import copy
 import os
 import re
-from fastapi import FastAPI, Request, HTTPException, status, Query, Path
-from fastapi.responses import FileResponse, JSONResponse
+import csv
+import uuid
+import asyncio
+from fastapi import FastAPI, Request, Response, HTTPException, status, Query, Path, Header
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import datetime
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, Field, validator
-import numpy as np
-from scipy import signal
+from pydantic import BaseModel, Field, validator, ValidationError
 from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
-from dao.sensor_config import SensorConfig
-from dao.device_info import DeviceInfo, DeviceStatus, add_device, get_all_devices, get_device_by_mac, update_device_status, delete_device, update_device_info, validate_mac_address
+from utils.metrics import registry, MetricsMiddleware
+from utils.log import setup_logging, get_logger, log_stats, RequestLogMiddleware
+from utils.mac import normalize_mac, mac_cache_stats
+from config import LOG_LEVEL, LOG_SAMPLE_RATE, LOG_RATE_LIMIT, LOG_RATE_WINDOW, LOG_QUEUE_SIZE, METRICS_ENABLED, IMPORT_CHUNK_SIZE, ALARM_HYSTERESIS, STATUS_WRITE_BEHIND, LIVENESS_DEFAULT_INTERVAL, LIVENESS_TIMEOUT_FACTOR, LIVENESS_MAX_DEVICES, HA_DISCOVERY_PREFIX, MQTT_BROKER, MQTT_PORT, MQTT_TOPIC_PREFIX, MQTT_CLIENT_ID, MQTT_PUBLISHER_POOL_SIZE, MQTT_BATCH_SIZE, MQTT_FLUSH_INTERVAL
+from dao.sensor_config import SensorConfig, add_device_config, get_device_config, update_device_config, delete_device_config, get_all_device_configs, get_config_snapshot, add_config_listener
+from dao.executor import run_in_db, shutdown_db_executor
+from dao.cluster import cluster, primary_task, writer_task
+from dao.database import DuplicateError
+from dao.events import device_events
+from dao.telemetry import parse_readings, add_reading_rows, get_readings, get_rollups, get_metrics, ROLLUP_TIERS
+from services import downsample
+from services.alarm_engine import AlarmEngine
+from services.mqtt_bridge import MqttBridge
+from services.ha_discovery import DiscoverySync
+from services.liveness import LivenessTracker
+from services.device_export import EXPORT_FORMATS, stream_export
+from services.device_import import AsyncStreamReader, import_devices
+from dao.device_info import DeviceInfo, DeviceStatus, add_device, get_all_devices, get_device_by_mac, update_device_status, delete_device, update_device_info, query_devices, iter_device_records, add_devices_bulk, device_cache, get_device_summary, rebuild_device_summary, update_devices_liveness, status_write_behind, get_import_checkpoint
+
+# 设备列表和单个设备的响应用 orjson 预先序列化，比标准库 json 快数倍；没有安装时退回标准库
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 结构化日志：JSON 格式，经队列由后台线程写出，不阻塞事件循环
+setup_logging(level=LOG_LEVEL, sample_rate=LOG_SAMPLE_RATE, rate_limit=LOG_RATE_LIMIT,
+              rate_window=LOG_RATE_WINDOW, queue_size=LOG_QUEUE_SIZE)
+logger = get_logger("server")
 
 app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
 # app.include_router(vis_router)
 
 app.mount("/static", StaticFiles(directory="./templates"), name="static")
 
+# 按路由模板统计请求耗时，IOT_METRICS=0 时不挂载中间件
+http_request_seconds = registry.histogram(
+    "iot_http_request_duration_seconds", "HTTP 请求耗时（秒）", ("method", "route", "status")
+)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, histogram=http_request_seconds)
+# 最外层：分配请求关联 ID 并记录访问日志
+app.add_middleware(RequestLogMiddleware)
+
+# 阈值报警引擎，启动时加载全部配置，之后随配置的增删改增量更新
+alarm_engine = AlarmEngine(default_hysteresis=ALARM_HYSTERESIS)
+add_config_listener(alarm_engine.update_config)
+
+def _persist_liveness(online_macs, offline_macs):
+    """心跳检测的上线/离线变化写入设备表，心跳本身不写数据库"""
+    update_devices_liveness(online_macs, online=True)
+    update_devices_liveness(offline_macs, online=False)
+
+# 心跳在线检测，上报间隔取设备配置的 report_interval，只跟踪已登记的设备
+liveness_tracker = LivenessTracker(
+    on_transitions=_persist_liveness,
+    default_interval=LIVENESS_DEFAULT_INTERVAL,
+    timeout_factor=LIVENESS_TIMEOUT_FACTOR,
+    max_devices=LIVENESS_MAX_DEVICES
+)
+add_config_listener(liveness_tracker.update_config)
+device_events.add_listener(liveness_tracker.on_device_event)
+
+# MQTT 桥接和 Home Assistant 自动发现同步，配置了 IOT_MQTT_BROKER 时在启动时连接
+mqtt_bridge = None
+discovery_sync = None
+
+@app.on_event("startup")
+async def startup_event():
+    """服务启动时确定多进程部署中的角色，重建设备汇总表，加载报警阈值和上报间隔，按设备表中的在线设备启动心跳检测、MQTT 桥接并同步 Home Assistant 自动发现配置"""
+    global mqtt_bridge, discovery_sync
+    if cluster.start() == "replica":
+        # 多进程部署的副本进程只处理 HTTP 请求，写操作和后台任务都在主进程中
+        return
+    await run_in_db(rebuild_device_summary)
+    if STATUS_WRITE_BEHIND:
+        status_write_behind.start()
+    configs = await run_in_db(get_all_device_configs)
+    alarm_engine.load(configs)
+    liveness_tracker.load_intervals(configs)
+    devices = await run_in_db(get_all_devices)
+    liveness_tracker.load_devices(device.mac_address for device in devices)
+    # 设备表中在线的设备如果再也不上报，超时后也要判定为离线
+    liveness_tracker.seed(device.mac_address for device in devices if device.status == DeviceStatus.ACTIVE.value)
+    liveness_tracker.start()
+    if MQTT_BROKER:
+        mqtt_bridge = MqttBridge(
+            MQTT_BROKER, MQTT_PORT,
+            topic_prefix=MQTT_TOPIC_PREFIX,
+            client_id=MQTT_CLIENT_ID,
+            publisher_pool_size=MQTT_PUBLISHER_POOL_SIZE,
+            batch_size=MQTT_BATCH_SIZE,
+            flush_interval=MQTT_FLUSH_INTERVAL,
+            on_readings=_ingest_rows,
+            on_status=_apply_device_statuses,
+            on_heartbeat=liveness_tracker.heartbeats
+        )
+        mqtt_bridge.start()
+        discovery_sync = DiscoverySync(
+            mqtt_bridge.publish,
+            topic_prefix=MQTT_TOPIC_PREFIX,
+            discovery_prefix=HA_DISCOVERY_PREFIX
+        )
+        discovery_sync.request_sync()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """服务关闭时写入 MQTT 桥接中未写入的消息、未持久化的在线状态变化和写后缓冲中的设备状态，等待数据库线程池中的操作完成"""
+    if discovery_sync is not None:
+        discovery_sync.cancel()
+    if mqtt_bridge is not None:
+        mqtt_bridge.stop()
+    liveness_tracker.stop()
+    if cluster.role != "replica":
+        status_write_behind.stop()
+    cluster.stop()
+    shutdown_db_executor()
+
 # Pydantic 模型定义
 class DeviceCreateRequest(BaseModel):
     """设备创建请求模型"""
@@ -43,10 +150,11 @@ class DeviceCreateRequest(BaseModel):
 
     @validator('mac_address')
     def validate_mac_address(cls, v):
-        """验证MAC地址格式"""
-        if not re.match(r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$', v):
+        """验证并规范化MAC地址格式"""
+        normalized = normalize_mac(v)
+        if not normalized:
             raise ValueError('MAC地址格式不正确，应为 00:1A:2B:3C:4D:5E 格式')
-        return v.upper()
+        return normalized
 
 
 # 添加全局异常处理来捕获验证错误
@@ -61,14 +169,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
             "type": error["type"]
         })
     
-    print("=== 422验证错误详情 ===")
-    print(f"错误数量: {len(exc.errors())}")
-    for i, error in enumerate(exc.errors()):
-        print(f"错误 {i+1}:")
-        print(f"  位置: {error['loc']}")
-        print(f"  类型: {error['type']}")
-        print(f"  信息: {error['msg']}")
-    print("=====================")
+    logger.warning("请求数据验证失败", extra={"path": request.url.path, "errors": error_details})
     
     return JSONResponse(
         status_code=422,
@@ -115,6 +216,50 @@ class DeviceResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class SensorConfigCreateRequest(BaseModel):
+    """设备配置创建请求模型"""
+    device_mac: str = Field(..., description="设备MAC地址")
+    report_interval: int = Field(60, description="上报间隔(秒)", gt=0)
+    alarm_threshold_min: Optional[float] = Field(None, description="报警阈值下限")
+    alarm_threshold_max: Optional[float] = Field(None, description="报警阈值上限")
+    config_data: Optional[str] = Field(None, description="其他配置信息(JSON格式)")
+    updated_by: Optional[str] = Field(None, description="最后修改人", max_length=50)
+
+    @validator('device_mac')
+    def validate_device_mac(cls, v):
+        normalized = normalize_mac(v)
+        if not normalized:
+            raise ValueError('MAC地址格式不正确，应为 00:1A:2B:3C:4D:5E 格式')
+        return normalized
+
+    @validator('alarm_threshold_max')
+    def validate_threshold(cls, v, values):
+        low = values.get('alarm_threshold_min')
+        if v is not None and low is not None and v < low:
+            raise ValueError('报警阈值上限不能小于下限')
+        return v
+
+class SensorConfigUpdateRequest(BaseModel):
+    """设备配置更新请求模型：未给出的字段不修改，显式给出 null 表示清除该字段"""
+    report_interval: Optional[int] = Field(None, description="上报间隔(秒)", gt=0)
+    alarm_threshold_min: Optional[float] = Field(None, description="报警阈值下限，null 表示取消下限")
+    alarm_threshold_max: Optional[float] = Field(None, description="报警阈值上限，null 表示取消上限")
+    config_data: Optional[str] = Field(None, description="其他配置信息(JSON格式)")
+    updated_by: Optional[str] = Field(None, description="最后修改人", max_length=50)
+
+    @validator('report_interval')
+    def validate_report_interval(cls, v):
+        if v is None:
+            raise ValueError('上报间隔不能清除')
+        return v
+
+    @validator('alarm_threshold_max')
+    def validate_threshold(cls, v, values):
+        low = values.get('alarm_threshold_min')
+        if v is not None and low is not None and v < low:
+            raise ValueError('报警阈值上限不能小于下限')
+        return v
+
 class StatusUpdateRequest(BaseModel):
     """状态更新请求模型"""
     status: DeviceStatus
@@ -132,6 +277,14 @@ class ErrorResponse(BaseModel):
     details: Optional[str] = None
 
 # 工具函数
+def json_bytes_response(content, headers: Dict[str, str] = None) -> Response:
+    """预先序列化好的 JSON 响应，与导出接口一样直接返回字节，不再经过 jsonable_encoder 和响应类"""
+    if orjson is not None:
+        body = orjson.dumps(content)
+    else:
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return Response(content=body, media_type="application/json", headers=headers)
+
 def create_success_response(message: str, data: Dict[str, Any] = None) -> JSONResponse:
     """创建成功响应"""
     return JSONResponse(
@@ -146,63 +299,170 @@ def create_error_response(error: str, details: str = None, status_code: int = st
         content=ErrorResponse(error=error, details=details).dict()
     )
 
+# Home Assistant 自动发现配置只和这些字段有关
+_DISCOVERY_FIELDS = {"device_name", "device_type", "location"}
+
+def _on_device_event(event):
+    """设备增删或名称、类型、位置变化后，合并触发一次 Home Assistant 自动发现同步"""
+    if discovery_sync is None:
+        return
+    if event["op"] != "update" or _DISCOVERY_FIELDS & event["changes"].keys():
+        discovery_sync.request_sync()
+
+device_events.add_listener(_on_device_event)
+
 # API 路由
+
 @app.get("/")
 async def root():
     """根路径"""
     return {"message": "设备管理API服务", "version": "1.0.0"}
 
-@app.get("/api/devices", response_model=List[DeviceResponse])
+@app.get("/api/devices")
 async def get_devices(
-    status: Optional[DeviceStatus] = Query(None, description="按状态筛选设备"),
-    device_type: Optional[str] = Query(None, description="按设备类型筛选")
+    device_status: Optional[DeviceStatus] = Query(None, alias="status", description="按状态筛选设备"),
+    device_type: Optional[str] = Query(None, description="按设备类型筛选"),
+    location: Optional[str] = Query(None, description="按安装位置筛选"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="每页条数，不传则返回全部"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
+    sort: str = Query("id", description="排序字段，前缀 - 表示倒序，例如 -created_at"),
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，例如 mac_address,device_name")
 ):
     """
-    获取所有设备列表
-    - 支持按状态和设备类型筛选
+    获取设备列表
+    - 支持按状态、设备类型和安装位置筛选
+    - 支持 limit/cursor 游标分页，sort 排序，fields 字段投影
+    - 响应头 X-Total-Count 为满足筛选条件的总数，X-Next-Cursor 为下一页游标
     """
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    # 在查询之前取变更游标，查询期间发生的变更会在订阅时重放，客户端按 MAC 覆盖即可
+    change_cursor = device_events.cursor()
     try:
-        devices = get_all_devices()
-        
-        # 筛选逻辑
-        filtered_devices = devices
-        if status:
-            filtered_devices = [d for d in filtered_devices if d['status'] == status.value]
-        if device_type:
-            filtered_devices = [d for d in filtered_devices if d['device_type'] == device_type]
-        
-        return filtered_devices
+        devices, next_cursor, total = await run_in_db(
+            query_devices,
+            status=device_status,
+            device_type=device_type,
+            location=location,
+            sort=sort,
+            limit=limit,
+            cursor=cursor,
+            fields=field_list
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"获取设备列表失败: {str(e)}"
         )
 
-@app.get("/api/devices/{mac_address}", response_model=DeviceResponse)
+    headers = {"X-Total-Count": str(total), "X-Change-Cursor": change_cursor}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return json_bytes_response(devices, headers=headers)
+
+# SSE 心跳间隔（秒），防止代理因连接空闲而断开
+_SSE_KEEPALIVE = 15
+
+def _sse_message(event_name, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id else []
+    lines.append(f"event: {event_name}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+@app.get("/api/devices/changes")
+async def device_changes(
+    request: Request,
+    since: Optional[str] = Query(None, description="变更游标，取自 GET /api/devices 的响应头 X-Change-Cursor"),
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    设备变更订阅（Server-Sent Events）
+    - 每个事件的 id 为游标，断线后浏览器通过 Last-Event-ID 自动续传
+    - event: device 为增量变更，data.op 为 create（device 为完整字段）、update（changes 为变化的字段）或 delete
+    - event: reset 表示游标过旧或服务已重启，客户端需要重新加载设备列表并使用 data.cursor 重新订阅
+    """
+    cursor = last_event_id or since or device_events.cursor()
+
+    async def stream():
+        nonlocal cursor
+        yield "retry: 3000\n\n"
+        while not await request.is_disconnected():
+            events = device_events.events_after(cursor)
+            if events is None:
+                cursor = device_events.cursor()
+                yield _sse_message("reset", {"cursor": cursor})
+                continue
+            for event in events:
+                cursor = f"{device_events.epoch}:{event['seq']}"
+                yield _sse_message(event["type"], event, cursor)
+            if not await device_events.wait(cursor, _SSE_KEEPALIVE):
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/devices/export")
+async def export_devices(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$", description="导出格式：ndjson 或 csv"),
+    gzip: bool = Query(False, description="是否边导出边 gzip 压缩"),
+    device_status: Optional[DeviceStatus] = Query(None, alias="status", description="按状态筛选设备"),
+    device_type: Optional[str] = Query(None, description="按设备类型筛选"),
+    location: Optional[str] = Query(None, description="按安装位置筛选")
+):
+    """
+    流式导出设备注册表
+    - 按 id 顺序逐批读取、编码并发送，内存占用与设备总数无关
+    - 字段与 GET /api/devices 相同；CSV 带 BOM 和表头
+    - gzip=true 时返回 .gz 文件（Content-Type: application/gzip）
+    """
+    batches = iter_device_records(status=device_status, device_type=device_type, location=location)
+    filename = f"devices-{datetime.datetime.now():%Y%m%d%H%M%S}.{export_format}"
+    media_type = EXPORT_FORMATS[export_format]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        stream_export(batches, export_format, compress=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"}
+    )
+
+# 直接返回预先序列化的字节，不经过 response_model 校验；DeviceResponse 只用于在 OpenAPI 中描述响应
+@app.get("/api/devices/{mac_address}", responses={200: {"model": DeviceResponse}})
 async def get_device(mac_address: str = Path(..., description="设备MAC地址")):
     """
     根据MAC地址获取设备详细信息
     """
     try:
         # 验证MAC地址格式
-        normalized_mac = validate_mac_address(mac_address)
+        normalized_mac = normalize_mac(mac_address)
         if not normalized_mac:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="MAC地址格式不正确"
             )
         
-        device = get_device_by_mac(normalized_mac)
+        device = await run_in_db(get_device_by_mac, normalized_mac)
         if not device:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"设备 {normalized_mac} 不存在"
             )
         
-        return device
+        # 缓存中的字典已经是 to_dict 的结果，直接序列化，不再经过 DeviceResponse 校验
+        return json_bytes_response(device)
+    except HTTPException:
+        raise
     except Exception as e:
         error_info = traceback.format_exc()
-        print(error_info)        
+        logger.exception("查询设备失败", extra={"mac_address": mac_address})
         return {"status": "failed", "error_info": f"{error_info}"}
 
 @app.post("/api/devices")
@@ -214,7 +474,8 @@ async def create_device(device_data: DeviceCreateRequest):
     """
         
     try:
-        status, msg = add_device(
+        status, msg = await run_in_db(
+            add_device,
             mac_address=device_data.mac_address,
             device_name=device_data.device_name,
             device_type=device_data.device_type,
@@ -231,10 +492,115 @@ async def create_device(device_data: DeviceCreateRequest):
     except Exception as e:
         
         error_info = traceback.format_exc()
-        print(error_info)
+        logger.exception("创建设备失败", extra={"mac_address": device_data.mac_address})
         
         return {"status": "failed", "error_info": f"{error_info}"}
 
+async def _read_json_records(request: Request) -> list:
+    """读取 JSON 数组或 NDJSON（Content-Type 含 ndjson）格式的请求体"""
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    try:
+        if "ndjson" in content_type:
+            records = [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+        else:
+            records = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"请求体解析失败: {str(e)}"
+        )
+    if not isinstance(records, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="请求体必须是 JSON 数组或 NDJSON"
+        )
+    return records
+
+@app.post("/api/devices/bulk")
+async def create_devices_bulk(request: Request):
+    """
+    批量创建设备
+    - 请求体为 DeviceCreateRequest 的 JSON 数组，或 Content-Type 为 application/x-ndjson 的逐行 JSON
+    - 每条记录单独返回成功或失败原因，失败的记录不影响其它记录
+    """
+    records = await _read_json_records(request)
+
+    # 先统一校验全部记录，只有校验通过的记录才交给数据库
+    results = [None] * len(records)
+    valid_indexes = []
+    valid_devices = []
+    for index, record in enumerate(records):
+        try:
+            device_data = DeviceCreateRequest.parse_obj(record)
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "failed", "error_info": f"数据验证失败:{str(e)}"}
+            continue
+        valid_indexes.append(index)
+        valid_devices.append(device_data.dict())
+
+    db_results = await run_in_db(add_devices_bulk, valid_devices)
+    for index, device, (success, msg) in zip(valid_indexes, valid_devices, db_results):
+        if success:
+            results[index] = {"index": index, "mac_address": device["mac_address"], "status": "success"}
+        else:
+            results[index] = {"index": index, "mac_address": device["mac_address"], "status": "failed", "error_info": msg}
+
+    succeeded = sum(1 for r in results if r["status"] == "success")
+    return {
+        "status": "success" if succeeded == len(results) else "failed",
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }
+
+@app.post("/api/devices/import")
+async def import_devices_file(
+    request: Request,
+    import_id: Optional[str] = Query(None, max_length=64, pattern=r"^[\w.-]+$", description="导入任务ID，中断后用同一个ID重新上传即可续传"),
+    import_format: Optional[str] = Query(None, alias="format", pattern="^(ndjson|csv)$", description="文件格式，未指定时按 Content-Type 判断")
+):
+    """
+    流式导入其它站点导出的设备注册表（CSV 或 NDJSON，可以 gzip 压缩）
+    - 按 MAC 地址新增或更新设备，与现有设备相同的行不写入
+    - 每 IMPORT_CHUNK_SIZE 行在一个事务中写入并记录断点；中断后用同一个 import_id 重新上传同一个文件，从断点继续
+    - 返回累计的新增、更新、未变化、失败行数和本次导入的前 100 个错误
+    """
+    if import_format is None:
+        content_type = request.headers.get("content-type", "")
+        import_format = "csv" if "csv" in content_type else "ndjson"
+    import_id = import_id or uuid.uuid4().hex
+
+    fileobj = AsyncStreamReader(request.stream(), asyncio.get_running_loop())
+    try:
+        summary = await run_in_db(import_devices, import_id, fileobj, import_format, IMPORT_CHUNK_SIZE)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except (UnicodeDecodeError, OSError, EOFError, csv.Error) as e:
+        # 编码错误、损坏的 gzip 或 CSV：已提交的块保留在断点中
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"导入文件解析失败: {str(e)}"
+        )
+    return dict(summary, status="success" if summary["failed"] == 0 else "failed")
+
+@app.get("/api/devices/import/{import_id}")
+async def get_import_status(import_id: str = Path(..., description="导入任务ID")):
+    """
+    查询导入任务的进度（断点）
+    """
+    checkpoint = await run_in_db(get_import_checkpoint, import_id)
+    if checkpoint is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"导入任务 {import_id} 不存在"
+        )
+    return checkpoint
+
 @app.put("/api/devices/{mac_address}")
 async def update_device(
     mac_address: str = Path(..., description="设备MAC地址"),
@@ -247,7 +613,7 @@ async def update_device(
     """
     try:
         # 验证MAC地址格式
-        normalized_mac = validate_mac_address(mac_address)
+        normalized_mac = normalize_mac(mac_address)
         if not normalized_mac:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -255,7 +621,7 @@ async def update_device(
             )
         
         # 检查设备是否存在
-        existing_device = get_device_by_mac(normalized_mac)
+        existing_device = await run_in_db(get_device_by_mac, normalized_mac)
         if not existing_device:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -278,7 +644,7 @@ async def update_device(
         if not update_dict:
             return {"status": "success", "info": f"未修改任何内容"}
             
-        status, msg = update_device_info(normalized_mac, **update_dict)
+        status, msg = await run_in_db(update_device_info, normalized_mac, **update_dict)
         if status:
             return {"status": "success", "info": f"修改成功"}
         else:
@@ -295,33 +661,27 @@ async def update_device_status_api(
     """
     更新设备状态
     - 只更新设备状态字段
+    - 开启写后缓冲（IOT_STATUS_WRITE_BEHIND）时状态稍后批量写入，返回的设备信息已包含新状态
     """
     try:
         # 验证MAC地址格式
-        normalized_mac = validate_mac_address(mac_address)
+        normalized_mac = normalize_mac(mac_address)
         if not normalized_mac:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="MAC地址格式不正确"
             )
         
-        # 检查设备是否存在
-        existing_device = get_device_by_mac(normalized_mac)
-        if not existing_device:
+        # 设备不存在时返回 False
+        success = await run_in_db(update_device_status, normalized_mac, status_data.status)
+        if not success:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"设备 {normalized_mac} 不存在"
             )
         
-        success = update_device_status(normalized_mac, status_data.status)
-        if not success:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="更新设备状态失败"
-            )
-        
         # 返回更新后的设备信息
-        updated_device = get_device_by_mac(normalized_mac)
+        updated_device = await run_in_db(get_device_by_mac, normalized_mac)
         return updated_device
     except HTTPException:
         raise
@@ -339,7 +699,7 @@ async def remove_device(mac_address: str = Path(..., description="设备MAC地
     """
     try:
         # 验证MAC地址格式
-        normalized_mac = validate_mac_address(mac_address)
+        normalized_mac = normalize_mac(mac_address)
         if not normalized_mac:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -347,14 +707,14 @@ async def remove_device(mac_address: str = Path(..., description="设备MAC地
             )
         
         # 检查设备是否存在
-        existing_device = get_device_by_mac(normalized_mac)
+        existing_device = await run_in_db(get_device_by_mac, normalized_mac)
         if not existing_device:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"设备 {normalized_mac} 不存在"
             )
         
-        success = delete_device(normalized_mac)
+        success = await run_in_db(delete_device, normalized_mac)
         if not success:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -382,9 +742,8 @@ async def get_device_types():
     - 用于前端下拉选择
     """
     try:
-        devices = get_all_devices()
-        device_types = list(set(device['device_type'] for device in devices))
-        return {"device_types": sorted(device_types)}
+        summary = await run_in_db(get_device_summary)
+        return {"device_types": summary["device_types"]}
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -396,28 +755,405 @@ async def get_device_status_count():
     """
     获取设备状态统计
     - 用于前端仪表板显示
+    - by_location 为按安装位置的状态分布
     """
     try:
-        devices = get_all_devices()
-        status_count = {
-            "active": 0,
-            "inactive": 0,
-            "maintenance": 0,
-            "total": len(devices)
+        summary = await run_in_db(get_device_summary)
+        return {
+            "active": summary["active"],
+            "inactive": summary["inactive"],
+            "maintenance": summary["maintenance"],
+            "total": summary["total"],
+            "by_location": summary["by_location"]
         }
-        
-        for device in devices:
-            status_value = device['status']
-            if status_value in status_count:
-                status_count[status_value] += 1
-        
-        return status_count
     except Exception as e:
         error_info = traceback.format_exc()
-        print("*"*100)
-        print(error_info)        
+        logger.exception("获取设备状态统计失败")
         return {"status": "failed", "error_info": f"{error_info}"}
 
+def _normalize_mac_or_400(mac_address: str) -> str:
+    """规范化路径中的MAC地址，格式错误时返回400"""
+    normalized_mac = normalize_mac(mac_address)
+    if not normalized_mac:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="MAC地址格式不正确"
+        )
+    return normalized_mac
+
+@app.get("/api/sensor-configs")
+async def get_sensor_configs(if_none_match: Optional[str] = Header(None)):
+    """
+    获取全部设备配置快照
+    - 供网关启动时批量拉取，响应头 ETag 为快照版本
+    - 请求头 If-None-Match 与当前版本一致时返回 304，无需重新下载
+    """
+    version, body = await run_in_db(get_config_snapshot)
+    etag = f'"{version}"'
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+@app.get("/api/sensor-configs/{mac_address}")
+async def get_sensor_config(mac_address: str = Path(..., description="设备MAC地址")):
+    """
+    根据MAC地址获取设备配置
+    """
+    normalized_mac = _normalize_mac_or_400(mac_address)
+    config = await run_in_db(get_device_config, normalized_mac)
+    if not config:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"设备 {normalized_mac} 的配置不存在"
+        )
+    return config
+
+@app.post("/api/sensor-configs")
+async def create_sensor_config(config_data: SensorConfigCreateRequest):
+    """
+    创建设备配置
+    - 每个设备只能有一条配置
+    """
+    try:
+        config = await run_in_db(add_device_config, **config_data.dict())
+        return {"status": "success", "info": "", "data": config}
+    except DuplicateError as e:
+        return {"status": "failed", "error_info": str(e)}
+    except Exception as e:
+        error_info = traceback.format_exc()
+        logger.exception("创建设备配置失败", extra={"device_mac": config_data.device_mac})
+        return {"status": "failed", "error_info": f"{error_info}"}
+
+@app.put("/api/sensor-configs/{mac_address}")
+async def update_sensor_config(
+    mac_address: str = Path(..., description="设备MAC地址"),
+    update_data: SensorConfigUpdateRequest = ...
+):
+    """
+    更新设备配置
+    - 只修改请求中给出的字段，阈值、配置信息和修改人给出 null 时清除
+    - 修改后的报警阈值上限不能小于下限（与未修改的一侧比较）
+    """
+    normalized_mac = _normalize_mac_or_400(mac_address)
+    update_dict = update_data.dict(exclude_unset=True)
+    if not update_dict:
+        return {"status": "success", "info": "未修改任何内容"}
+
+    try:
+        success = await run_in_db(update_device_config, normalized_mac, **update_dict)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if not success:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"设备 {normalized_mac} 的配置不存在"
+        )
+    return {"status": "success", "info": "修改成功"}
+
+@app.delete("/api/sensor-configs/{mac_address}")
+async def remove_sensor_config(mac_address: str = Path(..., description="设备MAC地址")):
+    """
+    删除设备配置
+    """
+    normalized_mac = _normalize_mac_or_400(mac_address)
+    success = await run_in_db(delete_device_config, normalized_mac)
+    if not success:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"设备 {normalized_mac} 的配置不存在"
+        )
+    return create_success_response(f"设备 {normalized_mac} 的配置删除成功")
+
+@app.post("/api/telemetry")
+async def ingest_telemetry(request: Request):
+    """
+    批量写入设备遥测数据
+    - 请求体为 JSON 数组或 NDJSON，每条为 {"mac_address", "metric", "value", "ts"}
+    - ts 为秒级时间戳或 ISO 时间字符串，不传则使用服务器当前时间
+    - 不合法的数据会被跳过，并在 errors 中返回前 100 条的原因
+    """
+    records = await _read_json_records(request)
+    accepted, errors, alarms = await run_in_db(_ingest_readings, records)
+    return {
+        "status": "success" if not errors else "failed",
+        "accepted": accepted,
+        "rejected": len(errors),
+        "errors": [{"index": index, "error_info": msg} for index, msg in errors[:100]],
+        "alarms": alarms
+    }
+
+def _ingest_readings(records):
+    """校验、写入遥测数据并做报警计算，在数据库线程池中执行"""
+    rows, errors = parse_readings(records)
+    alarms = _ingest_rows(rows)
+    return len(rows), errors, alarms
+
+@writer_task
+def _ingest_rows(rows):
+    """写入已经规范化的遥测数据并做报警计算，HTTP 和 MQTT 两个入口共用，上报数据的设备同时视为有心跳"""
+    add_reading_rows(rows)
+    liveness_tracker.heartbeats({row[0] for row in rows})
+    return alarm_engine.evaluate_rows(rows)
+
+def _apply_device_statuses(statuses):
+    """MQTT 在线状态消息：online 视为一次心跳，offline（通常是遗嘱消息）立即判定为离线"""
+    for mac_address, device_status in statuses.items():
+        if device_status == DeviceStatus.ACTIVE:
+            liveness_tracker.heartbeat(mac_address)
+        else:
+            liveness_tracker.mark_offline(mac_address)
+
+@app.post("/api/heartbeat")
+async def ingest_heartbeats(request: Request):
+    """
+    批量上报心跳
+    - 请求体为 MAC 地址或 {"mac_address": ...} 的 JSON 数组，或 NDJSON
+    - 心跳只更新内存中的最后心跳时间，只有上线/离线变化才会写入设备表
+    """
+    records = await _read_json_records(request)
+    device_macs = []
+    errors = []
+    for index, record in enumerate(records):
+        mac_address = record.get("mac_address") if isinstance(record, dict) else record
+        normalized_mac = normalize_mac(mac_address)
+        if normalized_mac:
+            device_macs.append(normalized_mac)
+        else:
+            errors.append({"index": index, "error_info": "MAC地址格式不正确"})
+    came_online = await run_in_db(_record_heartbeats, device_macs)
+    return {
+        "status": "success" if not errors else "failed",
+        "accepted": len(device_macs),
+        "came_online": came_online,
+        "rejected": len(errors),
+        "errors": errors[:100]
+    }
+
+@app.post("/api/devices/{mac_address}/heartbeat")
+async def device_heartbeat(mac_address: str = Path(..., description="设备MAC地址")):
+    """
+    单个设备上报心跳
+    """
+    normalized_mac = _normalize_mac_or_400(mac_address)
+    came_online = await run_in_db(_record_heartbeats, [normalized_mac])
+    return {"status": "success", "came_online": came_online > 0}
+
+@primary_task
+def _record_heartbeats(device_macs):
+    """记录心跳，返回由离线变为在线的设备数；多进程部署时在主进程中执行"""
+    return liveness_tracker.heartbeats(device_macs)
+
+@app.get("/api/liveness")
+async def get_liveness(mac_address: Optional[str] = Query(None, description="查询单个设备的最后心跳时间")):
+    """
+    获取心跳在线检测统计
+    - 传 mac_address 时返回该设备是否在线和最后心跳时间（秒级时间戳）
+    """
+    normalized_mac = _normalize_mac_or_400(mac_address) if mac_address else None
+    return await run_in_db(_liveness_info, normalized_mac)
+
+@primary_task
+def _liveness_info(mac_address):
+    if mac_address:
+        return {
+            "mac_address": mac_address,
+            "online": liveness_tracker.is_online(mac_address),
+            "last_seen": liveness_tracker.last_seen(mac_address)
+        }
+    return liveness_tracker.stats()
+
+# 降采样方式：mean/minmax 为按时间桶聚合，lttb/decimate 先取约 points 的 10 倍数据再降采样
+READING_MODES = ("mean", "minmax", "lttb", "decimate")
+_DOWNSAMPLE_OVERSAMPLE = 10
+_RESOLUTION_UNITS = {"": 1000, "s": 1000, "m": 60000, "h": 3600000, "d": 86400000}
+
+def _parse_resolution(resolution: str) -> int:
+    """把 resolution（例如 30、30s、5m、1h、1d）转换为毫秒"""
+    match = re.match(r'^(\d+)([smhd]?)$', resolution.strip().lower())
+    if not match or int(match.group(1)) <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="resolution 格式不正确，应为秒数或 30s/5m/1h/1d 格式"
+        )
+    return int(match.group(1)) * _RESOLUTION_UNITS[match.group(2)]
+
+def _pick_source(bucket_ms):
+    """选择不比 bucket_ms 更粗的最粗预聚合粒度，时间桶小于 1 分钟时只能读原始数据"""
+    source = "raw"
+    for tier, tier_ms in ROLLUP_TIERS:
+        if tier_ms <= bucket_ms:
+            source = tier
+    return source
+
+def _load_series(device_mac, metric, start_ms, end_ms, points, bucket_ms, source, mode):
+    """读取并降采样一个设备指标的时间序列，在数据库线程池中执行"""
+    if source == "raw":
+        rows = get_readings(device_mac, metric, start_ms, end_ms)
+        if not rows:
+            ts, values = [], []
+        else:
+            ts, values = zip(*rows)
+        if mode in ("mean", "minmax"):
+            buckets = downsample.bucket_raw(ts, values, bucket_ms)
+    else:
+        rollups = get_rollups(device_mac, metric, source, start_ms, end_ms)
+        if mode in ("mean", "minmax"):
+            buckets = downsample.merge_buckets(rollups, bucket_ms)
+        else:
+            # 预聚合数据以时间桶均值作为输入序列
+            ts = [row[0] for row in rollups]
+            values = [row[2] / row[1] for row in rollups]
+
+    if mode == "mean":
+        bucket_ts, counts, sums, _, _ = buckets
+        result = [
+            {"ts": int(t) / 1000, "value": float(s / c), "count": int(c)}
+            for t, c, s in zip(bucket_ts, counts, sums)
+        ]
+    elif mode == "minmax":
+        bucket_ts, counts, sums, lows, highs = buckets
+        result = [
+            {"ts": int(t) / 1000, "min": float(lo), "max": float(hi), "mean": float(s / c), "count": int(c)}
+            for t, c, s, lo, hi in zip(bucket_ts, counts, sums, lows, highs)
+        ]
+    else:
+        reduce = downsample.lttb if mode == "lttb" else downsample.decimate
+        out_ts, out_values = reduce(ts, values, points)
+        result = [{"ts": int(t) / 1000, "value": float(v)} for t, v in zip(out_ts, out_values)]
+
+    return result
+
+@app.get("/api/devices/{mac_address}/readings")
+async def get_device_readings(
+    mac_address: str = Path(..., description="设备MAC地址"),
+    metric: Optional[str] = Query(None, description="指标名称，设备只有一个指标时可省略"),
+    start: Optional[float] = Query(None, description="起始时间（秒级时间戳），默认为结束时间前 24 小时"),
+    end: Optional[float] = Query(None, description="结束时间（秒级时间戳），默认为当前时间"),
+    points: int = Query(500, ge=3, le=10000, description="期望返回的最大点数"),
+    resolution: Optional[str] = Query(None, description="时间桶宽度，例如 30s/5m/1h/1d，默认按 points 计算"),
+    mode: str = Query("mean", description="降采样方式: mean/minmax/lttb/decimate")
+):
+    """
+    按时间范围查询设备遥测数据并降采样
+    - mean: 每个时间桶的均值；minmax: 每个时间桶的最小/最大/均值，适合画包络
+    - lttb: 保留峰谷的视觉降采样；decimate: 抗混叠滤波后抽取，适合温度等平滑量
+    - 时间桶不小于 1 分钟时从 1m/1h/1d 预聚合数据计算，长时间范围不扫描原始数据
+    """
+    normalized_mac = _normalize_mac_or_400(mac_address)
+    if mode not in READING_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"mode 必须是 {'/'.join(READING_MODES)} 之一"
+        )
+
+    end_ms = int((end if end is not None else datetime.datetime.now().timestamp()) * 1000)
+    start_ms = int(start * 1000) if start is not None else end_ms - 86400000
+    if start_ms >= end_ms:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start 必须早于 end"
+        )
+
+    if metric is None:
+        metrics = await run_in_db(get_metrics, normalized_mac)
+        if len(metrics) != 1:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"设备 {normalized_mac} 有 {len(metrics)} 个指标，请通过 metric 指定: {metrics}"
+            )
+        metric = metrics[0]
+
+    if resolution is not None:
+        bucket_ms = _parse_resolution(resolution)
+    else:
+        bucket_ms = max(1000, -(-(end_ms - start_ms) // points))
+
+    if mode in ("lttb", "decimate"):
+        source = _pick_source(bucket_ms // _DOWNSAMPLE_OVERSAMPLE)
+    else:
+        source = _pick_source(bucket_ms)
+        # 时间桶取预聚合粒度的整数倍，保证每个时间桶由完整的预聚合数据合并而成
+        tier_ms = dict(ROLLUP_TIERS).get(source, 1000)
+        bucket_ms = -(-bucket_ms // tier_ms) * tier_ms
+
+    result = await run_in_db(_load_series, normalized_mac, metric, start_ms, end_ms, points, bucket_ms, source, mode)
+    return {
+        "device_mac": normalized_mac,
+        "metric": metric,
+        "mode": mode,
+        "source": source,
+        "bucket_ms": bucket_ms,
+        "points": result
+    }
+
+@app.get("/api/alarms")
+async def get_alarms(limit: int = Query(100, ge=1, le=1000, description="返回最近的报警变化条数")):
+    """
+    获取报警信息
+    - active 为当前处于报警状态的设备
+    - recent 为最近的报警进入/解除记录，最新的在前
+    """
+    return await run_in_db(_alarm_info, limit)
+
+@primary_task
+def _alarm_info(limit):
+    recent = list(alarm_engine.recent_transitions)[-limit:]
+    return {"active": alarm_engine.active_alarms(), "recent": recent[::-1]}
+
+@app.post("/api/ha-discovery/sync")
+async def sync_ha_discovery():
+    """
+    立即同步 Home Assistant 自动发现配置
+    - 只发布新增和变化的配置，已删除设备的配置以空的保留消息清除
+    """
+    result = await run_in_db(_sync_discovery)
+    if result is None:
+        return {"status": "failed", "error_info": "未配置 MQTT broker，Home Assistant 自动发现未启用"}
+    return {"status": "success" if not result["failed"] else "failed", **result}
+
+@primary_task
+def _sync_discovery():
+    return discovery_sync.sync() if discovery_sync is not None else None
+
+@app.get("/api/mqtt-stats")
+async def get_mqtt_stats():
+    """
+    获取 MQTT 桥接统计
+    - 收到/拒绝的消息数、批量写入次数、发布成功/丢弃/积压的消息数
+    """
+    return await run_in_db(_mqtt_stats)
+
+@primary_task
+def _mqtt_stats():
+    if mqtt_bridge is None:
+        return {"enabled": False}
+    return {"enabled": True, **mqtt_bridge.stats()}
+
+@app.get("/api/cache-stats")
+async def get_cache_stats():
+    """
+    获取设备缓存统计
+    - 命中/未命中/淘汰次数，用于调整 IOT_DEVICE_CACHE_SIZE 和 IOT_DEVICE_CACHE_TTL
+    - mac_cache 是 MAC 地址规范化缓存的命中情况，用于调整 IOT_MAC_CACHE_SIZE
+    - 状态写后缓冲的更新次数和实际写入行数，两者之比即合并的效果
+    - 多进程部署时为处理本次请求的 worker 的统计，cluster 中是该 worker 的角色和已应用的广播版本号
+    - logging 中是日志队列的积压，以及因队列满、限流而丢弃的日志条数
+    """
+    return {"device_cache": device_cache.stats(), "mac_cache": mac_cache_stats(),
+            "status_write_behind": status_write_behind.stats(), "cluster": cluster.stats(), "logging": log_stats()}
+
+@app.get("/metrics")
+async def get_prometheus_metrics():
+    """
+    Prometheus 文本格式的监控指标
+    - 按路由的请求耗时直方图、按 DAO 函数的查询次数和耗时、连接池等待时间、缓存命中率
+    - 多进程部署时每个 worker 各自统计，只返回处理本次请求的 worker 的指标
+    """
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # 全局异常处理
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -430,6 +1166,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     """通用异常处理"""
+    logger.error("未处理的异常", exc_info=exc, extra={"path": request.url.path})
     return JSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content=ErrorResponse(error="服务器内部错误", details=str(exc)).dict()
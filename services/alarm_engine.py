@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import threading
+from collections import deque
+from itertools import repeat
+from utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+
+# 报警状态
+ALARM_LOW = -1
+ALARM_NORMAL = 0
+ALARM_HIGH = 1
+
+_STATE_NAMES = {ALARM_LOW: "low", ALARM_NORMAL: "normal", ALARM_HIGH: "high"}
+
+# 不限定指标时的指标编码
+_ANY_METRIC = -1
+
+
+def _parse_config_data(config_data):
+    """解析 config_data 中与报警相关的字段：alarm_metric（阈值作用的指标）、alarm_hysteresis（回差）"""
+    if not config_data:
+        return {}
+    try:
+        data = json.loads(config_data)
+    except (TypeError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class AlarmEngine:
+    """向量化的阈值报警引擎
+
+    所有设备的阈值、回差、当前报警状态都保存在按设备槽位索引的连续 NumPy 数组中，
+    每批遥测数据只做一次向量化计算，输出报警状态的变化（进入/解除），而不是逐条比较。
+
+    回差规则（以上限为例）：数值超过上限进入高报警，回落到 上限-回差 以下才解除，
+    两者之间保持原状态；下限同理。
+
+    NumPy 数组在第一次计算时才创建，服务启动时只在字典中记录阈值，不导入 numpy。
+    """
+
+    def __init__(self, default_hysteresis=0.0, history_size=1000):
+        self.default_hysteresis = default_hysteresis
+        self._lock = threading.Lock()
+        self._slots = {}          # device_mac -> 槽位
+        self._free_slots = []
+        self._configs = {}        # device_mac -> (下限, 上限, 回差, 指标)，数组创建前的阈值
+        self._metric_codes = {}   # 指标名称 -> 编码
+        self._macs_by_slot = None # 槽位 -> device_mac，槽位变化时重建
+        self._arrays_ready = False
+        self._size = 0
+        self.recent_transitions = deque(maxlen=history_size)
+
+    # ---------- 阈值维护 ----------
+
+    def load(self, configs):
+        """用全部设备配置重建引擎，configs 为 get_all_device_configs() 的结果"""
+        with self._lock:
+            self._slots = {}
+            self._free_slots = []
+            self._configs = {}
+            self._macs_by_slot = None
+            self._arrays_ready = False
+            self._size = 0
+            for config in configs:
+                self._configs[config['device_mac']] = self._threshold_tuple(config)
+
+    def update_config(self, device_mac, config):
+        """配置变化时增量更新单个设备的阈值，config 为 None 表示配置被删除
+
+        可直接注册为 dao.sensor_config.add_config_listener 的监听器
+        """
+        with self._lock:
+            if config is None:
+                self._configs.pop(device_mac, None)
+                if self._arrays_ready and device_mac in self._slots:
+                    slot = self._slots.pop(device_mac)
+                    self._macs_by_slot = None
+                    self._set_slot(slot, (np.nan, np.nan, 0.0, None))
+                    self._free_slots.append(slot)
+                return
+
+            thresholds = self._threshold_tuple(config)
+            self._configs[device_mac] = thresholds
+            if self._arrays_ready:
+                slot = self._slots.get(device_mac)
+                if slot is None:
+                    slot = self._allocate_slot(device_mac)
+                self._set_slot(slot, thresholds)
+
+    def _threshold_tuple(self, config):
+        extra = _parse_config_data(config.get('config_data'))
+        low = config.get('alarm_threshold_min')
+        high = config.get('alarm_threshold_max')
+        hysteresis = extra.get('alarm_hysteresis', self.default_hysteresis)
+        return (
+            float('nan') if low is None else float(low),
+            float('nan') if high is None else float(high),
+            float(hysteresis or 0.0),
+            extra.get('alarm_metric')
+        )
+
+    def _metric_code(self, metric):
+        if metric is None:
+            return _ANY_METRIC
+        return self._metric_codes.setdefault(metric, len(self._metric_codes))
+
+    def _ensure_arrays(self):
+        """第一次计算前把字典中的阈值转换为数组"""
+        if self._arrays_ready:
+            return
+        capacity = max(1024, len(self._configs) * 2)
+        self._low = np.full(capacity, np.nan)
+        self._high = np.full(capacity, np.nan)
+        self._hysteresis = np.zeros(capacity)
+        self._metric = np.full(capacity, _ANY_METRIC, dtype=np.int32)
+        self._state = np.zeros(capacity, dtype=np.int8)
+        self._arrays_ready = True
+        for device_mac, thresholds in self._configs.items():
+            self._set_slot(self._allocate_slot(device_mac), thresholds)
+
+    def _allocate_slot(self, device_mac):
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            slot = self._size
+            self._size += 1
+            if slot >= len(self._low):
+                self._grow(len(self._low) * 2)
+        self._slots[device_mac] = slot
+        self._macs_by_slot = None
+        self._state[slot] = ALARM_NORMAL
+        return slot
+
+    def _grow(self, capacity):
+        def grow(array, fill):
+            new_array = np.full(capacity, fill, dtype=array.dtype)
+            new_array[:len(array)] = array
+            return new_array
+        self._low = grow(self._low, np.nan)
+        self._high = grow(self._high, np.nan)
+        self._hysteresis = grow(self._hysteresis, 0.0)
+        self._metric = grow(self._metric, _ANY_METRIC)
+        self._state = grow(self._state, ALARM_NORMAL)
+
+    def _set_slot(self, slot, thresholds):
+        low, high, hysteresis, metric = thresholds
+        self._low[slot] = low
+        self._high[slot] = high
+        self._hysteresis[slot] = hysteresis
+        self._metric[slot] = self._metric_code(metric)
+
+    # ---------- 报警计算 ----------
+
+    def evaluate(self, device_macs, metrics, values, timestamps=None):
+        """对一批数据做报警计算
+
+        同一设备的数据按输入顺序处理，回差状态会在批内逐条延续
+
+        Args:
+            device_macs: 规范化后的MAC地址序列
+            metrics: 指标名称序列
+            values: 数值序列
+            timestamps: 时间戳序列（毫秒），可选，只用于填充输出
+
+        Returns:
+            list: 报警状态变化，每项为 dict(device_mac, metric, value, ts, from_state, to_state, event)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return []
+
+        with self._lock:
+            self._ensure_arrays()
+            if not self._slots:
+                return []
+
+            slots = self._resolve_slots(device_macs, len(values))
+            metric_codes = self._resolve_metric_codes(metrics, len(values))
+
+            known = slots >= 0
+            slot_metric = np.where(known, self._metric[np.where(known, slots, 0)], -2)
+            selected = np.flatnonzero(known & ((slot_metric == _ANY_METRIC) | (slot_metric == metric_codes)))
+            if len(selected) == 0:
+                return []
+
+            # 按设备稳定排序，同一设备的数据保持原顺序；槽位不超过 16 位时 NumPy 使用基数排序
+            all_selected = len(selected) == len(values)
+            sort_key = slots if all_selected else slots[selected]
+            if self._size <= 0xFFFF:
+                sort_key = sort_key.astype(np.uint16)
+            order = np.argsort(sort_key, kind='stable')
+            if not all_selected:
+                order = selected[order]
+            seq_slots = slots[order]
+            seq_values = values[order]
+            states, previous = self._run_state_machine(seq_slots, seq_values)
+
+            # 每个设备最后一条数据的状态即为新的当前状态
+            is_last = np.r_[seq_slots[1:] != seq_slots[:-1], True]
+            self._state[seq_slots[is_last]] = states[is_last]
+
+            changed = np.flatnonzero(states != previous)
+            macs_by_slot = self._ensure_macs_by_slot() if len(changed) else {}
+
+        # 逐条生成输出前先整体转换为 Python 列表，避免逐个读取 NumPy 标量
+        transitions = []
+        now_ms = int(time.time() * 1000)
+        for index, slot, value, from_state, to_state in zip(
+                order[changed].tolist(), seq_slots[changed].tolist(), seq_values[changed].tolist(),
+                previous[changed].tolist(), states[changed].tolist()):
+            transition = {
+                "device_mac": macs_by_slot[slot],
+                "metric": metrics[index],
+                "value": value,
+                "ts": int(timestamps[index]) if timestamps is not None else now_ms,
+                "from_state": _STATE_NAMES[from_state],
+                "to_state": _STATE_NAMES[to_state],
+                "event": "exit" if to_state == ALARM_NORMAL else "enter"
+            }
+            transitions.append(transition)
+            self.recent_transitions.append(transition)
+        return transitions
+
+    def _resolve_slots(self, device_macs, count):
+        """MAC 地址到槽位的映射，未配置的设备为 -1
+
+        逐条查字典：字符串的哈希值缓存在对象上，实测比先对字符串数组做 np.unique 去重后再查快数倍，
+        也比转换为 48 位整数键后二分查找快
+        """
+        return np.fromiter(map(self._slots.get, device_macs, repeat(-1)), dtype=np.int64, count=count)
+
+    def _ensure_macs_by_slot(self):
+        """槽位到 MAC 地址的反查表，在槽位变化后的第一次报警变化时重建"""
+        if self._macs_by_slot is None:
+            self._macs_by_slot = {slot: mac for mac, slot in self._slots.items()}
+        return self._macs_by_slot
+
+    def _resolve_metric_codes(self, metrics, count):
+        """指标名称到编码的映射，未知指标为 -2；每个不同的指标只查一次字典，整批只有一种指标时直接返回标量"""
+        # 列表中同一个指标名通常是同一个字符串对象，list.count 先比较对象标识，比建字典去重快得多
+        if isinstance(metrics, (list, tuple)) and metrics.count(metrics[0]) == count:
+            return self._metric_codes.get(metrics[0], -2)
+        distinct = dict.fromkeys(metrics)
+        if len(distinct) == 1:
+            return self._metric_codes.get(next(iter(distinct)), -2)
+        codes = {metric: self._metric_codes.get(metric, -2) for metric in distinct}
+        return np.fromiter(map(codes.__getitem__, metrics), dtype=np.int32, count=count)
+
+    def evaluate_rows(self, rows):
+        """对 dao.telemetry 规范化后的 (device_mac, metric, ts_ms, value) 元组做报警计算"""
+        if not rows:
+            return []
+        device_macs, metrics, timestamps, values = zip(*rows)
+        return self.evaluate(device_macs, metrics, values, timestamps)
+
+    def _run_state_machine(self, seq_slots, seq_values):
+        """向量化的回差状态机
+
+        每条数据先按阈值分为：确定高报警、确定低报警、确定正常、处于上限回差区、处于下限回差区。
+        回差区的数据沿用前一条的状态，但只能保持同方向的报警，否则视为正常。
+        “前一条的状态”即同一设备内最近一条确定状态的数据（没有则为设备的初始状态），通过位置的前向最大值得到；
+        回差区被判为正常后会改变后续数据的来源，所以重复查找直到结果不再变化（通常一两轮即可）。
+        回差区的数据通常只占很少一部分，每轮只对它们取值和判断。
+
+        Returns:
+            (states, previous): 每条数据处理后的状态、处理前的状态
+        """
+        low = self._low[seq_slots]
+        high = self._high[seq_slots]
+        hysteresis = self._hysteresis[seq_slots]
+        initial = self._state[seq_slots]
+
+        with np.errstate(invalid='ignore'):
+            above = seq_values > high
+            below = seq_values < low
+            band_high = ~above & (seq_values > high - hysteresis)
+            band_low = ~below & (seq_values < low + hysteresis)
+
+        states = np.zeros(len(seq_values), dtype=np.int8)
+        states[above] = ALARM_HIGH
+        states[below] = ALARM_LOW
+        starts = np.r_[True, seq_slots[1:] != seq_slots[:-1]]
+
+        pending = np.flatnonzero(~(above | below) & (band_high | band_low))
+        if len(pending):
+            determined = np.ones(len(seq_values), dtype=bool)
+            determined[pending] = False
+            pending_high = band_high[pending]
+            pending_low = band_low[pending]
+            # 同时处于两个回差区（回差大于上下限间距）时，只要前一状态不是对应方向的报警就视为正常
+            both = pending_high & pending_low
+            positions = np.arange(len(seq_values))
+            while True:
+                # 设备开头的数据以初始状态为来源
+                sources = np.where(determined | starts, positions, 0)
+                np.maximum.accumulate(sources, out=sources)
+                source = sources[pending]
+                carried = np.where(determined[source], states[source], initial[source])
+                breaks = (pending_high & (carried != ALARM_HIGH)) | (pending_low & (carried != ALARM_LOW))
+                breaks &= ~(both & ((carried == ALARM_HIGH) | (carried == ALARM_LOW)))
+                if not breaks.any():
+                    break
+                determined[pending[breaks]] = True     # 视为确定正常，states 中已经是 0
+                keep = ~breaks
+                pending, pending_high, pending_low, both = pending[keep], pending_high[keep], pending_low[keep], both[keep]
+                if not len(pending):
+                    break
+            if len(pending):
+                states[pending] = carried
+
+        previous = np.where(starts, initial, np.r_[initial[:1], states[:-1]])
+        return states, previous
+
+    # ---------- 查询 ----------
+
+    def active_alarms(self):
+        """当前处于报警状态的设备"""
+        with self._lock:
+            if not self._arrays_ready:
+                return []
+            return [
+                {"device_mac": mac, "state": _STATE_NAMES[int(self._state[slot])]}
+                for mac, slot in self._slots.items() if self._state[slot] != ALARM_NORMAL
+            ]
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import csv
+import json
+import zlib
+from dao.device_info import DEVICE_FIELDS
+from dao.executor import run_in_db
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+# gzip 压缩级别：6 是 gzip 命令的默认值，压缩率和速度比较均衡
+GZIP_LEVEL = 6
+
+
+def encode_ndjson(records):
+    """一批 DeviceRecord 编码为 NDJSON，每行一个与 to_dict 相同的 JSON 对象"""
+    if orjson is not None:
+        return b"".join(orjson.dumps(dict(zip(DEVICE_FIELDS, record))) + b"\n" for record in records)
+    return "".join(json.dumps(dict(zip(DEVICE_FIELDS, record)), ensure_ascii=False) + "\n"
+                   for record in records).encode("utf-8")
+
+
+def encode_csv(records, header=False):
+    """一批 DeviceRecord 编码为 CSV，空值为空字符串；header 为 True 时先输出带 BOM 的表头，Excel 才能正确识别中文"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        buffer.write("\ufeff")
+        writer.writerow(DEVICE_FIELDS)
+    writer.writerows(records)
+    return buffer.getvalue().encode("utf-8")
+
+
+async def stream_export(batches, export_format, compress=False):
+    """把 iter_device_records 产出的批次编码后逐块输出，可选边编码边 gzip 压缩
+
+    每一批都在数据库线程池中读取，事件循环只做编码和压缩；客户端断开时关闭生成器归还连接
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    first = True
+    try:
+        while True:
+            batch = await run_in_db(next, batches, None)
+            if batch is None:
+                break
+            if export_format == "csv":
+                chunk = encode_csv(batch, header=first)
+            else:
+                chunk = encode_ndjson(batch)
+            first = False
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        if export_format == "csv" and first:
+            # 没有任何设备时也输出表头
+            chunk = encode_csv([], header=True)
+            yield compressor.compress(chunk) if compressor is not None else chunk
+        if compressor is not None:
+            yield compressor.flush()
+    finally:
+        try:
+            batches.close()
+        except ValueError:
+            # 取消时数据库线程中的 next() 可能还没返回，生成器结束后由垃圾回收关闭
+            pass
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import csv
+import json
+import gzip
+import asyncio
+from dao.device_info import validate_import_record, import_devices_chunk, get_import_checkpoint
+from utils.log import get_logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = get_logger("services.device_import")
+
+IMPORT_FORMATS = ("ndjson", "csv")
+
+# 汇总结果中最多返回的错误行数，其余只计数
+MAX_REPORTED_ERRORS = 100
+
+
+class AsyncStreamReader(io.RawIOBase):
+    """把请求体的异步流包装成同步的文件对象，供数据库线程池中的解析代码按需读取
+
+    每次 read 在事件循环上取下一块请求体并等待结果，整个文件不会一次读进内存
+    """
+
+    def __init__(self, chunks, loop):
+        self._chunks = chunks.__aiter__()
+        self._loop = loop
+        self._buffer = b""
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer and not self._eof:
+            future = asyncio.run_coroutine_threadsafe(self._next_chunk(), self._loop)
+            chunk = future.result()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer = chunk
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    async def _next_chunk(self):
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+
+def open_text(fileobj):
+    """按开头的魔数识别 gzip 压缩，返回逐行读取的文本流；utf-8-sig 去掉导出 CSV 时写入的 BOM"""
+    stream = fileobj if hasattr(fileobj, "peek") else io.BufferedReader(fileobj, buffer_size=64 * 1024)
+    if stream.peek(2)[:2] == b"\x1f\x8b":
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+
+def iter_rows(text, source_format):
+    """逐行产出 (行号, 记录字典或 None, 解析错误)，行号从 1 开始，CSV 不计表头，NDJSON 跳过空行但计入行号"""
+    if source_format == "csv":
+        for row_number, row in enumerate(csv.DictReader(text), 1):
+            if None in row:
+                yield row_number, None, "列数多于表头"
+            else:
+                yield row_number, row, ""
+        return
+
+    loads = orjson.loads if orjson is not None else json.loads
+    for row_number, line in enumerate(text, 1):
+        if not line.strip():
+            yield row_number, None, None
+            continue
+        try:
+            yield row_number, loads(line), ""
+        except ValueError as e:
+            yield row_number, None, f"JSON 格式不正确: {e}"
+
+
+def import_devices(import_id, fileobj, source_format, chunk_size=1000):
+    """流式导入设备注册表文件（CSV 或 NDJSON，可以是 gzip 压缩的），按 MAC 地址新增或更新设备
+
+    每读满 chunk_size 行校验后在一个事务中写入，并把断点（已处理的行数）一起提交；
+    同一个 import_id 再次导入同一个文件时跳过断点之前的行，从中断处继续
+
+    Returns:
+        dict: 断点中的累计结果，加上本次导入的前 MAX_REPORTED_ERRORS 个错误（行号, MAC地址, 错误信息）
+
+    Raises:
+        ValueError: 断点与文件格式不一致，或同一个任务被并发导入
+    """
+    checkpoint = get_import_checkpoint(import_id)
+    if checkpoint is not None:
+        if checkpoint["format"] != source_format:
+            raise ValueError(f"导入任务 {import_id} 的格式为 {checkpoint['format']}，不能用 {source_format} 续传")
+        if checkpoint["completed"]:
+            return dict(checkpoint, errors=[])
+    skip = checkpoint["rows_done"] if checkpoint else 0
+    if skip:
+        logger.info("导入任务从断点续传", extra={"import_id": import_id, "rows_done": skip})
+
+    errors = []
+    rows, failed = [], 0
+    start_row = end_row = skip
+
+    def report(row_number, mac_address, message):
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"row": row_number, "mac_address": mac_address, "error": message})
+
+    def write_chunk(completed=False):
+        nonlocal rows, failed, start_row
+        result = import_devices_chunk(import_id, source_format, start_row, end_row, rows, failed, completed)
+        for row_number, mac_address, message in result["errors"]:
+            report(row_number, mac_address, message)
+        rows, failed, start_row = [], 0, end_row
+
+    with open_text(fileobj) as text:
+        for row_number, record, error in iter_rows(text, source_format):
+            if row_number <= skip:
+                continue
+            end_row = row_number
+            if error is None:
+                continue        # NDJSON 中的空行
+            if not error:
+                device, error = validate_import_record(record)
+            if error:
+                failed += 1
+                report(row_number, record.get("mac_address") if isinstance(record, dict) else None, error)
+            else:
+                rows.append((row_number, device))
+            if end_row - start_row >= chunk_size:
+                write_chunk()
+    write_chunk(completed=True)
+
+    summary = get_import_checkpoint(import_id)
+    logger.info("导入任务完成", extra={k: summary[k] for k in ("import_id", "rows_done", "inserted", "updated", "failed")})
+    return dict(summary, errors=errors)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+from utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+signal = lazy_import("scipy.signal")
+
+# scipy.signal.decimate 建议单次抽取倍数不超过 13，更大的倍数分多级完成
+_MAX_DECIMATE_FACTOR = 10
+
+
+def bucket_raw(ts, values, bucket_ms):
+    """把原始数据按时间桶聚合
+
+    Args:
+        ts: 时间戳数组（毫秒，升序）
+        values: 数值数组
+        bucket_ms: 时间桶宽度（毫秒）
+
+    Returns:
+        (bucket_ts, count, sum, min, max): 各时间桶的聚合结果数组
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(ts) == 0:
+        empty = np.array([], dtype=np.float64)
+        return np.array([], dtype=np.int64), empty, empty, empty, empty
+    keys = ts - ts % bucket_ms
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    return (
+        keys[starts],
+        counts.astype(np.float64),
+        np.add.reduceat(values, starts),
+        np.minimum.reduceat(values, starts),
+        np.maximum.reduceat(values, starts),
+    )
+
+
+def merge_buckets(rollups, bucket_ms):
+    """把预聚合数据 [(bucket_ts, count, sum, min, max)] 合并到更宽的时间桶"""
+    if not rollups:
+        return bucket_raw([], [], bucket_ms)
+    data = np.asarray(rollups, dtype=np.float64)
+    keys = data[:, 0].astype(np.int64)
+    keys = keys - keys % bucket_ms
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return (
+        keys[starts],
+        np.add.reduceat(data[:, 1], starts),
+        np.add.reduceat(data[:, 2], starts),
+        np.minimum.reduceat(data[:, 3], starts),
+        np.maximum.reduceat(data[:, 4], starts),
+    )
+
+
+def lttb(ts, values, threshold):
+    """Largest-Triangle-Three-Buckets 视觉降采样，保留曲线的形状特征（峰谷）
+
+    Returns:
+        (ts, values): 降采样后的数组，首尾两点保持不变
+    """
+    ts = np.asarray(ts, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    n = len(ts)
+    if threshold >= n or threshold < 3:
+        return ts.astype(np.int64), values
+
+    # 中间 n-2 个点平均分为 threshold-2 个桶
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # 下一个桶的平均点（最后一个桶取末点）
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            avg_x = ts[next_start:next_end].mean()
+            avg_y = values[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = ts[-1], values[-1]
+        # 当前桶中与前一个选中点、下一个桶平均点构成三角形面积最大的点
+        ax, ay = ts[previous], values[previous]
+        area = np.abs((ax - avg_x) * (values[start:end] - ay) - (ax - ts[start:end]) * (avg_y - ay))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return ts[selected].astype(np.int64), values[selected]
+
+
+def decimate(ts, values, points):
+    """用 scipy.signal.decimate 抗混叠滤波后抽取，适合平滑的连续量（温度等）
+
+    要求数据大致等间隔；倍数较大时分多级抽取
+
+    Returns:
+        (ts, values): 抽取后的数组
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    factor = math.ceil(len(values) / points) if points else 1
+    if factor <= 1:
+        return ts, values
+    # 滤波时两端按 0 补齐，先减去均值，避免非零均值的序列在首尾被拉低
+    offset = values.mean()
+    values = values - offset
+    while factor > 1:
+        q = min(factor, _MAX_DECIMATE_FACTOR)
+        # FIR 滤波器需要足够长的输入，数据太短时直接等间隔取点
+        if len(values) <= 3 * 30 * q:
+            values = values[::q]
+        else:
+            values = signal.decimate(values, q, ftype='fir', zero_phase=True)
+        ts = ts[::q][:len(values)]
+        factor = math.ceil(factor / q)
+    return ts, values + offset
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import hashlib
+import threading
+from dao.device_info import query_devices
+from dao.ha_discovery import get_published_hashes, record_published
+from utils.log import get_logger
+
+logger = get_logger("services.ha_discovery")
+
+# 设备类型到 Home Assistant 实体的映射，键为小写的 device_type
+# metric 为设备上报遥测数据时使用的指标名称，与 services.mqtt_bridge 的主题约定一致
+_SENSOR_TYPES = {
+    "temperature": {"metric": "temperature", "device_class": "temperature", "unit_of_measurement": "°C"},
+    "humidity": {"metric": "humidity", "device_class": "humidity", "unit_of_measurement": "%"},
+    "illuminance": {"metric": "illuminance", "device_class": "illuminance", "unit_of_measurement": "lx"},
+}
+_TYPE_ALIASES = {
+    "温度传感器": "temperature",
+    "湿度传感器": "humidity",
+    "光照传感器": "illuminance",
+    "人在传感器": "presence",
+    "继电器": "relay",
+    "switch": "relay",
+}
+
+
+def _metric_slug(device_type):
+    """把设备类型转换为可以用在主题和 unique_id 中的名称"""
+    slug = re.sub(r'[^0-9a-z_]+', '_', device_type.lower()).strip('_')
+    return slug[:32] or "value"
+
+
+def discovery_entity(device, topic_prefix="txkj", discovery_prefix="homeassistant"):
+    """根据设备信息生成 discovery 配置
+
+    unique_id 为 MAC地址 + 传感器类型，手动删除时用同样的值才能被 Home Assistant 识别为同一个实体
+
+    Args:
+        device: 包含 mac_address、device_name、device_type、location 的字典
+
+    Returns:
+        (topic, payload): discovery 配置主题和负载字典
+    """
+    node = device['mac_address'].replace(':', '').lower()
+    device_type = (device.get('device_type') or '').strip()
+    kind = _TYPE_ALIASES.get(device_type, device_type.lower())
+    base = f"{topic_prefix}/{node}"
+
+    if kind == "presence":
+        component, metric = "binary_sensor", "presence"
+        payload = {
+            "device_class": "presence",
+            "state_topic": f"{base}/presence_state",
+            "payload_on": "present",
+            "payload_off": "not_present",
+            "value_template": "{{ value_json.state }}",
+            "availability_topic": f"{base}/presence_status",
+        }
+    elif kind == "relay":
+        component, metric = "switch", "relay"
+        payload = {
+            "state_topic": f"{base}/relay/state",
+            "command_topic": f"{base}/relay/command",
+            "payload_on": "ON",
+            "payload_off": "OFF",
+            "state_on": "ON",
+            "state_off": "OFF",
+            "optimistic": False,
+            "availability_topic": f"{base}/relay/availability",
+        }
+    else:
+        sensor = _SENSOR_TYPES.get(kind, {"metric": _metric_slug(device_type)})
+        component, metric = "sensor", sensor["metric"]
+        payload = {key: value for key, value in sensor.items() if key != "metric"}
+        payload.update({
+            "state_topic": f"{base}/{metric}",
+            "value_template": f"{{{{ value_json.{metric} }}}}",
+            "availability_topic": f"{base}/{metric}_status",
+        })
+
+    unique_id = f"{node}_{metric}"
+    ha_device = {
+        "identifiers": [f"{topic_prefix}_{node}"],
+        "connections": [["mac", device['mac_address'].lower()]],
+        "name": device['device_name'],
+        "manufacturer": "CustomMQTTDevice",
+    }
+    if device_type:
+        ha_device["model"] = device_type
+    if device.get('location'):
+        ha_device["suggested_area"] = device['location']
+
+    payload.update({
+        "name": device['device_name'],
+        "unique_id": unique_id,
+        "object_id": unique_id,
+        "payload_available": "online",
+        "payload_not_available": "offline",
+        "device": ha_device,
+    })
+    return f"{discovery_prefix}/{component}/{unique_id}/config", payload
+
+
+def build_discovery(devices, topic_prefix="txkj", discovery_prefix="homeassistant"):
+    """生成全部设备的 discovery 配置，返回 {topic: 序列化后的负载}
+
+    负载按键排序序列化，同样的配置总是得到同样的字符串，可以直接比较摘要
+    """
+    desired = {}
+    for device in devices:
+        topic, payload = discovery_entity(device, topic_prefix, discovery_prefix)
+        desired[topic] = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return desired
+
+
+def payload_hash(payload):
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def diff_discovery(desired, published):
+    """比较新生成的配置和已发布的配置摘要
+
+    Args:
+        desired: {topic: payload}
+        published: {topic: payload_hash}
+
+    Returns:
+        (changed, removed): [(topic, payload, payload_hash)] 需要发布的配置、[topic] 需要清除的主题
+    """
+    changed = []
+    for topic, payload in desired.items():
+        digest = payload_hash(payload)
+        if published.get(topic) != digest:
+            changed.append((topic, payload, digest))
+    removed = [topic for topic in published if topic not in desired]
+    return changed, removed
+
+
+class DiscoverySync:
+    """把设备表同步为 Home Assistant discovery 配置
+
+    每次同步重新生成全部配置，与本地保存的已发布摘要比较，只发布新增和变化的配置，
+    已删除设备的主题发布空的保留消息，Home Assistant 收到后会删除对应实体。
+    发布按批进行，每批发布完成后立即记录，中途失败时下次同步从未记录的部分继续。
+
+    Args:
+        publish: 发布函数，签名与 MqttBridge.publish(topic, payload, qos, retain) 一致，返回是否成功
+        debounce: request_sync() 的合并时间窗口（秒），窗口内的多次设备修改只触发一次同步
+    """
+
+    def __init__(self, publish, topic_prefix="txkj", discovery_prefix="homeassistant", batch_size=500, debounce=2.0):
+        self.publish = publish
+        self.topic_prefix = topic_prefix
+        self.discovery_prefix = discovery_prefix
+        self.batch_size = batch_size
+        self.debounce = debounce
+        self._sync_lock = threading.Lock()
+        self._timer_lock = threading.Lock()
+        self._timer = None
+
+    def sync(self, devices=None):
+        """执行一次同步
+
+        Args:
+            devices: 设备字典列表，None 表示从设备表读取
+
+        Returns:
+            dict: published（新增或变化）、removed、unchanged、failed 的条数
+        """
+        with self._sync_lock:
+            if devices is None:
+                devices, _, _ = query_devices(fields=['mac_address', 'device_name', 'device_type', 'location'])
+            desired = build_discovery(devices, self.topic_prefix, self.discovery_prefix)
+            changed, removed = diff_discovery(desired, get_published_hashes())
+
+            # 删除的主题和新配置放在同一个队列里按批发布，空负载 + retain 会清除 broker 上的保留消息
+            operations = changed + [(topic, "", None) for topic in removed]
+
+            published_count = removed_count = failed = 0
+            for start in range(0, len(operations), self.batch_size):
+                batch_published = []
+                batch_removed = []
+                for topic, payload, digest in operations[start:start + self.batch_size]:
+                    if not self.publish(topic, payload, qos=1, retain=True):
+                        failed += 1
+                    elif digest is None:
+                        batch_removed.append(topic)
+                    else:
+                        batch_published.append((topic, digest))
+                record_published(batch_published, batch_removed)
+                published_count += len(batch_published)
+                removed_count += len(batch_removed)
+
+            return {
+                "published": published_count,
+                "removed": removed_count,
+                "unchanged": len(desired) - len(changed),
+                "failed": failed,
+            }
+
+    def request_sync(self):
+        """请求一次同步，debounce 秒后在后台线程执行，期间的重复请求会被合并"""
+        with self._timer_lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.debounce, self._run_scheduled)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run_scheduled(self):
+        with self._timer_lock:
+            self._timer = None
+        try:
+            self.sync()
+        except Exception:
+            logger.exception("Home Assistant 自动发现同步失败")
+
+    def cancel(self):
+        """取消尚未执行的同步"""
+        with self._timer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
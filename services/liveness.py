@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import threading
+from utils.log import get_logger
+
+logger = get_logger("services.liveness")
+
+
+class TimerWheel:
+    """哈希时间轮
+
+    时间按 tick 划分，到期时刻按 tick 序号对槽位数取模放入对应槽位。推进一个 tick 只检查一个槽位，
+    槽位中到期时刻还没到的（超过一圈的定时器）原样保留。重新设置同一个 key 的定时器是 O(1) 的。
+    """
+
+    def __init__(self, tick=1.0, slots=512, now=0.0):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        self._positions = {}    # key -> 槽位
+        self._current = int(now // tick)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def schedule(self, key, deadline):
+        """设置 key 在 deadline 到期，已有的定时器会被替换"""
+        expire_tick = max(math.ceil(deadline / self.tick), self._current + 1)
+        self.cancel(key)
+        slot = expire_tick % len(self.slots)
+        self.slots[slot][key] = expire_tick
+        self._positions[key] = slot
+
+    def cancel(self, key):
+        slot = self._positions.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self, now):
+        """推进到 now，返回到期的 key 列表"""
+        target = int(now // self.tick)
+        if target <= self._current:
+            return []
+        # 落后超过一圈时每个槽位只需要检查一次
+        if target - self._current >= len(self.slots):
+            slots = self.slots
+        else:
+            slots = [self.slots[t % len(self.slots)] for t in range(self._current + 1, target + 1)]
+        self._current = target
+
+        expired = []
+        for slot in slots:
+            if not slot:
+                continue
+            due = [key for key, expire_tick in slot.items() if expire_tick <= target]
+            for key in due:
+                del slot[key]
+                del self._positions[key]
+            expired.extend(due)
+        return expired
+
+
+class LivenessTracker:
+    """基于心跳的设备在线状态跟踪
+
+    内存中记录每个设备最后一次心跳的时间，超过 report_interval * timeout_factor 没有心跳就判定为离线。
+    心跳只更新最后心跳时间，不触碰时间轮；定时器到期时再检查最后心跳时间，
+    期间有过心跳就按新的到期时间重新放回时间轮，所以每个 tick 的工作量只与到期的设备数有关。
+
+    上线/离线变化先在内存中累积，由 flush() 批量交给 on_transitions(online_macs, offline_macs) 持久化，
+    状态不变的心跳不会产生任何数据库写入。
+
+    心跳来自未经认证的上报，调用 load_devices() 之后只跟踪已登记的设备（增删随 on_device_event 更新），
+    跟踪的设备数达到 max_devices 后不再接受新设备，被拒绝的心跳只计数。
+
+    Args:
+        on_transitions: 回调，参数为 (上线的 MAC 列表, 离线的 MAC 列表)
+        default_interval: 没有配置 report_interval 的设备使用的上报间隔（秒）
+        timeout_factor: 超过上报间隔的多少倍没有心跳判定为离线
+        max_devices: 最多跟踪的设备数，None 表示不限制
+        clock: 时间函数，测试时可以替换
+    """
+
+    def __init__(self, on_transitions=None, default_interval=60, timeout_factor=2.0,
+                 tick=1.0, slots=512, max_devices=None, clock=time.time):
+        self.on_transitions = on_transitions
+        self.default_interval = default_interval
+        self.timeout_factor = timeout_factor
+        self.max_devices = max_devices
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._wheel = TimerWheel(tick, slots, clock())
+        self._last_seen = {}        # device_mac -> 最后心跳时间
+        self._intervals = {}        # device_mac -> report_interval
+        self._pending = {}          # device_mac -> True(上线)/False(离线)，尚未持久化的变化
+        self._known = None          # 已登记设备的 MAC 集合，None 表示不按登记过滤
+        self._heartbeats = 0
+        self._rejected = 0
+        self._transitions = 0
+        self._thread = None
+        self._stopping = threading.Event()
+
+    # ---------- 上报间隔 ----------
+
+    def load_intervals(self, configs):
+        """用全部设备配置初始化上报间隔，configs 为 get_all_device_configs() 的结果"""
+        with self._lock:
+            self._intervals = {c['device_mac']: c['report_interval'] for c in configs if c.get('report_interval')}
+
+    def update_config(self, device_mac, config):
+        """配置变化时更新上报间隔，可直接注册为 dao.sensor_config.add_config_listener 的监听器"""
+        with self._lock:
+            if config and config.get('report_interval'):
+                self._intervals[device_mac] = config['report_interval']
+            else:
+                self._intervals.pop(device_mac, None)
+
+    # ---------- 已登记设备 ----------
+
+    def load_devices(self, device_macs):
+        """设置已登记设备的 MAC 地址，之后只接受这些设备的心跳，已跟踪的其它设备被丢弃"""
+        with self._lock:
+            self._known = set(device_macs)
+            for device_mac in [mac for mac in self._last_seen if mac not in self._known]:
+                self._forget(device_mac)
+
+    def on_device_event(self, event):
+        """设备登记或删除时更新已登记设备，可直接注册为 dao.events.device_events 的监听器"""
+        if event.get("type") != "device":
+            return
+        device_mac = event["mac_address"]
+        with self._lock:
+            if event["op"] == "create":
+                if self._known is not None:
+                    self._known.add(device_mac)
+            elif event["op"] == "delete":
+                if self._known is not None:
+                    self._known.discard(device_mac)
+                self._forget(device_mac)
+
+    def _forget(self, device_mac):
+        self._last_seen.pop(device_mac, None)
+        self._wheel.cancel(device_mac)
+        self._pending.pop(device_mac, None)
+
+    def _accept(self, device_mac):
+        """已跟踪的设备直接接受；新设备需要已登记，且跟踪的设备数没有达到上限"""
+        if device_mac in self._last_seen:
+            return True
+        if (self._known is not None and device_mac not in self._known) or \
+                (self.max_devices is not None and len(self._last_seen) >= self.max_devices):
+            self._rejected += 1
+            return False
+        return True
+
+    def _timeout(self, device_mac):
+        return self._intervals.get(device_mac, self.default_interval) * self.timeout_factor
+
+    # ---------- 心跳 ----------
+
+    def heartbeat(self, device_mac, now=None):
+        """记录一次心跳，返回设备是否因此由离线变为在线"""
+        now = self.clock() if now is None else now
+        with self._lock:
+            self._heartbeats += 1
+            if not self._accept(device_mac):
+                return False
+            self._last_seen[device_mac] = now
+            if device_mac in self._wheel:
+                return False
+            self._wheel.schedule(device_mac, now + self._timeout(device_mac))
+            self._mark(device_mac, True)
+            return True
+
+    def heartbeats(self, device_macs, now=None):
+        """批量记录心跳，返回由离线变为在线的设备数"""
+        now = self.clock() if now is None else now
+        came_online = 0
+        with self._lock:
+            for device_mac in device_macs:
+                self._heartbeats += 1
+                if not self._accept(device_mac):
+                    continue
+                self._last_seen[device_mac] = now
+                if device_mac not in self._wheel:
+                    self._wheel.schedule(device_mac, now + self._timeout(device_mac))
+                    self._mark(device_mac, True)
+                    came_online += 1
+        return came_online
+
+    def seed(self, device_macs, now=None):
+        """启动时把设备表中在线的设备视为刚收到过心跳，之后一直没有心跳的设备到期后判定为离线，本身不产生上线变化"""
+        now = self.clock() if now is None else now
+        with self._lock:
+            for device_mac in device_macs:
+                if device_mac in self._wheel or not self._accept(device_mac):
+                    continue
+                self._last_seen[device_mac] = now
+                self._wheel.schedule(device_mac, now + self._timeout(device_mac))
+
+    def mark_offline(self, device_mac):
+        """设备主动报告离线（例如 MQTT 遗嘱消息），立即判定为离线"""
+        with self._lock:
+            if device_mac in self._wheel:
+                self._wheel.cancel(device_mac)
+                self._mark(device_mac, False)
+
+    def _mark(self, device_mac, online):
+        self._transitions += 1
+        # 同一个设备在一次 flush 之前先离线再上线，两次变化互相抵消
+        if self._pending.get(device_mac) is (not online):
+            del self._pending[device_mac]
+        else:
+            self._pending[device_mac] = online
+
+    # ---------- 到期检查 ----------
+
+    def tick(self, now=None):
+        """推进时间轮，处理到期的设备，返回本次判定为离线的设备数"""
+        now = self.clock() if now is None else now
+        went_offline = 0
+        with self._lock:
+            for device_mac in self._wheel.advance(now):
+                deadline = self._last_seen[device_mac] + self._timeout(device_mac)
+                if deadline > now:
+                    self._wheel.schedule(device_mac, deadline)
+                else:
+                    self._mark(device_mac, False)
+                    went_offline += 1
+        return went_offline
+
+    def flush(self):
+        """把累积的上线/离线变化交给 on_transitions 持久化"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self.on_transitions is None:
+            return
+        online = [mac for mac, is_online in pending.items() if is_online]
+        offline = [mac for mac, is_online in pending.items() if not is_online]
+        try:
+            self.on_transitions(online, offline)
+        except Exception:
+            logger.exception("设备上下线状态写入失败")
+
+    def start(self):
+        """启动后台线程，每个 tick 检查一次到期并持久化变化"""
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="liveness", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self._wheel.tick):
+            self.tick()
+            self.flush()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    # ---------- 查询 ----------
+
+    def last_seen(self, device_mac):
+        """最后一次心跳的时间戳（秒），没有心跳记录时为 None"""
+        return self._last_seen.get(device_mac)
+
+    def is_online(self, device_mac):
+        return device_mac in self._wheel
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tracked": len(self._last_seen),
+                "online": len(self._wheel),
+                "offline": len(self._last_seen) - len(self._wheel),
+                "heartbeats": self._heartbeats,
+                "rejected": self._rejected,
+                "transitions": self._transitions,
+                "pending": len(self._pending),
+            }
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import zlib
+import threading
+from collections import deque
+from utils.lazy_import import lazy_import
+from dao.device_info import DeviceStatus
+from dao.telemetry import parse_reading
+from utils.log import get_logger
+from utils.mac import normalize_mac
+
+logger = get_logger("services.mqtt_bridge")
+
+mqtt = lazy_import("paho.mqtt.client")
+
+# 在线状态主题的负载
+_AVAILABILITY = {"online": DeviceStatus.ACTIVE, "offline": DeviceStatus.INACTIVE}
+
+# 开关量负载对应的数值
+_STATE_VALUES = {
+    "on": 1.0, "off": 0.0,
+    "present": 1.0, "not_present": 0.0,
+    "true": 1.0, "false": 0.0,
+    "open": 1.0, "closed": 0.0,
+}
+
+# QoS 0 消息离线时最多缓存的条数，超过后丢弃最旧的
+QOS0_QUEUE_SIZE = 10000
+# QoS 1/2 消息离线时最多缓存的条数，超过后拒绝新的发布
+RELIABLE_QUEUE_SIZE = 100000
+
+
+def _topic_device_mac(node):
+    """主题中的设备段转换为MAC地址，支持 AA:BB:CC:DD:EE:FF、AA-BB-CC-DD-EE-FF 和 AABBCCDDEEFF"""
+    return normalize_mac(node)
+
+
+def _payload_value(payload, metric):
+    """从负载中取出数值和时间戳
+
+    支持 {"<metric>": 25.6}、{"state": "ON"}、{"value": 1, "ts": ...}、裸数字和 ON/OFF 等开关量
+    """
+    text = payload.decode("utf-8") if isinstance(payload, bytes) else str(payload)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = text.strip()
+
+    ts = None
+    if isinstance(data, dict):
+        ts = data.get("ts")
+        for key in (metric, "value", "state"):
+            if key in data:
+                data = data[key]
+                break
+        else:
+            raise ValueError(f"负载中没有 {metric}/value/state 字段")
+
+    if isinstance(data, str):
+        if data.lower() in _STATE_VALUES:
+            return _STATE_VALUES[data.lower()], ts
+        try:
+            return float(data), ts
+        except ValueError:
+            raise ValueError(f"无法识别的数值: {data}")
+    return data, ts
+
+
+def parse_message(topic, payload, topic_prefix="txkj"):
+    """把一条 MQTT 消息转换为设备状态或遥测数据
+
+    主题约定（与 scripts/homeassistant 下的脚本一致）:
+        {prefix}/{mac}/{metric}                 遥测数据，例如 txkj/AABBCCDDEEFF/temperature
+        {prefix}/{mac}/{metric}_state           开关量，例如 presence_state
+        {prefix}/{mac}/{metric}/state           开关量，例如 relay/state
+        {prefix}/{mac}/.../availability         在线状态 online/offline，也可以是 *_status
+        {prefix}/{mac}/heartbeat                心跳，负载任意
+        {prefix}/{mac}/.../command、.../config  不处理
+
+    Returns:
+        ("status", device_mac, DeviceStatus)、("heartbeat", device_mac) 或 ("reading", (device_mac, metric, ts_ms, value))，
+        不需要处理时返回 None
+
+    Raises:
+        ValueError: 主题属于桥接范围但内容不合法
+    """
+    levels = topic.split("/")
+    if len(levels) < 3 or levels[0] != topic_prefix:
+        return None
+    last = levels[-1]
+    if last in ("command", "config", "set"):
+        return None
+
+    device_mac = _topic_device_mac(levels[1])
+    if not device_mac:
+        raise ValueError(f"主题中的MAC地址格式不正确: {levels[1]}")
+
+    if last == "heartbeat" and len(levels) == 3:
+        return "heartbeat", device_mac
+
+    if last in ("availability", "status") or last.endswith("_status"):
+        text = payload.decode("utf-8") if isinstance(payload, bytes) else str(payload)
+        status = _AVAILABILITY.get(text.strip().lower())
+        if status is None:
+            raise ValueError(f"无法识别的在线状态: {text}")
+        return "status", device_mac, status
+
+    if last == "state":
+        metric = "_".join(levels[2:-1])
+    elif last.endswith("_state"):
+        metric = "_".join(levels[2:-1] + [last[:-len("_state")]])
+    else:
+        metric = "_".join(levels[2:])
+
+    value, ts = _payload_value(payload, metric)
+    record = {"mac_address": device_mac, "metric": metric, "value": value, "ts": ts}
+    return "reading", parse_reading(record)
+
+
+class _Publisher:
+    """发布连接池中的一个持久连接
+
+    已连接时直接发布；断线期间 QoS 1/2 消息保存在有界队列中，重连后优先补发，
+    QoS 0 消息只保留最新的 QOS0_QUEUE_SIZE 条，超过后丢弃最旧的
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.connected = False
+        self.lock = threading.Lock()
+        self.reliable = deque()
+        self.best_effort = deque(maxlen=QOS0_QUEUE_SIZE)
+        self.sent = 0
+        self.dropped = 0
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+
+    def publish(self, topic, payload, qos, retain):
+        with self.lock:
+            if not self.connected:
+                if qos > 0:
+                    if len(self.reliable) >= RELIABLE_QUEUE_SIZE:
+                        self.dropped += 1
+                        return False
+                    self.reliable.append((topic, payload, qos, retain))
+                else:
+                    if len(self.best_effort) == self.best_effort.maxlen:
+                        self.dropped += 1
+                    self.best_effort.append((topic, payload, qos, retain))
+                return True
+        return self._send(topic, payload, qos, retain)
+
+    def _send(self, topic, payload, qos, retain):
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        if info.rc != 0:
+            self.dropped += 1
+            return False
+        self.sent += 1
+        return True
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code != 0:
+            return
+        # 先在锁内取出积压的消息再标记为已连接，补发期间的新消息排在积压消息之后发送
+        while True:
+            with self.lock:
+                if self.reliable:
+                    message = self.reliable.popleft()
+                elif self.best_effort:
+                    message = self.best_effort.popleft()
+                else:
+                    self.connected = True
+                    return
+            self._send(*message)
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties=None):
+        with self.lock:
+            self.connected = False
+
+    def pending(self):
+        return len(self.reliable) + len(self.best_effort)
+
+
+class MqttBridge:
+    """常驻的 MQTT 桥接
+
+    - 订阅连接：持久会话订阅 {topic_prefix}/+/#，收到的消息在网络线程中只做解析和入队，
+      由写入线程每攒够 batch_size 条或每隔 flush_interval 秒批量交给 on_readings / on_status / on_heartbeat
+    - 发布连接池：publish() 按主题哈希选择连接，同一主题的消息顺序不变；断线时按 QoS 缓存
+    - client_factory(client_id, clean_session) 用于替换 paho 客户端，测试时可传入 services.mqtt_local.LocalBroker
+
+    Args:
+        on_readings: 回调，参数为 [(device_mac, metric, ts_ms, value)]
+        on_status: 回调，参数为 {device_mac: DeviceStatus}，同一批次中同一设备只保留最后一次状态
+        on_heartbeat: 回调，参数为本批次中发送过心跳的 MAC 地址集合
+    """
+
+    def __init__(self, host, port=1883, topic_prefix="txkj", client_id="iot-server",
+                 publisher_pool_size=2, batch_size=1000, flush_interval=0.5, keepalive=60,
+                 on_readings=None, on_status=None, on_heartbeat=None, client_factory=None):
+        self.host = host
+        self.port = port
+        self.topic_prefix = topic_prefix
+        self.client_id = client_id
+        self.publisher_pool_size = max(1, publisher_pool_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.keepalive = keepalive
+        self.on_readings = on_readings
+        self.on_status = on_status
+        self.on_heartbeat = on_heartbeat
+        self.client_factory = client_factory or self._paho_client
+
+        self._inbox = deque()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._writer = None
+        self._subscriber = None
+        self._publishers = []
+        self._received = 0
+        self._rejected = 0
+        self._readings_written = 0
+        self._status_written = 0
+        self._flushes = 0
+
+    @staticmethod
+    def _paho_client(client_id, clean_session):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, clean_session=clean_session)
+
+    # ---------- 生命周期 ----------
+
+    def start(self):
+        """建立订阅连接和发布连接池，启动写入线程；连接在后台建立，断线后自动重连"""
+        self._stopping.clear()
+        self._writer = threading.Thread(target=self._write_loop, name="mqtt-writer", daemon=True)
+        self._writer.start()
+
+        self._subscriber = self.client_factory(f"{self.client_id}-sub", False)
+        self._subscriber.on_connect = self._on_subscriber_connect
+        self._subscriber.on_message = self._on_message
+        self._connect(self._subscriber)
+
+        self._publishers = []
+        for index in range(self.publisher_pool_size):
+            publisher = _Publisher(self.client_factory(f"{self.client_id}-pub-{index}", True))
+            self._publishers.append(publisher)
+            self._connect(publisher.client)
+
+    def _connect(self, client):
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
+        client.connect_async(self.host, self.port, self.keepalive)
+        client.loop_start()
+
+    def stop(self):
+        """断开全部连接，并把已经收到的消息写入数据库"""
+        clients = [self._subscriber] + [publisher.client for publisher in self._publishers]
+        for client in clients:
+            if client is not None:
+                client.disconnect()
+                client.loop_stop()
+        self._stopping.set()
+        self._wakeup.set()
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+    # ---------- 接收 ----------
+
+    def _on_subscriber_connect(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code != 0:
+            logger.warning("MQTT 连接失败: %s", reason_code)
+            return
+        # 每次重连都重新订阅，持久会话下 broker 会补发离线期间的 QoS 1 消息
+        client.subscribe(f"{self.topic_prefix}/+/#", qos=1)
+
+    def _on_message(self, client, userdata, message):
+        self._received += 1
+        try:
+            parsed = parse_message(message.topic, message.payload, self.topic_prefix)
+        except (ValueError, UnicodeDecodeError):
+            self._rejected += 1
+            return
+        if parsed is None:
+            return
+        self._inbox.append(parsed)
+        if len(self._inbox) >= self.batch_size:
+            self._wakeup.set()
+
+    def _write_loop(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """把已经收到的消息批量写入，返回写入的条数"""
+        readings = []
+        statuses = {}
+        heartbeats = set()
+        while self._inbox:
+            kind, *item = self._inbox.popleft()
+            if kind == "reading":
+                readings.append(item[0])
+            elif kind == "heartbeat":
+                heartbeats.add(item[0])
+            else:
+                statuses[item[0]] = item[1]
+        if not readings and not statuses and not heartbeats:
+            return 0
+
+        self._flushes += 1
+        try:
+            if heartbeats and self.on_heartbeat:
+                self.on_heartbeat(heartbeats)
+            if readings and self.on_readings:
+                self.on_readings(readings)
+                self._readings_written += len(readings)
+            if statuses and self.on_status:
+                self.on_status(statuses)
+                self._status_written += len(statuses)
+        except Exception:
+            logger.exception("MQTT 消息批量写入失败")
+        return len(readings) + len(statuses) + len(heartbeats)
+
+    # ---------- 发布 ----------
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """发布消息，可在任意线程中调用
+
+        payload 为 dict/list 时按 JSON 编码。断线期间消息会被缓存，重连后补发
+
+        Returns:
+            bool: 消息已发送或已进入缓存队列时为 True
+        """
+        if qos not in (0, 1, 2):
+            raise ValueError(f"QoS 必须是 0、1 或 2: {qos}")
+        if not self._publishers:
+            raise RuntimeError("MQTT 桥接未启动")
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload, ensure_ascii=False)
+        publisher = self._publishers[zlib.crc32(topic.encode("utf-8")) % len(self._publishers)]
+        return publisher.publish(topic, payload, qos, retain)
+
+    # ---------- 统计 ----------
+
+    def stats(self):
+        return {
+            "received": self._received,
+            "rejected": self._rejected,
+            "queued": len(self._inbox),
+            "flushes": self._flushes,
+            "readings_written": self._readings_written,
+            "status_written": self._status_written,
+            "published": sum(publisher.sent for publisher in self._publishers),
+            "publish_dropped": sum(publisher.dropped for publisher in self._publishers),
+            "publish_pending": sum(publisher.pending() for publisher in self._publishers),
+            "publishers_connected": sum(publisher.connected for publisher in self._publishers),
+        }
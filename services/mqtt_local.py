@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+
+
+def topic_matches(topic_filter, topic):
+    """主题是否匹配订阅过滤器，支持 + 和 # 通配符"""
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class LocalMessage:
+    def __init__(self, topic, payload, qos=0, retain=False):
+        self.topic = topic
+        self.payload = payload.encode("utf-8") if isinstance(payload, str) else payload
+        self.qos = qos
+        self.retain = retain
+
+
+class LocalMessageInfo:
+    def __init__(self, rc):
+        self.rc = rc
+
+
+class LocalBroker:
+    """进程内的 MQTT broker 替身，用于测试 MqttBridge，不需要真实的 broker
+
+    只实现桥接用到的功能：订阅通配符、保留消息、断线/重连（持久会话在断线期间缓存 QoS 1/2 消息）。
+    消息在发布者的线程中同步投递。
+
+    示例:
+        broker = LocalBroker()
+        bridge = MqttBridge("local", client_factory=broker.client_factory, ...)
+        broker.publish("txkj/AABBCCDDEEFF/temperature", '{"temperature": 25.6}')
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clients = {}
+        self.retained = {}
+        self.messages = []      # 所有经过 broker 的消息，便于测试断言
+
+    def client_factory(self, client_id, clean_session=True):
+        client = LocalClient(self, client_id, clean_session)
+        with self.lock:
+            self.clients[client_id] = client
+        return client
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """模拟设备向 broker 发布一条消息"""
+        message = LocalMessage(topic, payload, qos, retain)
+        with self.lock:
+            self.messages.append(message)
+            # 与真实 broker 一致，空负载的保留消息会清除该主题的保留消息
+            if retain and message.payload:
+                self.retained[topic] = message
+            elif retain:
+                self.retained.pop(topic, None)
+            targets = []
+            for client in self.clients.values():
+                granted = client.granted_qos(topic)
+                if granted is None:
+                    continue
+                if client.connected:
+                    targets.append(client)
+                elif not client.clean_session and min(granted, qos) > 0:
+                    client.offline_queue.append(message)
+        for client in targets:
+            client.deliver(message)
+
+    def disconnect_all(self):
+        """模拟网络中断"""
+        for client in list(self.clients.values()):
+            client.drop()
+
+    def reconnect_all(self):
+        """模拟网络恢复，客户端自动重连"""
+        for client in list(self.clients.values()):
+            client.reconnect()
+
+
+class LocalClient:
+    """与 paho.mqtt.client.Client（VERSION2 回调）接口一致的替身客户端"""
+
+    def __init__(self, broker, client_id, clean_session):
+        self.broker = broker
+        self.client_id = client_id
+        self.clean_session = clean_session
+        self.connected = False
+        self.running = False
+        self.subscriptions = {}
+        self.offline_queue = []
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def connect_async(self, host, port=1883, keepalive=60):
+        pass
+
+    def loop_start(self):
+        self.running = True
+        self.reconnect()
+
+    def loop_stop(self):
+        self.running = False
+
+    def disconnect(self):
+        self.running = False
+        self.drop()
+
+    def drop(self):
+        if not self.connected:
+            return
+        self.connected = False
+        if self.clean_session:
+            self.subscriptions = {}
+        if self.on_disconnect:
+            self.on_disconnect(self, None, None, 0, None)
+
+    def reconnect(self):
+        if self.connected or not self.running:
+            return
+        self.connected = True
+        if self.on_connect:
+            self.on_connect(self, None, {"session present": not self.clean_session}, 0, None)
+        with self.broker.lock:
+            queued, self.offline_queue = self.offline_queue, []
+        for message in queued:
+            self.deliver(message)
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions[topic] = qos
+        with self.broker.lock:
+            retained = [m for t, m in self.broker.retained.items() if topic_matches(topic, t)]
+        for message in retained:
+            self.deliver(message)
+        return MQTT_ERR_SUCCESS, 1
+
+    def granted_qos(self, topic):
+        matched = [qos for topic_filter, qos in self.subscriptions.items() if topic_matches(topic_filter, topic)]
+        return max(matched) if matched else None
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if not self.connected:
+            return LocalMessageInfo(MQTT_ERR_NO_CONN)
+        self.broker.publish(topic, payload, qos, retain)
+        return LocalMessageInfo(MQTT_ERR_SUCCESS)
+
+    def deliver(self, message):
+        if self.on_message:
+            self.on_message(self, None, message)
@@ -2,5 +2,12 @@
 
 # service redis-server start
 
-uvicorn server:app --host 0.0.0.0 --port 55501 --workers 1
+# IOT_WORKERS 大于 1 时以多进程模式启动：一个 worker 成为主进程独占数据库写入，其它 worker 转发写操作，
+# 设置 IOT_REDIS_URL（例如 redis://127.0.0.1:6379/0）后缓存失效通过 Redis 广播
+WORKERS=${IOT_WORKERS:-1}
+if [ "$WORKERS" -gt 1 ]; then
+    export IOT_CLUSTER=1
+fi
 
+# 访问日志由 RequestLogMiddleware 以 JSON 格式输出（成功请求按 IOT_LOG_SAMPLE_RATE 采样），关闭 uvicorn 自带的访问日志
+uvicorn server:app --host 0.0.0.0 --port 55501 --workers "$WORKERS" --no-access-log
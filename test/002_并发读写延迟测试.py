@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 并发读写延迟测试：在持续写入设备的同时并发读取设备，统计读请求的 p50/p99 延迟
+# 分别以 IOT_DB_EXECUTOR_WORKERS=0（DAO 直接阻塞事件循环，旧行为）和默认线程池启动服务做对比
+#
+# 用法: python test/002_并发读写延迟测试.py
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import subprocess
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READERS = 4
+WRITERS = 4
+WRITES_PER_WRITER = 100
+
+
+def start_server(port, log_dir, workers):
+    env = dict(os.environ, IOT_LOG_DIR=log_dir, IOT_DB_EXECUTOR_WORKERS=str(workers))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--workers", "1", "--log-level", "warning"],
+        cwd=ROOT_DIR, env=env
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=0.5)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("服务启动失败")
+
+
+async def run_load(base_url):
+    read_latencies = []
+    writing = True
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await client.post("/api/devices", json={
+            "mac_address": "AA:00:00:00:00:00", "device_name": "read_target",
+            "device_type": "sensor", "status": "active"
+        })
+
+        async def writer(w):
+            for i in range(WRITES_PER_WRITER):
+                await client.post("/api/devices", json={
+                    "mac_address": f"AB:{w:02X}:00:00:{i // 256:02X}:{i % 256:02X}",
+                    "device_name": f"bench_{w}_{i}", "device_type": "sensor", "status": "active"
+                })
+
+        async def reader():
+            while writing:
+                start = time.perf_counter()
+                await client.get("/api/devices/AA:00:00:00:00:00")
+                read_latencies.append(time.perf_counter() - start)
+
+        readers = [asyncio.create_task(reader()) for _ in range(READERS)]
+        start = time.perf_counter()
+        await asyncio.gather(*(writer(w) for w in range(WRITERS)))
+        elapsed = time.perf_counter() - start
+        writing = False
+        await asyncio.gather(*readers)
+
+    read_latencies.sort()
+    p50 = read_latencies[len(read_latencies) // 2] * 1000
+    p99 = read_latencies[int(len(read_latencies) * 0.99)] * 1000
+    return len(read_latencies), p50, p99, elapsed
+
+
+if __name__ == "__main__":
+
+    for name, workers, port in [("阻塞调用(旧)", 0, 55601), ("线程池", 8, 55602)]:
+        with tempfile.TemporaryDirectory() as log_dir:
+            proc = start_server(port, log_dir, workers)
+            try:
+                reads, p50, p99, elapsed = asyncio.run(run_load(f"http://127.0.0.1:{port}"))
+            finally:
+                proc.terminate()
+                proc.wait()
+        print(f"{name:<10} 读请求: {reads:>6}  p50: {p50:8.2f} ms  p99: {p99:8.2f} ms  写入耗时: {elapsed:.2f} s")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 启动耗时测试：在全新的子进程中导入 server:app，用 python -X importtime 统计各模块的导入耗时，
+# 并检查冷启动导入时间和常驻内存不超过预算，防止重新引入 numpy/scipy 等重量级依赖
+#
+# 用法: python test/003_启动耗时测试.py
+#   或: pytest test/003_启动耗时测试.py
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 预算可以通过环境变量调整，默认值约为当前实测值的两倍
+IMPORT_TIME_BUDGET = float(os.environ.get("IOT_IMPORT_TIME_BUDGET", 1.5))   # 秒
+RSS_BUDGET_MB = float(os.environ.get("IOT_RSS_BUDGET_MB", 120))
+
+# 启动时不应该被导入的模块
+HEAVY_MODULES = ["numpy", "scipy", "redis", "requests"]
+
+PROBE = """
+import sys, json, time, resource
+start = time.perf_counter()
+from server import app
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "elapsed": elapsed,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_probe(importtime=False):
+    """在新进程中导入 server:app，返回探测结果和 importtime 输出"""
+    with tempfile.TemporaryDirectory() as log_dir:
+        cmd = [sys.executable, "-W", "ignore"] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE]
+        proc = subprocess.run(
+            cmd, cwd=ROOT_DIR, capture_output=True, text=True,
+            env=dict(os.environ, IOT_LOG_DIR=log_dir)
+        )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def top_imports(importtime_output, count=15):
+    """解析 -X importtime 的输出，返回 server 直接导入的模块中累计耗时最多的几个"""
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # 模块名前的缩进表示导入层级，缩进最少的是被直接导入的模块
+        rows.append((len(name) - len(name.lstrip()), int(cumulative_us), name.strip()))
+    if not rows:
+        return []
+    # 最外层是 server 本身，第二层才是它直接导入的依赖
+    levels = sorted(set(depth for depth, _, _ in rows))
+    level = levels[1] if len(levels) > 1 else levels[0]
+    modules = sorted(((cum, name) for depth, cum, name in rows if depth == level), reverse=True)
+    return modules[:count]
+
+
+def test_cold_import_budget():
+    # 取多次中的最小值，减少机器抖动的影响
+    results = [run_probe()[0] for _ in range(3)]
+    elapsed = min(r["elapsed"] for r in results)
+    rss_mb = min(r["rss_mb"] for r in results)
+    assert not results[0]["loaded"], f"启动时导入了重量级依赖: {results[0]['loaded']}"
+    assert elapsed < IMPORT_TIME_BUDGET, f"导入 server:app 耗时 {elapsed:.3f}s，超过预算 {IMPORT_TIME_BUDGET}s"
+    assert rss_mb < RSS_BUDGET_MB, f"导入 server:app 后内存 {rss_mb:.1f}MB，超过预算 {RSS_BUDGET_MB}MB"
+
+
+if __name__ == "__main__":
+
+    result, importtime_output = run_probe(importtime=True)
+    print(f"导入 server:app 耗时(含 importtime 开销): {result['elapsed']:.3f}s  内存: {result['rss_mb']:.1f}MB")
+    print("server 直接导入的模块中累计耗时最多的:")
+    for cumulative_us, name in top_imports(importtime_output):
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    test_cold_import_budget()
+    print("预算检查通过")
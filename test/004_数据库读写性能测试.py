@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 数据库读写微基准：对比旧的引擎配置（QueuePool + pool_pre_ping、默认 rollback journal、每次调用新建 sessionmaker）
+# 和 dao.database 当前的配置（WAL 等 PRAGMA、缓存的 sessionmaker、session_scope）
+# 每次写入都是一个独立事务，每次读取都是一次按 MAC 的点查，与 DAO 函数的实际用法一致
+#
+# 用法: python test/004_数据库读写性能测试.py
+
+import os
+import sys
+import time
+import tempfile
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ.setdefault("IOT_LOG_DIR", TMP_DIR)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine as sa_create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from dao.database import create_db_engine, session_scope
+from dao.device_info import Base, DeviceInfo, DeviceStatus
+
+WRITES = 2000
+READS = 10000
+
+
+def old_engine(db_path):
+    """旧版 create_db_engine 的配置"""
+    return sa_create_engine(
+        f"sqlite:///{db_path}",
+        poolclass=QueuePool,
+        pool_size=5,
+        max_overflow=10,
+        pool_timeout=30,
+        pool_pre_ping=True,
+        pool_recycle=3600
+    )
+
+
+def old_session(engine):
+    """旧版 get_session：每次调用都新建 sessionmaker"""
+    return sessionmaker(bind=engine)()
+
+
+class OldScope:
+    """用旧版 get_session 实现的等价工作单元"""
+
+    def __init__(self, engine):
+        self.session = old_session(engine)
+
+    def __enter__(self):
+        return self.session
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.session.commit()
+            else:
+                self.session.rollback()
+        finally:
+            self.session.close()
+
+
+def mac(i):
+    return f"AA:00:00:{i // 65536 % 256:02X}:{i // 256 % 256:02X}:{i % 256:02X}"
+
+
+def run(name, engine, scope):
+    Base.metadata.create_all(engine)
+
+    start = time.perf_counter()
+    for i in range(WRITES):
+        with scope(engine) as session:
+            session.add(DeviceInfo(mac_address=mac(i), device_name=f"bench_{i}", device_type="sensor", status=DeviceStatus.ACTIVE))
+    write_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(READS):
+        with scope(engine) as session:
+            session.query(DeviceInfo).filter(DeviceInfo.mac_address == mac(i % WRITES)).first()
+    read_elapsed = time.perf_counter() - start
+
+    engine.dispose()
+    print(f"{name:<8} 写入: {WRITES / write_elapsed:8.0f} 事务/秒   点查: {READS / read_elapsed:8.0f} 次/秒")
+
+
+if __name__ == "__main__":
+
+    run("旧配置", old_engine(os.path.join(TMP_DIR, "bench_old.db")), OldScope)
+    run("新配置", create_db_engine(os.path.join(TMP_DIR, "bench_new.db")), session_scope)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# MQTT 桥接测试：用进程内的 LocalBroker 替代真实 broker，验证
+# 主题解析、遥测数据和在线状态的批量写入、断线期间按 QoS 缓存并在重连后补发，以及接收吞吐
+#
+# 用法: python test/007_MQTT桥接测试.py
+#   或: pytest test/007_MQTT桥接测试.py
+
+import os
+import sys
+import time
+import tempfile
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dao.device_info import DeviceStatus, add_device, get_device_by_mac, update_device_status
+from dao.telemetry import add_reading_rows, get_readings
+from services.mqtt_bridge import MqttBridge, parse_message
+from services.mqtt_local import LocalBroker
+
+MAC = "AA:BB:CC:00:13:01"
+NODE = MAC.replace(":", "")
+
+
+def make_bridge(broker, **kwargs):
+    def apply_statuses(statuses):
+        for mac, device_status in statuses.items():
+            update_device_status(mac, device_status)
+
+    options = dict(on_readings=add_reading_rows, on_status=apply_statuses, flush_interval=0.05)
+    options.update(kwargs)
+    return MqttBridge("local", client_factory=broker.client_factory, **options)
+
+
+def test_parse_message():
+    assert parse_message(f"txkj/{NODE}/temperature", b'{"temperature": 25.6, "ts": 1700000000}')[1] == \
+        (MAC, "temperature", 1700000000000, 25.6)
+    assert parse_message(f"txkj/{NODE}/presence_state", b'{"state": "present"}')[1][1:4:2] == ("presence", 1.0)
+    assert parse_message(f"txkj/{NODE}/relay/state", b"OFF")[1][1:4:2] == ("relay", 0.0)
+    assert parse_message(f"txkj/{MAC}/humidity", b"41.5")[1][3] == 41.5
+    assert parse_message(f"txkj/{NODE}/relay/availability", b"offline") == ("status", MAC, DeviceStatus.INACTIVE)
+    assert parse_message(f"txkj/{NODE}/presence_status", b"online") == ("status", MAC, DeviceStatus.ACTIVE)
+    assert parse_message(f"txkj/{NODE}/relay/command", b"ON") is None
+    assert parse_message("other/xx/temperature", b"1") is None
+    for topic, payload in [("txkj/jokker_desktop/temperature", b"1"), (f"txkj/{NODE}/temperature", b"hot"),
+                           (f"txkj/{NODE}/status", b"maybe")]:
+        try:
+            parse_message(topic, payload)
+        except ValueError:
+            continue
+        raise AssertionError(f"{topic} {payload} 应该被拒绝")
+
+
+def test_ingest_batches_readings_and_status():
+    add_device(MAC, "mqtt_bridge_test", "sensor", None, None, None, DeviceStatus.ACTIVE)
+    broker = LocalBroker()
+    bridge = make_bridge(broker)
+    bridge.start()
+    try:
+        for i in range(50):
+            broker.publish(f"txkj/{NODE}/temperature", f'{{"temperature": {20 + i}, "ts": {1700000000 + i}}}', qos=1)
+        broker.publish(f"txkj/{NODE}/temperature_status", "offline", qos=1)
+        broker.publish(f"txkj/{NODE}/temperature", "not a number", qos=1)
+    finally:
+        bridge.stop()
+
+    stats = bridge.stats()
+    assert stats["readings_written"] == 50 and stats["status_written"] == 1 and stats["rejected"] == 1
+    assert len(get_readings(MAC, "temperature")) == 50
+    assert get_device_by_mac(MAC)["status"] == DeviceStatus.INACTIVE.value
+
+
+def test_persistent_session_and_qos_queue():
+    broker = LocalBroker()
+    received = []
+    bridge = make_bridge(broker, on_readings=received.extend, on_status=None, publisher_pool_size=2)
+    bridge.start()
+    try:
+        broker.disconnect_all()
+        # 订阅使用持久会话，断线期间的 QoS 1 消息在重连后补发，QoS 0 消息丢失
+        broker.publish(f"txkj/{NODE}/temperature", "1", qos=1)
+        broker.publish(f"txkj/{NODE}/temperature", "2", qos=0)
+        # 发布连接断线期间消息进入缓存队列
+        for i in range(5):
+            assert bridge.publish(f"txkj/{NODE}/relay/command", "ON", qos=1)
+            assert bridge.publish(f"txkj/{NODE}/relay/state", {"state": "ON"}, qos=0)
+        assert bridge.stats()["publish_pending"] == 10
+        broker.reconnect_all()
+    finally:
+        bridge.stop()
+
+    # 桥接发布的 relay/state 同样在订阅范围内，会被当作遥测数据收回
+    assert [row[3] for row in received if row[1] == "temperature"] == [1.0]
+    assert sum(1 for row in received if row[1] == "relay") == 5
+    assert sum(1 for m in broker.messages if m.topic.endswith("/command")) == 5
+    stats = bridge.stats()
+    assert stats["published"] == 10 and stats["publish_pending"] == 0
+
+
+def benchmark(messages=50000):
+    broker = LocalBroker()
+    bridge = make_bridge(broker, on_readings=add_reading_rows, on_status=None, batch_size=5000, flush_interval=0.2)
+    bridge.start()
+    start = time.perf_counter()
+    for i in range(messages):
+        broker.publish(f"txkj/AABBCC00{i % 100:04X}/temperature", f'{{"temperature": {i % 40}, "ts": {1700000000 + i}}}')
+    bridge.stop()
+    elapsed = time.perf_counter() - start
+    written = bridge.stats()["readings_written"]
+    print(f"接收并写入 {written} 条消息，耗时 {elapsed:.2f}s，{written / elapsed:,.0f} 条/秒，批量写入 {bridge.stats()['flushes']} 次")
+
+
+if __name__ == "__main__":
+
+    test_parse_message()
+    test_ingest_batches_readings_and_status()
+    test_persistent_session_and_qos_queue()
+    print("功能测试通过")
+    benchmark()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Home Assistant 自动发现同步测试：5000 个设备通过 LocalBroker 同步，验证
+# 首次全部发布、无变化时不发布、修改和删除只发布变化的部分（删除为空的保留消息），并输出各次同步的耗时
+#
+# 用法: python test/008_HA自动发现同步测试.py
+#   或: pytest test/008_HA自动发现同步测试.py
+
+import os
+import sys
+import json
+import time
+import tempfile
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.ha_discovery import DiscoverySync, discovery_entity
+from services.mqtt_bridge import MqttBridge
+from services.mqtt_local import LocalBroker
+
+DEVICES = 5000
+TYPES = ["temperature", "humidity", "人在传感器", "relay", "sensor"]
+
+
+def make_devices(count):
+    return [
+        {
+            "mac_address": f"AA:BB:{i // 65536 % 256:02X}:{i // 256 % 256:02X}:{i % 256:02X}:14",
+            "device_name": f"设备_{i}",
+            "device_type": TYPES[i % len(TYPES)],
+            "location": f"房间_{i % 20}" if i % 3 else None,
+        }
+        for i in range(count)
+    ]
+
+
+def timed_sync(sync, devices, label):
+    start = time.perf_counter()
+    result = sync.sync(devices)
+    print(f"{label:<12} 耗时 {time.perf_counter() - start:6.3f}s  {result}")
+    return result
+
+
+def test_discovery_entity():
+    topic, payload = discovery_entity({"mac_address": "AA:BB:CC:DD:EE:FF", "device_name": "桌面温度",
+                                       "device_type": "温度传感器", "location": "书房"})
+    assert topic == "homeassistant/sensor/aabbccddeeff_temperature/config"
+    assert payload["unique_id"] == "aabbccddeeff_temperature"
+    assert payload["state_topic"] == "txkj/aabbccddeeff/temperature"
+    assert payload["device"]["suggested_area"] == "书房"
+
+    topic, payload = discovery_entity({"mac_address": "AA:BB:CC:DD:EE:FF", "device_name": "继电器",
+                                       "device_type": "relay", "location": None})
+    assert topic == "homeassistant/switch/aabbccddeeff_relay/config"
+    assert payload["command_topic"] == "txkj/aabbccddeeff/relay/command"
+    assert "suggested_area" not in payload["device"]
+
+
+def test_sync_publishes_only_changes():
+    broker = LocalBroker()
+    bridge = MqttBridge("local", client_factory=broker.client_factory)
+    bridge.start()
+    sync = DiscoverySync(bridge.publish, batch_size=500)
+    devices = make_devices(DEVICES)
+    try:
+        assert timed_sync(sync, devices, "首次同步")["published"] == DEVICES
+        assert timed_sync(sync, devices, "无变化")["published"] == 0
+
+        for device in devices[:10]:
+            device["location"] = "新房间"
+        result = timed_sync(sync, devices, "修改10个")
+        assert result["published"] == 10 and result["unchanged"] == DEVICES - 10
+
+        removed_topics = {discovery_entity(device)[0] for device in devices[-5:]}
+        result = timed_sync(sync, devices[:-5], "删除5个")
+        assert result["removed"] == 5 and result["published"] == 0
+    finally:
+        bridge.stop()
+
+    # 删除的实体以空的保留消息清除
+    assert not removed_topics & broker.retained.keys()
+    assert {m.topic for m in broker.messages if m.retain and m.payload == b""} == removed_topics
+    retained = json.loads(broker.retained[discovery_entity(devices[0])[0]].payload)
+    assert retained["device"]["suggested_area"] == "新房间"
+    assert len([m for m in broker.messages if m.topic.startswith("homeassistant/")]) == DEVICES + 10 + 5
+
+
+if __name__ == "__main__":
+
+    test_discovery_entity()
+    test_sync_publishes_only_changes()
+    print("测试通过")
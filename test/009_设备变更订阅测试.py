@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 设备变更订阅测试：验证 DAO 写函数发布的增量事件、游标续传、过期游标的 reset 和异步等待
+#
+# 用法: python test/009_设备变更订阅测试.py
+#   或: pytest test/009_设备变更订阅测试.py
+
+import os
+import sys
+import asyncio
+import tempfile
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dao.device_info import DeviceStatus, add_device, add_devices_bulk, update_device_info, update_device_status, delete_device
+from dao.events import EventBus, device_events
+
+MAC = "AA:BB:CC:00:15:01"
+
+
+def test_dao_writes_publish_diffs():
+    cursor = device_events.cursor()
+    add_device(MAC, "change_feed_test", "temperature", "书房")
+    update_device_info(MAC, location="客厅", device_type="temperature")
+    update_device_status(MAC, DeviceStatus.ACTIVE)          # 状态没有变化，不发布事件
+    update_device_status(MAC, DeviceStatus.MAINTENANCE)
+    add_device(MAC, "change_feed_dup", "temperature")       # 失败的写入不发布事件
+    add_devices_bulk([{"mac_address": "AA:BB:CC:00:15:02", "device_name": "change_feed_bulk", "device_type": "relay"}])
+    delete_device(MAC)
+
+    events = device_events.events_after(cursor)
+    assert [(e["op"], e["mac_address"]) for e in events] == [
+        ("create", MAC), ("update", MAC), ("update", MAC), ("create", "AA:BB:CC:00:15:02"), ("delete", MAC)
+    ]
+    assert events[0]["device"]["location"] == "书房"
+    assert events[1]["changes"] == {"location": "客厅"}
+    assert events[2]["changes"] == {"status": "maintenance"}
+    # 从中间的游标续传
+    assert device_events.events_after(f"{device_events.epoch}:{events[2]['seq']}") == events[3:]
+
+
+def test_cursor_reset():
+    bus = EventBus(buffer_size=3)
+    start = bus.cursor()
+    for i in range(5):
+        bus.publish("device", op="delete", mac_address=str(i))
+    assert bus.events_after(start) is None                  # 已被环形缓冲区淘汰
+    assert len(bus.events_after(f"{bus.epoch}:2")) == 3
+    assert bus.events_after("00000000:1") is None           # 其它进程的游标
+    assert bus.events_after(f"{bus.epoch}:99") is None
+    assert bus.events_after(bus.cursor()) == []
+
+
+def test_async_wait():
+    bus = EventBus()
+
+    async def scenario():
+        cursor = bus.cursor()
+        assert not await bus.wait(cursor, 0.05)
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, lambda: loop.run_in_executor(None, lambda: bus.publish("device", op="delete", mac_address="x")))
+        assert await bus.wait(cursor, 2)
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+
+    test_dao_writes_publish_diffs()
+    test_cursor_reset()
+    test_async_wait()
+    print("测试通过")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 心跳在线检测测试：验证时间轮的到期和多圈定时器、心跳的惰性重新调度、
+# 只跟踪已登记的设备且跟踪数有上限、启动时按设备表中的在线设备开始计时、只有上线/离线变化才写入设备表，
+# 且心跳只恢复被心跳检测判定为离线的设备，以及大量设备持续心跳时的吞吐和数据库写入次数
+#
+# 用法: python test/010_心跳在线检测测试.py
+#   或: pytest test/010_心跳在线检测测试.py
+
+import os
+import sys
+import time
+import tempfile
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dao.device_info import DeviceStatus, add_device, add_devices_bulk, get_device_by_mac, update_device_status, update_devices_liveness
+from services.liveness import TimerWheel, LivenessTracker
+
+MAC = "AA:BB:CC:00:16:01"
+
+
+def test_timer_wheel():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.schedule("a", 3)
+    wheel.schedule("b", 11)         # 超过一圈，与 a 落在同一个槽位
+    wheel.schedule("c", 5)
+    wheel.schedule("c", 6)          # 替换原来的定时器
+    assert len(wheel) == 3
+    assert wheel.advance(2) == []
+    assert wheel.advance(3) == ["a"]
+    assert wheel.advance(6) == ["c"]
+    assert "b" in wheel
+    assert wheel.advance(10) == []
+    assert wheel.advance(100) == ["b"]  # 落后超过一圈
+    wheel.schedule("d", 101.5)
+    wheel.cancel("d")
+    assert len(wheel) == 0 and wheel.advance(200) == []
+
+
+def test_lazy_reschedule():
+    transitions = []
+    tracker = LivenessTracker(lambda online, offline: transitions.append((online, offline)),
+                              default_interval=10, timeout_factor=2.0, slots=16, clock=lambda: 0.0)
+    tracker.update_config("fast", {"report_interval": 2})
+    assert tracker.heartbeat("slow", now=0) is True
+    assert tracker.heartbeat("fast", now=0) is True
+    assert tracker.heartbeat("slow", now=1) is False
+    tracker.flush()
+    assert transitions == [(["slow", "fast"], [])]
+
+    # 定时器在 20 秒到期，期间有过心跳就顺延，不判定为离线
+    tracker.heartbeat("slow", now=15)
+    assert tracker.tick(4) == 1             # fast 超过 2 * 2 秒没有心跳
+    assert tracker.tick(20) == 0
+    assert tracker.is_online("slow")
+    assert tracker.tick(35) == 1
+    tracker.flush()
+    assert transitions[1:] == [([], ["fast", "slow"])]
+
+    # 同一次 flush 之前先离线再上线，不产生写入
+    tracker.heartbeat("fast", now=40)
+    tracker.mark_offline("fast")
+    tracker.heartbeat("fast", now=41)
+    tracker.mark_offline("fast")
+    tracker.heartbeat("fast", now=42)
+    tracker.flush()
+    assert transitions[2:] == [(["fast"], [])]
+    assert tracker.stats()["online"] == 1 and tracker.stats()["offline"] == 1
+
+
+def test_unknown_devices_rejected():
+    tracker = LivenessTracker(default_interval=10, max_devices=3, clock=lambda: 0.0)
+    tracker.heartbeat("stray", now=0)
+    tracker.load_devices(["a", "b", "c", "d"])
+    assert tracker.last_seen("stray") is None       # 登记之前收到的未登记设备被丢弃
+
+    assert tracker.heartbeats(["a", "x", "y", "a"], now=1) == 1
+    assert tracker.heartbeat("z", now=1) is False
+    assert tracker.stats()["tracked"] == 1 and tracker.stats()["rejected"] == 3
+
+    # 新登记的设备可以上报，删除的设备不再跟踪
+    tracker.on_device_event({"type": "device", "op": "create", "mac_address": "x"})
+    assert tracker.heartbeats(["x", "b"], now=2) == 2
+    tracker.on_device_event({"type": "device", "op": "delete", "mac_address": "a"})
+    assert not tracker.is_online("a") and tracker.last_seen("a") is None
+    assert tracker.heartbeat("a", now=3) is False
+
+    # 达到上限后已登记的新设备也被拒绝，已跟踪的设备不受影响
+    assert tracker.heartbeats(["c", "d"], now=3) == 1
+    assert tracker.heartbeat("d", now=4) is False and tracker.last_seen("d") is None
+    assert tracker.heartbeat("c", now=4) is False and tracker.last_seen("c") == 4
+    assert tracker.stats()["tracked"] == 3
+
+
+def test_only_transitions_persisted():
+    add_device(MAC, "liveness_test", "temperature")
+    assert update_devices_liveness([MAC], online=True) == []            # 已经是 active
+    assert update_devices_liveness([MAC], online=False) == [MAC]
+    assert get_device_by_mac(MAC)["status"] == DeviceStatus.INACTIVE.value
+    assert update_devices_liveness([MAC], online=False) == []
+    assert update_devices_liveness([MAC, "AA:BB:CC:00:16:FF"], online=True) == [MAC]
+
+    # 维护中的设备不受心跳影响
+    update_device_status(MAC, DeviceStatus.MAINTENANCE)
+    assert update_devices_liveness([MAC], online=False) == []
+    assert get_device_by_mac(MAC)["status"] == DeviceStatus.MAINTENANCE.value
+
+    # 人工设为 inactive 的设备不会因为心跳恢复在线，包括心跳检测判定离线之后又人工设置一次的
+    update_device_status(MAC, DeviceStatus.INACTIVE)
+    assert update_devices_liveness([MAC], online=True) == []
+    update_device_status(MAC, DeviceStatus.ACTIVE)
+    assert update_devices_liveness([MAC], online=False) == [MAC]
+    update_device_status(MAC, DeviceStatus.INACTIVE)
+    assert update_devices_liveness([MAC], online=True) == []
+    assert get_device_by_mac(MAC)["status"] == DeviceStatus.INACTIVE.value
+
+    # 心跳检测判定离线后改为维护中，之后的心跳同样不会改动
+    update_device_status(MAC, DeviceStatus.ACTIVE)
+    assert update_devices_liveness([MAC], online=False) == [MAC]
+    update_device_status(MAC, DeviceStatus.MAINTENANCE)
+    update_device_status(MAC, DeviceStatus.INACTIVE)
+    assert update_devices_liveness([MAC], online=True) == []
+
+
+def test_seeded_on_startup():
+    """服务启动前就是 active 的设备，启动后一直没有心跳也会超时离线"""
+    from fastapi.testclient import TestClient
+    from server import app, liveness_tracker
+
+    mac = "AA:BB:CC:00:16:02"
+    add_device(mac, "liveness_seed", "temperature")
+    with TestClient(app) as client:
+        assert client.get("/api/liveness", params={"mac_address": mac}).json()["online"] is True
+        assert liveness_tracker.stats()["pending"] == 0      # 启动时的计时不产生写入
+        liveness_tracker.tick(time.time() + 3600)
+        liveness_tracker.flush()
+        assert client.get("/api/liveness", params={"mac_address": mac}).json()["online"] is False
+    assert get_device_by_mac(mac)["status"] == DeviceStatus.INACTIVE.value
+
+
+def test_heartbeat_throughput(device_count=10000, seconds=5, interval=1.0):
+    """device_count 个设备每 interval 秒心跳一次，模拟 seconds 秒，最后 10% 的设备停止心跳"""
+    macs = [f"AA:BB:{(i >> 16) & 0xFF:02X}:{(i >> 8) & 0xFF:02X}:{i & 0xFF:02X}:16" for i in range(device_count)]
+    add_devices_bulk([{"mac_address": mac, "device_name": f"liveness_{i}", "device_type": "temperature"}
+                      for i, mac in enumerate(macs)])
+
+    db_writes = []
+
+    def persist(online, offline):
+        db_writes.append(len(update_devices_liveness(online, True)) + len(update_devices_liveness(offline, False)))
+
+    tracker = LivenessTracker(persist, default_interval=interval, timeout_factor=2.0, tick=0.1, clock=lambda: 0.0)
+    silent = device_count // 10
+    now = 0.0
+    heartbeats = 0
+    elapsed = 0.0
+    while now < seconds:
+        alive = macs if now < seconds / 2 else macs[silent:]
+        start = time.perf_counter()
+        for mac in alive:
+            tracker.heartbeat(mac, now)
+        elapsed += time.perf_counter() - start
+        heartbeats += len(alive)
+        for step in range(1, 11):
+            tracker.tick(now + step * interval / 10)
+        tracker.flush()
+        now += interval
+
+    stats = tracker.stats()
+    print(f"{device_count} 个设备心跳 {heartbeats} 次，{heartbeats / elapsed:,.0f} 次/秒，"
+          f"在线 {stats['online']}，离线 {stats['offline']}，设备表实际更新 {sum(db_writes)} 行")
+    assert stats["offline"] == silent
+    # 新登记的设备本来就是 active，只有停止心跳的设备产生写入
+    assert sum(db_writes) == silent
+    assert heartbeats / elapsed > 10000
+
+
+if __name__ == "__main__":
+
+    test_timer_wheel()
+    test_lazy_reschedule()
+    test_unknown_devices_rejected()
+    test_only_transitions_persisted()
+    test_seeded_on_startup()
+    test_heartbeat_throughput()
+    print("测试通过")
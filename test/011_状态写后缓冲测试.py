@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 设备状态写后缓冲测试：验证同一设备的状态合并为最新值、写入前后都能读到自己写入的值、
+# 停止时写入剩余状态、服务启动时重建设备汇总表，以及设备频繁上下线时与逐条提交的吞吐对比
+#
+# 用法: python test/011_状态写后缓冲测试.py
+#   或: pytest test/011_状态写后缓冲测试.py
+
+import os
+import sys
+import time
+import tempfile
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dao.device_info import (DeviceStatus, add_device, add_devices_bulk, get_device_by_mac, get_device_summary,
+                             update_device_status, status_write_behind, engine_device)
+from dao.events import device_events
+from sqlalchemy import event
+
+MAC = "AA:BB:CC:00:17:01"
+
+
+class CommitCounter:
+    """统计设备库上的提交次数"""
+
+    def __init__(self):
+        self.commits = 0
+
+    def __call__(self, conn):
+        self.commits += 1
+
+    def __enter__(self):
+        event.listen(engine_device, "commit", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(engine_device, "commit", self)
+
+
+def test_coalesce_and_read_your_writes():
+    add_device(MAC, "write_behind_test", "temperature")
+    status_write_behind.flush_interval = 60     # 只由测试显式写入
+    status_write_behind.start()
+    try:
+        cursor = device_events.cursor()
+        get_device_by_mac(MAC)      # 预热缓存
+        with CommitCounter() as counter:
+            for device_status in (DeviceStatus.INACTIVE, DeviceStatus.MAINTENANCE, DeviceStatus.INACTIVE):
+                assert update_device_status(MAC, device_status)
+                assert get_device_by_mac(MAC)["status"] == device_status.value
+            assert counter.commits == 0
+        assert not update_device_status("AA:BB:CC:00:17:FF", DeviceStatus.INACTIVE)
+
+        # 汇总查询之前先写入缓冲中的状态
+        summary = get_device_summary()
+        assert summary["inactive"] >= 1
+        assert status_write_behind.stats()["pending"] == 0
+        assert [e["changes"] for e in device_events.events_after(cursor)] == [{"status": "inactive"}]
+
+        # 改回原值不产生写入和事件
+        update_device_status(MAC, DeviceStatus.MAINTENANCE)
+        update_device_status(MAC, DeviceStatus.INACTIVE)
+        cursor = device_events.cursor()
+        assert status_write_behind.flush() == 0
+        assert device_events.events_after(cursor) == []
+
+        update_device_status(MAC, DeviceStatus.ACTIVE)
+    finally:
+        status_write_behind.stop()
+        status_write_behind.flush_interval = 0.2
+    # 停止时写入剩余状态，之后直接写入数据库
+    assert status_write_behind.stats()["pending"] == 0
+    assert get_device_by_mac(MAC)["status"] == DeviceStatus.ACTIVE.value
+    update_device_status(MAC, DeviceStatus.INACTIVE)
+    assert get_device_by_mac(MAC)["status"] == DeviceStatus.INACTIVE.value
+
+
+def test_summary_rebuilt_on_startup():
+    """汇总表在导入模块时不再重建，由服务启动（主进程）时重建一次，补齐绕过触发器的数据"""
+    from fastapi.testclient import TestClient
+    from server import app
+
+    add_device("AA:BB:CC:00:17:02", "summary_rebuild_test", "humidity", location="summary_room")
+    with engine_device.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM device_summary")
+    assert get_device_summary()["total"] == 0
+
+    with TestClient(app) as client:
+        summary = client.get("/api/device-status").json()
+    with engine_device.connect() as conn:
+        total = conn.exec_driver_sql("SELECT COUNT(*) FROM devices").scalar()
+    assert summary["total"] == total > 0
+    assert {"location": "summary_room", "active": 1, "inactive": 0, "maintenance": 0, "total": 1} in summary["by_location"]
+
+
+def test_flapping_throughput(device_count=200, updates=20000):
+    """device_count 个设备反复上下线，对比逐条提交与写后缓冲的吞吐和提交次数"""
+    macs = [f"AA:BB:CC:17:{i >> 8:02X}:{i & 0xFF:02X}" for i in range(device_count)]
+    add_devices_bulk([{"mac_address": mac, "device_name": f"flap_{i}", "device_type": "relay"}
+                      for i, mac in enumerate(macs)])
+    for mac in macs:
+        get_device_by_mac(mac)      # 预热缓存，写后缓冲模式下的存在性检查走缓存
+
+    def run(count):
+        with CommitCounter() as counter:
+            start = time.perf_counter()
+            for i in range(count):
+                device_status = DeviceStatus.ACTIVE if (i // device_count) % 2 else DeviceStatus.INACTIVE
+                update_device_status(macs[i % device_count], device_status)
+            status_write_behind.flush()
+            return count / (time.perf_counter() - start), counter.commits
+
+    direct_rate, direct_commits = run(updates // 10)
+    status_write_behind.start()
+    try:
+        buffered_rate, buffered_commits = run(updates)
+    finally:
+        status_write_behind.stop()
+
+    print(f"逐条提交: {direct_rate:,.0f} 次/秒，{updates // 10} 次更新提交 {direct_commits} 次")
+    print(f"写后缓冲: {buffered_rate:,.0f} 次/秒，{updates} 次更新提交 {buffered_commits} 次")
+    assert buffered_commits < direct_commits
+    assert buffered_rate > direct_rate * 5
+
+
+if __name__ == "__main__":
+
+    test_coalesce_and_read_your_writes()
+    test_summary_rebuilt_on_startup()
+    test_flapping_throughput()
+    print("测试通过")
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 多进程部署测试：以 IOT_CLUSTER=1 启动多个 uvicorn worker，验证写操作经主进程串行写入后任何 worker 都能立即读到、
+# 副本进程转发的写操作出错时返回与单进程相同的结果，
+# 并对比 1 个和 N 个 worker 在读多写少负载下的吞吐、延迟和错误数（包括 database is locked）
+#
+# 用法: python test/012_多进程部署测试.py [worker 数，默认 4]
+#   或: pytest test/012_多进程部署测试.py（只运行一致性测试）
+
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import subprocess
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEVICES = 2000
+CONCURRENCY = 32
+DURATION = 10
+WRITE_RATIO = 0.05
+
+
+def start_server(port, workers):
+    log_dir = tempfile.mkdtemp()
+    env = dict(os.environ, IOT_LOG_DIR=log_dir, IOT_CLUSTER="1" if workers > 1 else "0")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT_DIR, env=env
+    )
+    for _ in range(200):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/cache-stats", timeout=0.5)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("服务启动失败")
+
+
+def stop_server(proc):
+    proc.terminate()
+    proc.wait(timeout=30)
+
+
+def fresh_client(port):
+    """不复用连接，每个请求都可能落到不同的 worker"""
+    return httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=30,
+                        limits=httpx.Limits(max_keepalive_connections=0))
+
+
+def test_cluster_consistency(port=55611, workers=3):
+    proc = start_server(port, workers)
+    try:
+        with fresh_client(port) as client:
+            mac = "AA:BB:CC:00:18:01"
+            response = client.post("/api/devices", json={
+                "mac_address": mac, "device_name": "cluster_test", "device_type": "temperature", "status": "active"
+            })
+            assert response.json()["status"] == "success", response.text
+
+            roles = set()
+            for i in range(40):
+                # 写入后立即从（可能是另一个 worker 的）新连接读取，缓存中不能有旧值
+                response = client.put(f"/api/devices/{mac}", json={"location": f"room_{i}"})
+                assert response.json()["status"] == "success", response.text
+                assert client.get(f"/api/devices/{mac}").json()["location"] == f"room_{i}"
+                device_status = ("active", "inactive", "maintenance")[i % 3]
+                assert client.patch(f"/api/devices/{mac}/status", json={"status": device_status}).json()["status"] == device_status
+                assert client.get(f"/api/devices/{mac}").json()["status"] == device_status
+                roles.add(client.get("/api/cache-stats").json()["cluster"]["role"])
+
+            client.post("/api/sensor-configs", json={"device_mac": mac, "report_interval": 30})
+            versions = set()
+            for interval in (10, 20, 40):
+                client.put(f"/api/sensor-configs/{mac}", json={"report_interval": interval})
+                snapshot = client.get("/api/sensor-configs").json()
+                assert snapshot["configs"][0]["report_interval"] == interval
+                versions.add(snapshot["version"])
+            assert len(versions) == 3
+
+            # 心跳检测只在主进程中运行，从任何 worker 上报和查询都一致
+            assert client.post("/api/heartbeat", json=[mac]).json()["accepted"] == 1
+            for _ in range(5):
+                assert client.get("/api/liveness", params={"mac_address": mac}).json()["online"]
+
+            # 变更游标在所有 worker 上一致
+            cursors = {client.get("/api/devices", params={"limit": 1}).headers["X-Change-Cursor"] for _ in range(10)}
+            assert len(cursors) == 1, cursors
+
+        print(f"一致性测试通过，请求落到的角色: {sorted(roles)}")
+        assert roles == {"primary", "replica"}
+    finally:
+        stop_server(proc)
+
+
+def test_replica_duplicate_config(port=55613, workers=2):
+    """副本进程转发的写操作违反唯一约束时，返回与单进程部署相同的“配置已存在”，而不是异常堆栈"""
+    proc = start_server(port, workers)
+    try:
+        mac = "AA:BB:CC:00:18:02"
+        with fresh_client(port) as client:
+            assert client.post("/api/sensor-configs", json={"device_mac": mac}).json()["status"] == "success"
+        # 保持连接的客户端所有请求都落到同一个 worker，找到一个副本进程的连接
+        for _ in range(50):
+            client = httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=30)
+            if client.get("/api/cache-stats").json()["cluster"]["role"] == "replica":
+                break
+            client.close()
+        else:
+            raise AssertionError("没有请求落到副本进程")
+        try:
+            result = client.post("/api/sensor-configs", json={"device_mac": mac}).json()
+            assert result == {"status": "failed", "error_info": f"设备 {mac} 的配置已存在"}, result
+            assert client.get("/api/cache-stats").json()["cluster"]["role"] == "replica"
+        finally:
+            client.close()
+    finally:
+        stop_server(proc)
+
+
+async def run_load(port):
+    """读多写少的混合负载：按 MAC 读单个设备、分页列表和少量状态更新"""
+    latencies = []
+    errors = {}
+    macs = [f"AC:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}:00:18" for i in range(DEVICES)]
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60,
+                                 limits=httpx.Limits(max_connections=CONCURRENCY)) as client:
+        for start in range(0, DEVICES, 500):
+            await client.post("/api/devices/bulk", json=[
+                {"mac_address": mac, "device_name": f"load_{start + i}", "device_type": "temperature", "status": "active"}
+                for i, mac in enumerate(macs[start:start + 500])
+            ])
+
+        deadline = time.perf_counter() + DURATION
+
+        async def worker(seed):
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                mac = rng.choice(macs)
+                choice = rng.random()
+                begin = time.perf_counter()
+                if choice < WRITE_RATIO:
+                    response = await client.patch(f"/api/devices/{mac}/status",
+                                                  json={"status": rng.choice(("active", "inactive"))})
+                elif choice < 0.15:
+                    response = await client.get("/api/devices", params={"limit": 50, "status": "active"})
+                else:
+                    response = await client.get(f"/api/devices/{mac}")
+                latencies.append(time.perf_counter() - begin)
+                if response.status_code >= 400:
+                    key = "database is locked" if "locked" in response.text else str(response.status_code)
+                    errors[key] = errors.get(key, 0) + 1
+
+        await asyncio.gather(*(worker(i) for i in range(CONCURRENCY)))
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / DURATION,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    test_cluster_consistency()
+    test_replica_duplicate_config()
+
+    print(f"\nCPU 核数: {os.cpu_count()}，并发连接: {CONCURRENCY}，写请求比例: {WRITE_RATIO:.0%}，每轮 {DURATION} 秒")
+    print(f"{'worker':>8}{'请求/秒':>12}{'p50(ms)':>10}{'p99(ms)':>10}  错误")
+    for count in (1, workers):
+        proc = start_server(55612, count)
+        try:
+            result = asyncio.run(run_load(55612))
+        finally:
+            stop_server(proc)
+        print(f"{count:>8}{result['rps']:>12,.0f}{result['p50']:>10.1f}{result['p99']:>10.1f}  {result['errors'] or '无'}")
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 结构化日志测试：验证日志为一行一条的 JSON、请求关联 ID 会带到数据库线程中的日志、重复错误被限流、
+# 成功请求的访问日志按比例采样，并对比请求处理中 print 堆栈与经队列写日志在调用方线程上的耗时
+#
+# 用法: python test/014_结构化日志测试.py
+#   或: pytest test/014_结构化日志测试.py
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import traceback
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import LOG_LEVEL, LOG_SAMPLE_RATE, LOG_RATE_LIMIT, LOG_RATE_WINDOW, LOG_QUEUE_SIZE
+from utils.log import setup_logging, shutdown_logging, get_logger, RateLimitFilter
+
+MAC = "AA:BB:CC:00:20:01"
+
+
+def capture_logs(**options):
+    """重新安装日志 handler，输出写到内存中"""
+    shutdown_logging()
+    stream = io.StringIO()
+    setup_logging(stream=stream, **options)
+    return stream
+
+
+def read_logs(stream):
+    shutdown_logging()      # 等后台线程写完队列中的日志
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def restore_logging():
+    """恢复为服务的日志配置（与 server.py 相同），同一进程中之后运行的测试不受影响"""
+    shutdown_logging()
+    setup_logging(level=LOG_LEVEL, sample_rate=LOG_SAMPLE_RATE, rate_limit=LOG_RATE_LIMIT,
+                  rate_window=LOG_RATE_WINDOW, queue_size=LOG_QUEUE_SIZE)
+
+
+def test_request_id_and_sampling():
+    from fastapi.testclient import TestClient
+    from server import app
+
+    try:
+        stream = capture_logs(sample_rate=1.0)
+        with TestClient(app) as client:
+            client.post("/api/devices", json={"mac_address": MAC, "device_name": "log_test", "device_type": "temperature",
+                                              "status": "active"})
+            response = client.delete(f"/api/devices/{MAC}", headers={"X-Request-ID": "req-test-1"})
+            assert response.headers["X-Request-ID"] == "req-test-1"
+            assert client.get("/api/cache-stats").headers["X-Request-ID"]
+            records = read_logs(stream)
+
+            # 采样率为 0 时成功请求不输出访问日志，错误请求照常输出
+            stream = capture_logs(sample_rate=0.0)
+            for _ in range(20):
+                client.get("/api/cache-stats")
+            client.get("/no-such-path")
+            access = [r for r in read_logs(stream) if r["logger"] == "iot.access"]
+    finally:
+        restore_logging()
+
+    # 在数据库线程中执行的 DAO 函数写的日志也带上请求的关联 ID
+    deleted = [r for r in records if r["msg"] == "设备删除成功"]
+    assert deleted and deleted[0]["request_id"] == "req-test-1" and deleted[0]["mac_address"] == MAC
+    access_1 = [r for r in records if r["logger"] == "iot.access" and r.get("request_id") == "req-test-1"]
+    assert access_1 and access_1[0]["route"] == "/api/devices/{mac_address}" and access_1[0]["status"] == 200
+    assert [r["status"] for r in access] == [404]
+
+
+def test_rate_limit():
+    logger = get_logger("test")
+
+    def fail(i):
+        try:
+            raise ValueError(f"第 {i} 次")
+        except ValueError:
+            logger.exception("处理失败: %s", i)
+
+    try:
+        stream = capture_logs(rate_limit=3, rate_window=0.2)
+        for i in range(50):
+            fail(i)
+        logger.warning("其它警告")
+        time.sleep(0.25)
+        fail(50)
+        records = read_logs(stream)
+    finally:
+        restore_logging()
+
+    failures = [r for r in records if r["msg"].startswith("处理失败")]
+    assert [r["msg"] for r in failures] == ["处理失败: 0", "处理失败: 1", "处理失败: 2", "处理失败: 50"]
+    assert failures[0]["exc_type"] == "ValueError" and "Traceback" in failures[0]["exc"]
+    assert failures[-1]["suppressed"] == 47
+    assert any(r["msg"] == "其它警告" for r in records)
+    # INFO 不受限流影响
+    assert RateLimitFilter(burst=1).filter(logging.makeLogRecord({"levelno": logging.INFO}))
+
+
+def main():
+    test_request_id_and_sampling()
+    test_rate_limit()
+    print("测试通过")
+
+    # 请求处理中遇到同一个错误时，调用方线程（事件循环）上的耗时
+    count = 2000
+    with open(os.devnull, "w") as devnull:
+        start = time.perf_counter()
+        for i in range(count):
+            try:
+                raise ValueError(i)
+            except ValueError:
+                print(traceback.format_exc(), file=devnull, flush=True)
+        print(f"print 堆栈: {(time.perf_counter() - start) / count * 1e6:.1f} 微秒/条")
+
+        logger = get_logger("bench")
+        for label, options in (("队列日志（不限流）", {"rate_limit": 0}), ("队列日志（限流）", {"rate_limit": 5})):
+            shutdown_logging()
+            setup_logging(stream=devnull, queue_size=count + 10, **options)
+            start = time.perf_counter()
+            for i in range(count):
+                try:
+                    raise ValueError(i)
+                except ValueError:
+                    logger.exception("处理失败")
+            cost = (time.perf_counter() - start) / count
+            shutdown_logging()
+            print(f"{label}: {cost * 1e6:.1f} 微秒/条")
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 设备列表序列化测试：验证 query_devices 在 SQL 中转换的日期和状态与 to_dict 的结果一致、列表和单个设备接口不产生弃用警告，
+# 并在 1k/10k/100k 个设备上对比全量列表的查询加序列化耗时：
+#   ORM 逐字段转换: session.query + 逐字段 _format_value + json.dumps（之前的实现）
+#   pydantic 校验:  query_devices + List[DeviceResponse] 重新校验和序列化（声明 response_model 时的做法）
+#   标准库 json:    query_devices + json.dumps（starlette 的 JSONResponse）
+#   orjson:         query_devices + orjson.dumps（现在列表接口预先序列化后直接返回字节）
+#
+# 用法: python test/015_列表序列化性能测试.py
+#   或: pytest test/015_列表序列化性能测试.py（只运行一致性测试）
+
+import os
+import sys
+import json
+import time
+import warnings
+import tempfile
+from typing import List
+from datetime import datetime
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson
+from pydantic import TypeAdapter
+from sqlalchemy import update
+from dao.database import session_scope
+from dao.device_info import (DeviceInfo, DeviceStatus, DEVICE_FIELDS, add_devices_bulk, query_devices, update_device_status,
+                             engine_device, _format_value)
+
+SIZES = (1000, 10000, 100000)
+
+
+def make_devices(start, count):
+    return [{
+        "mac_address": f"AB:{i >> 24 & 0xFF:02X}:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}:21",
+        "device_name": f"serialize_{i}",
+        "device_type": ("temperature", "humidity", "relay")[i % 3],
+        "location": f"room_{i % 50}",
+        "description": "序列化测试设备" if i % 2 else None,
+    } for i in range(start, start + count)]
+
+
+def stdlib_dumps(content):
+    """与 starlette JSONResponse.render 相同的参数"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def orm_dicts():
+    """之前的实现：ORM 查询各列后逐字段转换"""
+    with session_scope(engine_device) as session:
+        rows = session.query(*[getattr(DeviceInfo, f) for f in DEVICE_FIELDS]).order_by(DeviceInfo.id).all()
+        return [{f: _format_value(getattr(row, f)) for f in DEVICE_FIELDS} for row in rows]
+
+
+def test_rows_match_to_dict():
+    add_devices_bulk(make_devices(0, 300))
+    update_device_status("AB:00:00:00:05:21", DeviceStatus.MAINTENANCE)
+    with session_scope(engine_device) as session:
+        # 微秒为 0 的时间 isoformat 不带小数部分
+        session.execute(update(DeviceInfo).where(DeviceInfo.id == 1).values(install_date=datetime(2024, 5, 1, 8, 30)))
+        expected = {device.mac_address: device.to_dict() for device in session.query(DeviceInfo)}
+
+    devices, _, total = query_devices()
+    assert total == len(devices) == len(expected)
+    assert devices == [expected[device["mac_address"]] for device in devices]
+    assert devices[0]["install_date"] == "2024-05-01T08:30:00"
+    assert orjson.loads(orjson.dumps(devices)) == json.loads(stdlib_dumps(devices))
+
+    # 按日期排序翻页的游标在 SQL 转换后的值上同样可用
+    pages, cursor = [], None
+    while True:
+        page, cursor, _ = query_devices(sort="-created_at", limit=70, cursor=cursor, fields=["mac_address", "status"])
+        pages.extend(page)
+        if not cursor:
+            break
+    assert len({device["mac_address"] for device in pages}) == total
+    assert {"mac_address": "AB:00:00:00:05:21", "status": "maintenance"} in pages
+
+
+def test_list_endpoints_without_deprecation_warning():
+    from fastapi.exceptions import FastAPIDeprecationWarning
+    from fastapi.testclient import TestClient
+    from server import app
+
+    add_devices_bulk(make_devices(300, 5))
+    with TestClient(app) as client:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            response = client.get("/api/devices", params={"limit": 3})
+            device = client.get("/api/devices/AB:00:00:01:2C:21")
+        assert response.status_code == 200 and response.headers["content-type"] == "application/json"
+        assert len(response.json()) == 3 and response.headers["X-Next-Cursor"]
+        assert device.json()["device_name"] == "serialize_300"
+        # 单个设备接口直接返回字节，不声明 response_model，OpenAPI 文档仍然描述为 DeviceResponse
+        route = next(r for r in app.routes if getattr(r, "path", None) == "/api/devices/{mac_address}" and "GET" in r.methods)
+        assert route.response_model is None
+        schema = app.openapi()["paths"]["/api/devices/{mac_address}"]["get"]["responses"]["200"]
+        assert schema["content"]["application/json"]["schema"] == {"$ref": "#/components/schemas/DeviceResponse"}
+    deprecated = [str(w.message) for w in caught if issubclass(w.category, (FastAPIDeprecationWarning, DeprecationWarning))]
+    assert not deprecated, deprecated
+
+
+def best_of(func, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    test_rows_match_to_dict()
+    test_list_endpoints_without_deprecation_warning()
+    print("一致性测试通过")
+
+    from server import DeviceResponse
+    adapter = TypeAdapter(List[DeviceResponse])
+    paths = {
+        "ORM 逐字段转换": lambda: stdlib_dumps(orm_dicts()),
+        "pydantic 校验": lambda: adapter.dump_json(adapter.validate_python(query_devices()[0])),
+        "标准库 json": lambda: stdlib_dumps(query_devices()[0]),
+        "orjson": lambda: orjson.dumps(query_devices()[0]),
+    }
+
+    inserted = 300
+    print(f"{'设备数':>8}" + "".join(f"{name:>16}" for name in paths) + f"{'加速比':>10}（ORM 逐字段转换 / orjson）")
+    for size in SIZES:
+        for start in range(inserted, size, 5000):
+            add_devices_bulk(make_devices(start, min(5000, size - start)))
+        inserted = size
+        costs = {name: best_of(func) for name, func in paths.items()}
+        print(f"{size:>8,}" + "".join(f"{costs[name] * 1000:>14.1f}ms" for name in paths)
+              + f"{costs['ORM 逐字段转换'] / costs['orjson']:>9.1f}x")
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 设备记录测试：验证 Core 查询构造的 DeviceRecord 与 ORM 的 to_dict 结果一致、不可变、支持按字段名取值，
+# 并对比 10 万个设备时 ORM 实例、ORM + to_dict 字典与 DeviceRecord 三种读取方式的常驻内存和每秒行数
+#
+# 用法: python test/016_设备记录内存测试.py [设备数，默认 100000]
+#   或: pytest test/016_设备记录内存测试.py（只运行一致性测试）
+
+import gc
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dao.database import session_scope
+from dao.device_info import (DeviceInfo, DeviceRecord, DeviceStatus, add_devices_bulk, get_all_devices, get_device_records,
+                             get_device_by_mac, update_device_status, device_cache, engine_device)
+
+
+def make_devices(start, count):
+    return [{
+        "mac_address": f"AD:{i >> 24 & 0xFF:02X}:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}:22",
+        "device_name": f"record_{i}",
+        "device_type": ("temperature", "humidity", "relay")[i % 3],
+        "location": f"room_{i % 50}",
+        "description": "设备记录测试" if i % 2 else None,
+    } for i in range(start, start + count)]
+
+
+def test_records_match_orm():
+    add_devices_bulk(make_devices(0, 200))
+    mac = "AD:00:00:00:07:22"
+    update_device_status(mac, DeviceStatus.INACTIVE)
+
+    records = get_all_devices()
+    with session_scope(engine_device) as session:
+        expected = [device.to_dict() for device in session.query(DeviceInfo).order_by(DeviceInfo.id)]
+    assert [record.to_dict() for record in records] == expected
+
+    record = get_device_records(status=DeviceStatus.INACTIVE)[0]
+    assert isinstance(record, DeviceRecord) and record.mac_address == mac
+    assert record["status"] == record.status == "inactive" and record.get("location") == "room_7"
+    assert dict(record) == record.to_dict()
+    try:
+        record.status = "active"
+        assert False, "DeviceRecord 应当不可变"
+    except AttributeError:
+        pass
+    assert not hasattr(record, "__dict__")
+
+    # 缓存中存放的是记录，返回给调用方的是可以随意修改的字典
+    device = get_device_by_mac(mac)
+    device["status"] = "changed"
+    assert isinstance(device_cache.get(mac)[1], DeviceRecord)
+    assert get_device_by_mac(mac)["status"] == "inactive"
+
+
+def measure(load):
+    """返回 (结果常驻内存字节数, 每秒行数)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = load()
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # 计时单独再跑一次，排除 tracemalloc 的开销
+    del result
+    gc.collect()
+    start = time.perf_counter()
+    rows = len(load())
+    elapsed = time.perf_counter() - start
+    return retained, rows / elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    test_records_match_orm()
+    print("一致性测试通过")
+
+    for start in range(200, count, 5000):
+        add_devices_bulk(make_devices(start, min(5000, count - start)))
+
+    def orm_instances():
+        # 提交前移出会话，避免提交时过期清空属性，得到加载完整的 ORM 实例
+        with session_scope(engine_device) as session:
+            devices = session.query(DeviceInfo).all()
+            session.expunge_all()
+            return devices
+
+    def orm_dicts():
+        with session_scope(engine_device) as session:
+            return [device.to_dict() for device in session.query(DeviceInfo).all()]
+
+    print(f"{count:,} 个设备")
+    print(f"{'读取方式':<16}{'内存(MB)':>10}{'每设备(字节)':>14}{'行/秒':>12}")
+    for name, load in (("ORM 实例", orm_instances), ("ORM + to_dict", orm_dicts), ("DeviceRecord", get_device_records)):
+        retained, rate = measure(load)
+        print(f"{name:<16}{retained / 1e6:>10.1f}{retained / count:>14.0f}{rate:>12,.0f}")
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 设备流式导出测试：验证 NDJSON/CSV 导出的内容与 GET /api/devices 一致、筛选条件生效、gzip 可以正确解压，
+# 并在独立的 uvicorn 进程中导出大量设备，对比流式导出与一次性返回全部设备的列表接口的服务端峰值内存（VmHWM）
+#
+# 用法: python test/017_设备流式导出测试.py [设备数，默认 1000000]
+#   或: pytest test/017_设备流式导出测试.py（只运行导出内容测试）
+
+import io
+import os
+import sys
+import csv
+import gzip
+import json
+import time
+import tempfile
+import subprocess
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+
+def make_devices(start, count):
+    return [{
+        "mac_address": f"AE:{i >> 24 & 0xFF:02X}:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}:23",
+        "device_name": f"export_{i}",
+        "device_type": ("temperature", "humidity", "relay")[i % 3],
+        "location": f"机房_{i % 50}",
+        "description": "导出测试, 含逗号和\"引号\"" if i % 2 else None,
+    } for i in range(start, start + count)]
+
+
+def test_export_formats():
+    from fastapi.testclient import TestClient
+    from server import app
+    from dao.device_info import add_devices_bulk
+
+    add_devices_bulk(make_devices(0, 2500))
+    with TestClient(app) as client:
+        expected = client.get("/api/devices").json()
+
+        response = client.get("/api/devices/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert response.headers["content-disposition"].endswith('.ndjson"')
+        assert [json.loads(line) for line in response.text.splitlines()] == expected
+
+        response = client.get("/api/devices/export", params={"format": "csv", "gzip": "true"})
+        assert response.headers["content-type"] == "application/gzip"
+        text = gzip.decompress(response.content).decode("utf-8-sig")
+        rows = list(csv.DictReader(io.StringIO(text)))
+        assert rows == [{k: "" if v is None else str(v) for k, v in device.items()} for device in expected]
+
+        response = client.get("/api/devices/export", params={"gzip": "true", "device_type": "relay"})
+        relays = [json.loads(line) for line in gzip.decompress(response.content).splitlines()]
+        assert relays == [device for device in expected if device["device_type"] == "relay"]
+
+        # 没有匹配的设备时 CSV 只有表头
+        response = client.get("/api/devices/export", params={"format": "csv", "location": "不存在"})
+        assert response.content.decode("utf-8-sig").strip() == ",".join(expected[0].keys())
+        assert client.get("/api/devices/export", params={"format": "xml"}).status_code == 422
+
+
+def start_server(port, log_dir):
+    env = dict(os.environ, IOT_LOG_DIR=log_dir)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT_DIR, env=env
+    )
+    import httpx
+    for _ in range(200):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/cache-stats", timeout=0.5)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("服务启动失败")
+
+
+def peak_rss_mb(pid):
+    """进程的峰值常驻内存（VmHWM）"""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def main():
+    import httpx
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    test_export_formats()
+    print("导出内容测试通过")
+
+    # 在本进程中写入设备后，再用同一个数据目录启动服务
+    from dao.device_info import add_devices_bulk
+    for start in range(2500, count, 5000):
+        add_devices_bulk(make_devices(start, min(5000, count - start)))
+    print(f"已写入 {count:,} 个设备")
+
+    port = 55617
+    proc = start_server(port, os.environ["IOT_LOG_DIR"])
+    try:
+        print(f"启动后峰值内存: {peak_rss_mb(proc.pid):.0f} MB")
+        print(f"{'方式':<22}{'大小(MB)':>10}{'耗时(秒)':>10}{'行/秒':>12}{'峰值内存(MB)':>14}")
+        cases = (
+            ("NDJSON 流式", "/api/devices/export", {}),
+            ("CSV 流式", "/api/devices/export", {"format": "csv"}),
+            ("NDJSON 流式 + gzip", "/api/devices/export", {"gzip": "true"}),
+            ("GET /api/devices 全量", "/api/devices", {}),     # 一次性构造全部结果，放在最后
+        )
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=600) as client:
+            for name, path, params in cases:
+                size = 0
+                start = time.perf_counter()
+                with client.stream("GET", path, params=params) as response:
+                    for chunk in response.iter_raw():
+                        size += len(chunk)
+                elapsed = time.perf_counter() - start
+                print(f"{name:<22}{size / 1e6:>10.1f}{elapsed:>10.1f}{count / elapsed:>12,.0f}{peak_rss_mb(proc.pid):>14.0f}")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+if __name__ == "__main__":
+
+    main()
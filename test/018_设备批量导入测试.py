@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 设备批量导入测试：验证 CSV/NDJSON（含 gzip）导入按 MAC 地址新增或更新、逐行返回校验错误、导出的文件可以原样导入，
+# 导入中断后用同一个任务ID续传得到与一次导入相同的结果；并测量 100 万行文件首次导入和重复导入（全部未变化）的吞吐量
+#
+# 用法: python test/018_设备批量导入测试.py [行数，默认 1000000]
+#   或: pytest test/018_设备批量导入测试.py（只运行功能测试）
+
+import io
+import os
+import sys
+import csv
+import json
+import time
+import tempfile
+import threading
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.device_import import import_devices
+from sqlalchemy import event
+from dao.device_info import (get_device_by_mac, get_import_checkpoint, validate_import_record, import_devices_chunk,
+                             engine_device)
+from utils.mac import normalize_mac
+
+
+def make_rows(start, count, prefix="AF", tag="import"):
+    return [{
+        "mac_address": f"{prefix}-{i >> 24 & 0xFF:02X}-{i >> 16 & 0xFF:02X}-{i >> 8 & 0xFF:02X}-{i & 0xFF:02X}-24".lower(),
+        "device_name": f"{tag}_{i}",
+        "device_type": ("temperature", "humidity", "relay")[i % 3],
+        "location": f"站点_{i % 50}",
+        "description": "导入测试, 含逗号" if i % 2 else "",
+        "install_date": "2024-05-01T08:30:00" if i % 3 == 0 else "",
+        "status": "active",
+    } for i in range(start, start + count)]
+
+
+def to_ndjson(rows):
+    return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+
+
+def to_csv(rows):
+    buffer = io.StringIO()
+    buffer.write("﻿")
+    writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+class BrokenFile(io.RawIOBase):
+    """读到 limit 字节后模拟连接中断"""
+
+    def __init__(self, data, limit):
+        self._data = io.BytesIO(data)
+        self._limit = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._data.tell() >= self._limit:
+            raise ConnectionResetError("上传中断")
+        chunk = self._data.read(min(len(buffer), self._limit - self._data.tell()))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def test_import_validation_and_upsert():
+    rows = make_rows(0, 300)
+    rows[10]["mac_address"] = "not-a-mac"
+    rows[20]["device_name"] = ""
+    rows[30]["status"] = "broken"
+    rows[40]["device_name"] = rows[41]["device_name"]      # 与后一行的设备名称冲突
+    data = to_ndjson(rows[:150]) + b"\n{bad json\n" + to_ndjson(rows[150:])
+
+    summary = import_devices("validate-1", io.BytesIO(data), "ndjson", chunk_size=64)
+    assert summary["rows_done"] == 302 and summary["completed"]
+    assert summary["inserted"] == 296 and summary["failed"] == 5
+    assert [e["row"] for e in summary["errors"]] == [11, 21, 31, 42, 152]
+    assert "已被设备" in summary["errors"][3]["error"] and summary["errors"][3]["mac_address"] == "AF:00:00:00:29:24"
+
+    device = get_device_by_mac("AF:00:00:00:00:24")
+    assert device["location"] == "站点_0" and device["install_date"] == "2024-05-01T08:30:00"
+    assert device["description"] is None and device["status"] == "active"
+
+    # 同一个任务已完成时直接返回断点；新任务按 MAC 地址更新有变化的设备
+    assert import_devices("validate-1", io.BytesIO(data), "ndjson")["inserted"] == 296
+    rows[0]["location"] = "新站点"
+    rows[1]["status"] = "MAINTENANCE"
+    summary = import_devices("validate-2", io.BytesIO(to_csv(rows)), "csv", chunk_size=100)
+    assert (summary["inserted"], summary["updated"], summary["unchanged"]) == (0, 2, 294)
+    assert get_device_by_mac("AF:00:00:00:00:24")["location"] == "新站点"
+    assert get_device_by_mac("AF:00:00:00:01:24")["status"] == "maintenance"
+
+
+def test_non_string_fields_are_reported():
+    rows = make_rows(500, 8, tag="types")
+    rows[0]["device_name"] = 123
+    rows[1]["device_type"] = ["temperature"]
+    rows[2]["location"] = {"room": 1}
+    rows[3]["description"] = 3.5
+    rows[4]["status"] = ["active"]
+    rows[5]["install_date"] = 20240501
+    summary = import_devices("types-1", io.BytesIO(to_ndjson(rows)), "ndjson")
+    assert summary["completed"] and (summary["inserted"], summary["failed"]) == (2, 6)
+    assert [e["row"] for e in summary["errors"]] == [1, 2, 3, 4, 5, 6]
+    assert "必须是字符串" in summary["errors"][0]["error"] and "必须是字符串" in summary["errors"][3]["error"]
+    assert get_device_by_mac(normalize_mac(rows[6]["mac_address"]))["device_name"] == "types_506"
+
+
+def test_concurrent_first_chunks():
+    """同一个任务的第一块被并发提交：后写入断点的一方得到进度不一致的 ValueError（接口返回 409），而不是唯一约束冲突"""
+    device, _ = validate_import_record(make_rows(600, 1, tag="race")[0])
+    racing = []
+
+    def run_other_first(conn, cursor, statement, parameters, context, executemany):
+        # 在本方写入断点之前，另一个线程完整地处理同一个任务的第一块
+        if not racing and statement.startswith("INSERT") and "device_imports" in statement:
+            racing.append(threading.Thread(target=import_devices_chunk, args=("race-1", "csv", 0, 1, [(1, device)])))
+            racing[0].start()
+            racing[0].join()
+
+    event.listen(engine_device, "before_cursor_execute", run_other_first)
+    try:
+        import_devices_chunk("race-1", "csv", 0, 1, [(1, device)])
+        assert False, "进度不一致时应当拒绝"
+    except ValueError as e:
+        assert "不一致" in str(e)
+    finally:
+        event.remove(engine_device, "before_cursor_execute", run_other_first)
+    assert racing and get_import_checkpoint("race-1")["rows_done"] == 1
+    assert get_device_by_mac(device["mac_address"])["device_name"] == "race_600"
+
+
+def test_resume_after_interruption():
+    rows = make_rows(1000, 2000, prefix="B0", tag="resume")
+    data = to_csv(rows)
+
+    try:
+        import_devices("resume-1", BrokenFile(data, len(data) // 2), "csv", chunk_size=250)
+        assert False, "应当抛出中断异常"
+    except ConnectionResetError:
+        pass
+    checkpoint = get_import_checkpoint("resume-1")
+    assert not checkpoint["completed"] and checkpoint["rows_done"] % 250 == 0 and checkpoint["rows_done"] > 0
+    assert checkpoint["inserted"] == checkpoint["rows_done"]
+    assert get_device_by_mac(rows[checkpoint["rows_done"]]["mac_address"]) is None
+
+    # 续传跳过已提交的行，结果与一次导入相同
+    summary = import_devices("resume-1", io.BytesIO(data), "csv", chunk_size=250)
+    assert summary["completed"] and summary["rows_done"] == 2000
+    assert (summary["inserted"], summary["updated"], summary["unchanged"], summary["failed"]) == (2000, 0, 0, 0)
+    try:
+        import_devices("resume-1", io.BytesIO(data), "ndjson")
+        assert False, "格式不一致时应当拒绝续传"
+    except ValueError:
+        pass
+
+
+def test_export_import_roundtrip():
+    from fastapi.testclient import TestClient
+    from server import app
+
+    with TestClient(app) as client:
+        exported = client.get("/api/devices/export", params={"format": "csv", "gzip": "true"}).content
+        total = len(client.get("/api/devices").json())
+
+        response = client.post("/api/devices/import", params={"import_id": "roundtrip"}, content=exported,
+                               headers={"Content-Type": "text/csv"})
+        assert response.status_code == 200
+        result = response.json()
+        assert result["status"] == "success" and result["unchanged"] == result["rows_done"] == total
+
+        assert client.get("/api/devices/import/roundtrip").json()["completed"] is True
+        assert client.get("/api/devices/import/missing").status_code == 404
+        response = client.post("/api/devices/import", params={"import_id": "roundtrip", "format": "ndjson"}, content=b"")
+        assert response.status_code == 409
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    test_import_validation_and_upsert()
+    test_non_string_fields_are_reported()
+    test_concurrent_first_chunks()
+    test_resume_after_interruption()
+    test_export_import_roundtrip()
+    print("功能测试通过")
+
+    from config import IMPORT_CHUNK_SIZE
+    with tempfile.TemporaryDirectory() as tmp:
+        files = {}
+        for name, encode in (("ndjson", to_ndjson), ("csv", to_csv)):
+            path = os.path.join(tmp, f"devices.{name}")
+            with open(path, "wb") as f:
+                for start in range(0, count, 100000):
+                    chunk = encode(make_rows(start, min(100000, count - start), prefix="C0" if name == "csv" else "C1",
+                                             tag=f"bench_{name}"))
+                    if start and name == "csv":
+                        chunk = chunk.split(b"\n", 1)[1]        # 只保留第一个表头
+                    f.write(chunk)
+            files[name] = path
+        print(f"{count:,} 行，每块 {IMPORT_CHUNK_SIZE} 行")
+        print(f"{'文件':<10}{'导入':<10}{'大小(MB)':>10}{'耗时(秒)':>10}{'行/秒':>12}")
+        for name, path in files.items():
+            for run in ("首次", "重复"):
+                start = time.perf_counter()
+                with open(path, "rb") as f:
+                    summary = import_devices(f"bench-{name}-{run}", f, name, chunk_size=IMPORT_CHUNK_SIZE)
+                elapsed = time.perf_counter() - start
+                assert summary["rows_done"] == count and summary["failed"] == 0
+                print(f"{name:<10}{run:<10}{os.path.getsize(path) / 1e6:>10.1f}{elapsed:>10.1f}{count / elapsed:>12,.0f}")
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# MAC 地址规范化测试：验证 normalize_mac、normalize_many 和 48 位整数键在随机输入上与原来的正则实现结果一致，
+# 创建设备接口接受各种写法并统一保存为规范形式；并对比原实现、normalize_mac（未命中/命中缓存）和 normalize_many 的每个 MAC 耗时
+#
+# 用法: python test/019_MAC地址规范化测试.py [MAC 数，默认 1000000]
+#   或: pytest test/019_MAC地址规范化测试.py（只运行一致性测试）
+
+import os
+import re
+import sys
+import time
+import random
+import tempfile
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from utils.mac import normalize_mac, normalize_many, mac_to_int, int_to_mac, mac_cache_stats, MAC_KEY_MAX
+
+
+def legacy_validate_mac_address(mac_address):
+    """原来 dao/device_info.py 中的实现，每次调用按字符串模式 re.match"""
+    if not mac_address or not isinstance(mac_address, str):
+        return None
+    mac_address = mac_address.strip()
+    if re.match(r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$', mac_address):
+        return mac_address.replace('-', ':').upper()
+    if re.match(r'^[0-9A-Fa-f]{12}$', mac_address):
+        return ':'.join(mac_address[i:i+2] for i in range(0, 12, 2)).upper()
+    return None
+
+
+def random_inputs(count, seed=25):
+    """合法的各种写法，以及替换了一个字符、加了空白和随机字符的输入"""
+    rng = random.Random(seed)
+    hex_chars = "0123456789abcdefABCDEF"
+    noise = hex_chars + "gG:- \n"
+    inputs = []
+    for _ in range(count):
+        if rng.random() < 0.6:
+            octets = ["".join(rng.choice(hex_chars) for _ in range(2)) for _ in range(6)]
+            value = rng.choice([":", "-", ""]).join(octets)
+            if rng.random() < 0.3:
+                i = rng.randrange(len(value))
+                value = value[:i] + rng.choice(noise) + value[i + 1:]
+            if rng.random() < 0.2:
+                value = f" {value}\n"
+        else:
+            value = "".join(rng.choice(noise) for _ in range(rng.choice((5, 12, 13, 17, 18))))
+        inputs.append(value)
+    return inputs
+
+
+def test_normalize_mac_matches_legacy():
+    inputs = random_inputs(20000) + ["", "AA-BB:CC-DD:EE-FF", "AA:BB:CC:DD:EE:FF\n", "aabbccddeeff", "AA:BB:CC:DD:EE:F$"]
+    assert [normalize_mac(v) for v in inputs] == [legacy_validate_mac_address(v) for v in inputs]
+    # 原来的函数名仍然可以从 dao.device_info 导入
+    from dao.device_info import validate_mac_address
+    assert [validate_mac_address(v) for v in inputs[:1000]] == [legacy_validate_mac_address(v) for v in inputs[:1000]]
+    assert normalize_mac(" aa-bb-cc-dd-ee-0f ") == "AA:BB:CC:DD:EE:0F"
+    for value in (None, 12, b"AA:BB:CC:DD:EE:FF", ["AA:BB:CC:DD:EE:FF"], "AA:BB:CC:DD:EE:FF" + " " * 100):
+        assert normalize_mac(value) is None
+
+    # 按原始输入缓存，同一种写法第二次规范化时命中
+    before = mac_cache_stats()["hits"]
+    normalize_mac(" aa-bb-cc-dd-ee-0f ")
+    assert mac_cache_stats()["hits"] == before + 1
+
+
+def test_normalize_many_matches_scalar():
+    inputs = random_inputs(20000, seed=26)
+    expected = [normalize_mac(v) or "" for v in inputs]
+    assert normalize_many(inputs).tolist() == expected
+    assert normalize_many(np.array(inputs)).tolist() == expected
+    assert normalize_many(np.array(inputs, dtype=object)).tolist() == expected
+    assert normalize_many(np.array([v.encode("latin-1") for v in inputs])).tolist() == expected
+
+    keys = normalize_many(inputs, as_int=True)
+    assert keys.dtype == np.int64
+    assert keys.tolist() == [mac_to_int(v) if v else -1 for v in expected]
+
+    assert normalize_many(np.array([["aabbccddeeff", None]], dtype=object)).tolist() == [["AA:BB:CC:DD:EE:FF", ""]]
+    assert normalize_many([]).shape == (0,)
+
+
+def test_int_key_roundtrip():
+    assert mac_to_int("00:00:00:00:00:00") == 0
+    assert mac_to_int("ff-ff-ff-ff-ff-ff") == MAC_KEY_MAX
+    assert int_to_mac(mac_to_int("aabbccddee0f")) == "AA:BB:CC:DD:EE:0F"
+    assert mac_to_int("not a mac") is None
+    for key in (-1, MAC_KEY_MAX + 1):
+        try:
+            int_to_mac(key)
+            assert False, "超出 48 位范围时应当抛出异常"
+        except ValueError:
+            pass
+
+
+def test_create_device_normalizes_mac():
+    from fastapi.testclient import TestClient
+    from server import app
+
+    with TestClient(app) as client:
+        response = client.post("/api/devices", json={"mac_address": " aa-bb-cc-00-25-01 ", "device_name": "mac_test",
+                                                     "device_type": "temperature", "status": "active"})
+        assert response.status_code == 200, response.text
+        assert client.get("/api/devices/aabbcc002501").json()["mac_address"] == "AA:BB:CC:00:25:01"
+        response = client.post("/api/devices", json={"mac_address": "AA:BB:CC:00:25", "device_name": "mac_test_2",
+                                                     "device_type": "temperature", "status": "active"})
+        assert response.status_code == 422
+        assert "mac_cache" in client.get("/api/cache-stats").json()
+
+
+def per_mac_ns(func, count):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) / count * 1e9
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    test_normalize_mac_matches_legacy()
+    test_normalize_many_matches_scalar()
+    test_int_key_roundtrip()
+    test_create_device_normalizes_mac()
+    print("一致性测试通过")
+
+    from utils.mac import _normalize
+    canonical = [f"AE:{i >> 24 & 0xFF:02X}:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}:25" for i in range(count)]
+    dashed = [mac.lower().replace(":", "-") for mac in canonical]
+    # 心跳等入口反复上报同一批设备：1 万个设备循环出现
+    repeated = canonical[:10000] * (count // 10000)
+
+    print(f"{count:,} 个 MAC 地址，每个的耗时（纳秒）")
+    print(f"{'输入':<22}{'原实现':>10}{'normalize_mac':>16}{'normalize_many':>16}")
+    for name, inputs in (("规范形式，各不相同", canonical), ("小写短横线，各不相同", dashed), ("规范形式，1万个重复", repeated)):
+        _normalize.cache_clear()
+        legacy = per_mac_ns(lambda: [legacy_validate_mac_address(v) for v in inputs], len(inputs))
+        scalar = per_mac_ns(lambda: [normalize_mac(v) for v in inputs], len(inputs))
+        array = np.array(inputs)
+        batch = per_mac_ns(lambda: normalize_many(array), len(inputs))
+        print(f"{name:<22}{legacy:>10.0f}{scalar:>16.0f}{batch:>16.0f}")
+    print(f"缓存: {mac_cache_stats()}")
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 遥测预聚合一致性测试：同一 (设备, 指标, 时间戳) 重复上报（数值相同的重投、数值不同的覆盖、同一批内的重复）后，
+# 1m/1h/1d 各粒度的 count/sum/min/max 必须与从原始表直接汇总的结果一致；并测量含 10% 重投时的写入吞吐
+#
+# 用法: python test/020_遥测预聚合一致性测试.py
+#   或: pytest test/020_遥测预聚合一致性测试.py
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from dao.database import session_scope
+from dao.telemetry import add_reading_rows, get_readings, ROLLUP_TIERS, engine_telemetry
+
+START_MS = 1700000000000
+
+
+def rollups_from_raw(device_mac, metric):
+    """从原始表直接汇总的各粒度 {(tier, bucket_ts): (count, sum, min, max)}"""
+    result = {}
+    with session_scope(engine_telemetry) as session:
+        for tier, bucket_ms in ROLLUP_TIERS:
+            rows = session.execute(text(
+                "SELECT ts - ts % :ms AS bucket, COUNT(*), SUM(value), MIN(value), MAX(value) FROM readings "
+                "WHERE device_mac = :mac AND metric = :metric GROUP BY bucket"
+            ), {'ms': bucket_ms, 'mac': device_mac, 'metric': metric})
+            result.update({(tier, bucket): tuple(values) for bucket, *values in rows})
+    return result
+
+
+def stored_rollups(device_mac, metric):
+    with session_scope(engine_telemetry) as session:
+        rows = session.execute(text(
+            "SELECT tier, bucket_ts, count, sum, min, max FROM reading_rollups WHERE device_mac = :mac AND metric = :metric"
+        ), {'mac': device_mac, 'metric': metric})
+        return {(tier, bucket): tuple(values) for tier, bucket, *values in rows}
+
+
+def assert_rollups_match(device_mac, metric):
+    expected = rollups_from_raw(device_mac, metric)
+    actual = stored_rollups(device_mac, metric)
+    assert actual.keys() == expected.keys()
+    for key, (count, total, low, high) in expected.items():
+        assert actual[key][0] == count and abs(actual[key][1] - total) < 1e-6 and actual[key][2:] == (low, high), key
+
+
+def test_duplicate_readings_keep_rollups_consistent():
+    mac, metric = "AA:00:00:00:20:01", "temperature"
+    rows = [(mac, metric, START_MS + i * 20000, 20.0 + i % 7) for i in range(500)]
+    add_reading_rows(rows)
+    assert_rollups_match(mac, metric)
+    before = stored_rollups(mac, metric)
+
+    # 数值相同的重投：原始表和预聚合都不变
+    add_reading_rows(rows[100:300])
+    assert stored_rollups(mac, metric) == before
+
+    # 数值不同的覆盖：包括把某个时间桶的极值改小/改大，以及同一批内同一时间戳出现多次（以最后一次为准）
+    changed = [(mac, metric, START_MS + i * 20000, 100.0 + i) for i in range(0, 500, 50)]
+    changed += [(mac, metric, START_MS + 20000, -5.0), (mac, metric, START_MS + 20000, 3.5)]
+    add_reading_rows(changed + [(mac, metric, START_MS + 10, 1.0)])
+    assert_rollups_match(mac, metric)
+    assert get_readings(mac, metric, START_MS + 20000, START_MS + 20001) == [(START_MS + 20000, 3.5)]
+    assert len(get_readings(mac, metric)) == 501
+
+    # 覆盖后极值被替换掉的时间桶，min/max 也回到新的数据
+    add_reading_rows([(mac, metric, ts, 20.0) for _, _, ts, _ in changed])
+    assert_rollups_match(mac, metric)
+    days = [values for (tier, _), values in stored_rollups(mac, metric).items() if tier == "1d"]
+    assert sum(day[0] for day in days) == 501 and max(day[3] for day in days) < 100
+
+
+def test_redelivery_through_telemetry_api():
+    from fastapi.testclient import TestClient
+    from server import app
+
+    mac, metric = "AA:00:00:00:20:02", "humidity"
+    body = [{"mac_address": mac, "metric": metric, "value": 40 + i, "ts": START_MS / 1000 + i * 90} for i in range(100)]
+    with TestClient(app) as client:
+        for _ in range(3):
+            assert client.post("/api/telemetry", json=body).json()["accepted"] == 100
+        response = client.get(f"/api/devices/{mac}/readings", params={
+            "metric": metric, "start": START_MS / 1000, "end": START_MS / 1000 + 86400, "resolution": "1h"
+        })
+        assert response.status_code == 200, response.text
+    assert_rollups_match(mac, metric)
+    assert sum(count for (tier, _), (count, *_) in stored_rollups(mac, metric).items() if tier == "1h") == 100
+
+
+def main():
+    test_duplicate_readings_keep_rollups_consistent()
+    test_redelivery_through_telemetry_api()
+    print("一致性测试通过")
+
+    rng = random.Random(20)
+    devices, batches, batch_size = 1000, 20, 10000
+    sent = []
+    elapsed = 0.0
+    for batch in range(batches):
+        rows = [(f"AC:00:00:00:{i % devices // 256:02X}:{i % devices % 256:02X}", "temperature",
+                 START_MS + (batch * batch_size + i) // devices * 1000, 20.0 + i % 100 / 10) for i in range(batch_size)]
+        # 10% 是之前已经写过的数据点的重投
+        redelivered = rng.sample(sent, min(len(sent), batch_size // 10))
+        start = time.perf_counter()
+        add_reading_rows(rows + redelivered)
+        elapsed += time.perf_counter() - start
+        sent.extend(rows)
+    total = batches * batch_size
+    print(f"含 10% 重投: {total} 个新数据点, {elapsed:.2f} s, {total / elapsed:,.0f} 点/秒")
+    assert_rollups_match("AC:00:00:00:00:00", "temperature")
+
+
+if __name__ == "__main__":
+
+    main()
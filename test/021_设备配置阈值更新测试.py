@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 设备配置阈值更新测试：验证更新时未给出的字段保持不变、显式给出 null 的阈值被清除，
+# 只更新一侧阈值时与库中另一侧比较上下限，违反时不做任何修改；报警引擎随之使用新的阈值
+#
+# 用法: python test/021_设备配置阈值更新测试.py
+#   或: pytest test/021_设备配置阈值更新测试.py
+
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("IOT_LOG_DIR", tempfile.mkdtemp())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from server import app, alarm_engine
+
+MAC = "AA:BB:CC:00:21:01"
+
+
+def test_update_thresholds():
+    with TestClient(app) as client:
+        response = client.post("/api/sensor-configs", json={
+            "device_mac": MAC, "report_interval": 30, "alarm_threshold_min": 10, "alarm_threshold_max": 30,
+            "updated_by": "tester"
+        })
+        assert response.json()["status"] == "success", response.text
+
+        def config():
+            return client.get(f"/api/sensor-configs/{MAC}").json()
+
+        # 只给出一侧：另一侧和其它字段不变
+        assert client.put(f"/api/sensor-configs/{MAC}", json={"alarm_threshold_max": 40}).status_code == 200
+        assert (config()["alarm_threshold_min"], config()["alarm_threshold_max"], config()["updated_by"]) == (10, 40, "tester")
+
+        # 与库中的下限比较，违反时整个更新都不生效
+        response = client.put(f"/api/sensor-configs/{MAC}", json={"alarm_threshold_max": 5, "report_interval": 90})
+        assert response.status_code == 400 and "不能小于下限" in response.json()["error"]
+        assert (config()["alarm_threshold_max"], config()["report_interval"]) == (40, 30)
+        response = client.put(f"/api/sensor-configs/{MAC}", json={"alarm_threshold_min": 50})
+        assert response.status_code == 400
+        # 同时给出两侧时由请求模型检查
+        response = client.put(f"/api/sensor-configs/{MAC}", json={"alarm_threshold_min": 50, "alarm_threshold_max": 45})
+        assert response.status_code == 422
+
+        # 显式 null 清除阈值，之后另一侧可以任意取值
+        assert client.put(f"/api/sensor-configs/{MAC}", json={"alarm_threshold_min": None}).status_code == 200
+        assert (config()["alarm_threshold_min"], config()["alarm_threshold_max"]) == (None, 40)
+        assert client.put(f"/api/sensor-configs/{MAC}", json={"alarm_threshold_max": -100}).status_code == 200
+        assert client.put(f"/api/sensor-configs/{MAC}", json={"alarm_threshold_max": None, "updated_by": None}).status_code == 200
+        assert (config()["alarm_threshold_max"], config()["updated_by"], config()["report_interval"]) == (None, None, 30)
+
+        # 上报间隔不能清除
+        assert client.put(f"/api/sensor-configs/{MAC}", json={"report_interval": None}).status_code == 422
+        assert client.put(f"/api/sensor-configs/{MAC}", json={}).json()["info"] == "未修改任何内容"
+        assert client.put("/api/sensor-configs/AA:BB:CC:00:21:FF", json={"alarm_threshold_min": None}).status_code == 404
+
+    # 阈值全部清除后不再报警
+    assert alarm_engine.evaluate([MAC], ["temperature"], [1000.0]) == []
+
+
+if __name__ == "__main__":
+
+    test_update_thresholds()
+    print("测试通过")
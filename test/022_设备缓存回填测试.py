@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 设备缓存回填测试：验证读数据库期间发生失效时，同一设备的旧数据不会被回填，
+# 其它分片中设备的并发回填不受影响；clear 之后之前取得的 generation 全部作废
+#
+# 用法: python test/022_设备缓存回填测试.py
+#   或: pytest test/022_设备缓存回填测试.py
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dao.cache import LRUCache
+
+MAC = "AA:BB:CC:00:22:01"
+
+
+def test_concurrent_fills():
+    cache = LRUCache(maxsize=100, ttl=60, shards=256)
+    # 字符串哈希每个进程不同，挑一个与 MAC 不在同一分片的设备
+    other = next(mac for mac in (f"AA:BB:CC:00:22:{i:02X}" for i in range(2, 256))
+                 if hash(mac) % 256 != hash(MAC) % 256)
+
+    hit, _, generation = cache.get(MAC)
+    _, _, other_generation = cache.get(other)
+    assert not hit
+    # 两个设备都在读数据库时，MAC 被修改并失效
+    cache.invalidate(MAC)
+    cache.set(MAC, "旧数据", generation)
+    cache.set(other, "其它设备", other_generation)
+    assert cache.get(MAC)[0] is False
+    assert cache.get(other)[:2] == (True, "其它设备")
+
+    # 失效之后重新读取的结果可以回填
+    _, _, generation = cache.get(MAC)
+    cache.set(MAC, "新数据", generation)
+    assert cache.get(MAC)[:2] == (True, "新数据")
+
+    # clear 让所有分片中进行中的回填作废
+    _, _, generation = cache.get("AA:BB:CC:00:22:FF")
+    cache.clear()
+    cache.set("AA:BB:CC:00:22:FF", "旧数据", generation)
+    assert cache.get("AA:BB:CC:00:22:FF")[0] is False
+
+
+if __name__ == "__main__":
+
+    test_concurrent_fills()
+    print("测试通过")
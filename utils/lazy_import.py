@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import importlib
+import threading
+
+class LazyModule:
+    """模块代理对象，第一次访问属性时才真正导入模块
+
+    用于 numpy、scipy、redis 等只有部分功能才需要的重量级依赖，
+    避免每个 worker 启动时都为这些模块付出导入耗时和常驻内存
+    """
+
+    def __init__(self, module_name):
+        self.__dict__['_module_name'] = module_name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with self.__dict__['_lock']:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self.__dict__['_module_name'])
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__['_module'] is not None else "not loaded"
+        return f"<LazyModule '{self.__dict__['_module_name']}' ({state})>"
+
+def lazy_import(module_name):
+    """延迟导入模块，已经导入过的模块直接返回
+
+    示例:
+        np = lazy_import("numpy")
+        signal = lazy_import("scipy.signal")
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    return LazyModule(module_name)
+
+def is_loaded(module_name):
+    """模块是否已经被真正导入"""
+    return module_name in sys.modules
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+import contextvars
+import logging.handlers
+
+# 当前请求的关联 ID，由 RequestLogMiddleware 设置，run_in_db 会把它带到数据库线程
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# LogRecord 自带的属性，其余通过 extra 传入的字段原样输出到 JSON 中
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "rate_key", "sample"}
+
+
+def get_logger(name):
+    """返回 iot 下的子 logger，例如 get_logger("dao.device_info")"""
+    return logging.getLogger(f"iot.{name}")
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行 JSON：时间、级别、logger、消息、请求 ID、extra 字段和异常堆栈"""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key != "request_id":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_type"] = record.exc_info[0].__name__
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """同一错误在 window 秒内最多输出 burst 条，其余丢弃并计数
+
+    同一错误指 logger、级别、代码位置和异常类型都相同（也可以通过 extra={"rate_key": ...} 指定），
+    与消息参数无关；窗口结束后的第一条日志带上 suppressed 字段，说明这期间丢弃了多少条。
+    只限制 WARNING 及以上级别，INFO 由采样控制。
+    """
+
+    def __init__(self, burst=5, window=60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._windows = {}  # key -> [窗口开始时间, 已输出条数, 已丢弃条数]
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        key = getattr(record, "rate_key", None)
+        if key is None:
+            key = (record.name, record.levelno, record.pathname, record.lineno,
+                   record.exc_info[0] if record.exc_info else None)
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                if len(self._windows) > 10000:
+                    self._windows.clear()
+                suppressed = state[2] if state else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            self.suppressed += 1
+            return False
+
+
+class SamplingFilter(logging.Filter):
+    """按比例采样标记了 extra={"sample": True} 的日志（请求成功的访问日志等），其它日志不受影响"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, "sample", False) and self.rate < 1.0:
+            return random.random() < self.rate
+        return True
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """只把日志放进队列，格式化和写出由后台线程完成；队列满时丢弃而不是阻塞调用方"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 调用方线程只做消息参数的替换，异常堆栈的格式化留给后台线程
+        record.msg = record.getMessage()
+        record.args = None
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _LogState:
+    handler = None
+    listener = None
+    rate_limit = None
+    sampling = None
+
+_state = _LogState()
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level="INFO", sample_rate=1.0, rate_limit=5, rate_window=60.0, queue_size=10000, stream=None):
+    """给 iot logger 安装队列 handler 并启动后台写出线程，重复调用只更新级别和采样/限流参数
+
+    Args:
+        sample_rate: 标记为 sample 的成功日志的保留比例，0 为全部丢弃
+        rate_limit: 同一错误每 rate_window 秒最多输出的条数，0 为不限制
+        stream: 输出流，默认 stderr（与 uvicorn 的日志一致，由 journald 收集）
+    """
+    root = logging.getLogger("iot")
+    root.setLevel(level)
+    with _setup_lock:
+        if _state.handler is not None:
+            _state.sampling.rate = sample_rate
+            _state.rate_limit.burst = rate_limit
+            _state.rate_limit.window = rate_window
+            return
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter())
+        _state.sampling = SamplingFilter(sample_rate)
+        _state.rate_limit = RateLimitFilter(rate_limit, rate_window)
+        _state.handler = _NonBlockingQueueHandler(queue.Queue(queue_size))
+        _state.handler.addFilter(_state.sampling)
+        _state.handler.addFilter(_state.rate_limit)
+        _state.listener = logging.handlers.QueueListener(_state.handler.queue, output)
+        _state.listener.start()
+        root.addHandler(_state.handler)
+        root.propagate = False
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    with _setup_lock:
+        if _state.handler is None:
+            return
+        logging.getLogger("iot").removeHandler(_state.handler)
+        _state.listener.stop()
+        _state.handler = _state.listener = None
+
+
+def log_stats():
+    """队列积压、队列满丢弃和限流丢弃的日志条数"""
+    if _state.handler is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "queued": _state.handler.queue.qsize(),
+        "dropped": _state.handler.dropped,
+        "rate_limited": _state.rate_limit.suppressed,
+        "sample_rate": _state.sampling.rate,
+    }
+
+
+class RequestLogMiddleware:
+    """为每个请求分配关联 ID 并记录访问日志的 ASGI 中间件
+
+    关联 ID 取请求头 X-Request-ID（没有则生成），写入响应头并附加到该请求期间的所有日志；
+    状态码小于 400 的访问日志按采样比例输出，4xx/5xx 总是输出（同一路由和状态码受限流控制）。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = get_logger("access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        if not request_id:
+            request_id = random.getrandbits(64).to_bytes(8, "big").hex()
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "<unmatched>"
+            duration_ms = round((time.perf_counter() - start) * 1000, 2)
+            fields = {"method": scope["method"], "path": scope["path"], "route": route,
+                      "status": status_code, "duration_ms": duration_ms}
+            if status_code < 400:
+                self.logger.info("request", extra={**fields, "sample": True})
+            else:
+                self.logger.warning("request", extra={**fields, "rate_key": (route, status_code)})
+            request_id_var.reset(token)
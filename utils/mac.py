@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import binascii
+import functools
+from config import MAC_CACHE_SIZE
+from utils.lazy_import import lazy_import
+
+# 只有批量规范化才需要 numpy，按需导入
+np = lazy_import("numpy")
+
+# 超过该长度的输入直接判为非法，不进入缓存
+_MAX_INPUT_LENGTH = 64
+
+# 规范形式中分隔符和十六进制数字的位置
+_SEPARATOR_COLUMNS = (2, 5, 8, 11, 14)
+_HEX_COLUMNS = (0, 1, 3, 4, 6, 7, 9, 10, 12, 13, 15, 16)
+
+MAC_KEY_MAX = (1 << 48) - 1
+
+
+@functools.lru_cache(maxsize=MAC_CACHE_SIZE)
+def _normalize(mac_address):
+    """规范化一个字符串形式的 MAC 地址，非法时返回 None；结果由 lru_cache 按原始输入缓存
+
+    不用正则：binascii.unhexlify 只接受十六进制数字（不接受空白和符号），用它检查 12 位数字
+    """
+    mac_address = mac_address.strip()
+    if len(mac_address) == 17:
+        # AA:BB:CC:DD:EE:FF 或 AA-BB-CC-DD-EE-FF：分隔符统一为冒号后只需检查分隔符位置和其余 12 位
+        mac_address = mac_address.replace('-', ':')
+        hex_digits = mac_address.replace(':', '')
+        if len(hex_digits) != 12 or mac_address[2::3] != ':::::':
+            return None
+        try:
+            binascii.unhexlify(hex_digits)
+        except (binascii.Error, ValueError):
+            return None
+        return mac_address.upper()
+
+    if len(mac_address) == 12:
+        # AABBCCDDEEFF
+        try:
+            return binascii.unhexlify(mac_address).hex(':').upper()
+        except (binascii.Error, ValueError):
+            return None
+    return None
+
+def normalize_mac(mac_address):
+    """
+    验证并规范化 MAC 地址格式
+    支持常见格式: AA:BB:CC:DD:EE:FF、AA-BB-CC-DD-EE-FF 或 AABBCCDDEEFF，允许首尾空格
+    返回值：
+        如果合法 -> 返回规范化后的 MAC（大写、冒号分隔）
+        如果非法 -> 返回 None
+    """
+    if not mac_address or not isinstance(mac_address, str) or len(mac_address) > _MAX_INPUT_LENGTH:
+        return None
+    return _normalize(mac_address)
+
+def mac_cache_stats():
+    """规范化缓存的统计信息，用于调整 IOT_MAC_CACHE_SIZE"""
+    info = _normalize.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_ratio": info.hits / lookups if lookups else 0.0
+    }
+
+def mac_to_int(mac_address):
+    """MAC 地址转换为 48 位整数键，可以存为 SQLite 的 INTEGER（最多 8 字节）代替 17 个字符的文本；非法时返回 None"""
+    normalized = normalize_mac(mac_address)
+    if normalized is None:
+        return None
+    return int(normalized.replace(':', ''), 16)
+
+def int_to_mac(key):
+    """48 位整数键转换回规范化的 MAC 地址"""
+    if not 0 <= key <= MAC_KEY_MAX:
+        raise ValueError(f"MAC 地址整数键超出 48 位范围: {key}")
+    digits = f"{key:012X}"
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+def normalize_many(mac_addresses, as_int=False):
+    """批量规范化 MAC 地址，整批用 NumPy 的向量运算完成，不逐个调用 normalize_mac
+
+    Args:
+        mac_addresses: 字符串列表或 NumPy 字符串数组（str_ / bytes_ / object），支持的写法与 normalize_mac 相同
+        as_int: 为 True 时返回 48 位整数键
+
+    Returns:
+        numpy.ndarray: 与输入形状相同；默认为 '<U17' 数组，非法的位置为空字符串；
+        as_int 为 True 时为 int64 数组，非法的位置为 -1
+    """
+    values = np.asarray(mac_addresses)
+    shape = values.shape
+    if values.dtype.kind == 'S':
+        values = np.char.decode(values, 'latin-1')
+    elif values.dtype.kind != 'U':
+        values = np.array([v if isinstance(v, str) else '' for v in values.ravel()], dtype=str)
+    values = np.char.strip(values.ravel())
+    lengths = np.char.str_len(values)
+
+    # 每个字符串展开为 17 个 UCS4 码点，超过 17 个字符的已由长度判为非法；
+    # 只有 a-f 需要转成大写，直接在码点上减 32，比 np.char.upper 快一个数量级
+    codes = values.astype('<U17').view(np.uint32).reshape(-1, 17)
+    codes = np.where((codes >= ord('a')) & (codes <= ord('f')), codes - 32, codes)
+    separated = lengths == 17
+    bare = lengths == 12
+    digits = np.where(separated[:, None], codes[:, _HEX_COLUMNS], codes[:, :12])
+    separators = codes[:, _SEPARATOR_COLUMNS]
+
+    is_hex = ((digits >= ord('0')) & (digits <= ord('9'))) | ((digits >= ord('A')) & (digits <= ord('F')))
+    separators_ok = ((separators == ord(':')) | (separators == ord('-'))).all(axis=1)
+    valid = is_hex.all(axis=1) & ((separated & separators_ok) | bare)
+
+    if as_int:
+        nibbles = (digits - np.where(digits >= ord('A'), ord('A') - 10, ord('0'))).astype(np.int64)
+        keys = (nibbles << np.arange(44, -1, -4, dtype=np.int64)).sum(axis=1)
+        return np.where(valid, keys, -1).reshape(shape)
+
+    normalized = np.zeros((len(values), 17), dtype=np.uint32)
+    normalized[:, _SEPARATOR_COLUMNS] = ord(':')
+    normalized[:, _HEX_COLUMNS] = digits
+    normalized[~valid] = 0
+    return normalized.view('<U17').reshape(shape)